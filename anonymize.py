@@ -1,8 +1,22 @@
+import contextlib
 import csv
+import functools
+import logging
+import os
 import pathlib
 import random
+import shutil
+import tempfile
 
-import cplex
+try:
+    import cplex
+except ImportError:
+    cplex = None
+
+from common import mps_anonymizer
+from common import parallel
+
+JOURNAL_FILE = "journal.csv"
 
 
 def anonymize_problem(in_file_path, out_file_path, name, file_format="mps"):
@@ -15,7 +29,24 @@ def anonymize_problem(in_file_path, out_file_path, name, file_format="mps"):
     cpx.write(out_file_path, file_format)
 
 
-def rename_problem(cpx: cplex.Cplex, new_name):
+def anonymize_problem_streaming(in_file_path, out_file_path, name,
+                                mapping_file_path=None, rng=random,
+                                out_file=None, mapping_file=None):
+    """Same renaming as anonymize_problem, without CPLEX.
+
+    Streams the (free, possibly gzipped) MPS file line by line instead of
+    loading the model. If mapping_file_path is given, the original and new
+    row and column names are written there. If out_file (mapping_file) is
+    given, the bytes go there instead, out_file_path (mapping_file_path)
+    only naming them in the gzip header.
+    """
+    return mps_anonymizer.AnonymizeMps(in_file_path, out_file_path, str(name),
+                                       rng=rng, mapping_file=mapping_file_path,
+                                       out_fileobj=out_file,
+                                       mapping_fileobj=mapping_file)
+
+
+def rename_problem(cpx: "cplex.Cplex", new_name):
     cpx.set_problem_name(new_name)
 
 
@@ -32,37 +63,159 @@ def write_csv(d, f):
             writer.writerow([key, value])
 
 
-def rename_vars(cpx: cplex.Cplex, new_names=None):
+def rename_vars(cpx: "cplex.Cplex", new_names=None):
     num_vars = cpx.variables.get_num()
     if not new_names:
         new_names = list(map(str, permutation(num_vars)))
     cpx.variables.set_names(zip(range(num_vars), new_names))
 
 
-def rename_cols(cpx: cplex.Cplex, new_names=None):
+def rename_cols(cpx: "cplex.Cplex", new_names=None):
     num_constraints = cpx.linear_constraints.get_num()
     if not new_names:
         new_names = list(map(str, permutation(num_constraints)))
     cpx.linear_constraints.set_names(zip(range(num_constraints), new_names))
 
 
-def anonymize_all(in_dir, out_dir, file_ending="mps"):
-    all_files = list(pathlib.Path(in_dir).glob(f"*.{file_ending}"))
-    random.shuffle(all_files)
+def _temp_path(path):
+    # Keeps the file ending, from which CPLEX infers the compression.
+    path = pathlib.Path(path)
+    return path.with_name(f".tmp.{path.name}")
+
+
+def _anonymize_file(tasks, index):
+    """Anonymizes tasks[index] into temporary files, then renames them."""
+    (in_file_path, out_file_path, name, file_format, use_cplex,
+     mapping_file_path, file_seed) = tasks[index]
+    out_temp_path = _temp_path(out_file_path)
+    mapping_temp_path = mapping_file_path and _temp_path(mapping_file_path)
+    if use_cplex:
+        # CPLEX compresses the file itself, naming the gzip header after the
+        # file it writes: it writes the final name in a temporary directory.
+        temp_dir = tempfile.mkdtemp(prefix=".tmp.",
+                                    dir=os.path.dirname(out_file_path))
+        try:
+            cplex_path = os.path.join(temp_dir,
+                                      os.path.basename(out_file_path))
+            # anonymize_problem draws its permutations from the random module.
+            random.seed(file_seed)
+            anonymize_problem(in_file_path, cplex_path, name, file_format)
+            os.replace(cplex_path, out_temp_path)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    else:
+        # The temporary files are written through file objects, so that the
+        # gzip headers are named after the final files, as in
+        # common/output.WriteModel.
+        with contextlib.ExitStack() as stack:
+            out_file = stack.enter_context(open(out_temp_path, "wb"))
+            mapping_file = mapping_temp_path and stack.enter_context(
+                open(mapping_temp_path, "wb"))
+            anonymize_problem_streaming(in_file_path, out_file_path, name,
+                                        mapping_file_path,
+                                        random.Random(file_seed), out_file,
+                                        mapping_file)
+    if mapping_temp_path:
+        os.replace(mapping_temp_path, mapping_file_path)
+    os.replace(out_temp_path, out_file_path)
+    return pathlib.Path(in_file_path).name, pathlib.Path(out_file_path).name
+
+
+def _read_journal(journal_path, seed):
+    """Returns the seed of the run recorded in journal_path and its mapping."""
     file_name_mapping = {}
+    if not os.path.exists(journal_path):
+        return seed, file_name_mapping
+    with open(journal_path, "r", newline="") as journal:
+        rows = [row for row in csv.reader(journal) if len(row) == 2]
+    if not rows or rows[0][0] != "seed":
+        raise ValueError(f"{journal_path} is not an anonymization journal")
+    journal_seed = int(rows[0][1])
+    if seed is not None and seed != journal_seed:
+        raise ValueError(f"{journal_path} was written with seed "
+                         f"{journal_seed}, not {seed}")
+    # A line torn by a crash while appending was dropped above, or maps to a
+    # name that does not match; either way its file is anonymized again.
+    for original, anonymized in rows[1:]:
+        file_name_mapping[original] = anonymized
+    return journal_seed, file_name_mapping
+
+
+def anonymize_all(in_dir, out_dir, file_ending="mps", use_cplex=False,
+                  name_mapping_dir=None, seed=None, jobs=1):
+    """Anonymizes all the *.file_ending files of in_dir into out_dir.
+
+    The files are shuffled and renamed {i}.{file_ending}. The shuffle and the
+    name permutations of each file only depend on seed (drawn at random if
+    not given), so the output does not depend on jobs, the number of
+    processes the files are spread over.
+
+    Each output is written to a temporary file and renamed once complete,
+    then recorded in out_dir/journal.csv along with the seed. Running again
+    over the same out_dir resumes an interrupted run: the files already in
+    the journal are skipped. A file that fails is logged and left out of the
+    returned mapping, and is retried by the next run.
+    """
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    journal_path = out_dir.joinpath(JOURNAL_FILE)
+    seed, file_name_mapping = _read_journal(journal_path, seed)
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**32)
+
+    all_files = sorted(pathlib.Path(in_dir).glob(f"*.{file_ending}"))
+    random.Random(seed).shuffle(all_files)
+    tasks = []
     for i, current_file in enumerate(all_files):
-        print(f"Working on {current_file}.")
-        new_file_path = pathlib.Path(out_dir).joinpath(f"{i}.{file_ending}")
-        file_name_mapping[str(current_file.name)] = new_file_path.name
-        anonymize_problem(str(current_file.absolute()),
-                          str(new_file_path),
-                          str(i),
-                          file_ending.rstrip(".gz").rstrip(".bz"))
+        new_file_path = out_dir.joinpath(f"{i}.{file_ending}")
+        if (file_name_mapping.get(current_file.name) == new_file_path.name and
+                new_file_path.exists()):
+            continue
+        mapping_file_path = None
+        if name_mapping_dir:
+            mapping_file_path = str(
+                pathlib.Path(name_mapping_dir).joinpath(f"{i}.csv.gz"))
+        tasks.append((str(current_file.absolute()), str(new_file_path),
+                      str(i), file_ending.rstrip(".gz").rstrip(".bz"),
+                      use_cplex, mapping_file_path, f"{seed}:{i}"))
+    logging.info("Anonymizing %d of %d files with seed %d",
+                 len(tasks), len(all_files), seed)
+    if name_mapping_dir:
+        pathlib.Path(name_mapping_dir).mkdir(parents=True, exist_ok=True)
+
+    # Rewritten first, so that appending never extends a torn last line.
+    journal_temp_path = _temp_path(journal_path)
+    with open(journal_temp_path, "w", newline="") as journal:
+        writer = csv.writer(journal)
+        writer.writerow(["seed", seed])
+        writer.writerows(file_name_mapping.items())
+    os.replace(journal_temp_path, journal_path)
+
+    with open(journal_path, "a", newline="") as journal:
+        writer = csv.writer(journal)
+
+        def record(names):
+            original, anonymized = names
+            writer.writerow([original, anonymized])
+            journal.flush()
+            os.fsync(journal.fileno())
+            file_name_mapping[original] = anonymized
+
+        # Roughly one non-zero every few bytes of compressed MPS.
+        mean_size = sum(os.path.getsize(task[0]) for task in tasks) // max(
+            1, len(tasks))
+        failures = parallel.RunInstances(
+            functools.partial(_anonymize_file, tasks), len(tasks), jobs,
+            mean_size // 3, record)
+    for index in failures:
+        logging.error("Failed to anonymize %s", tasks[index][0])
     return file_name_mapping
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     file_name_mapping = anonymize_all("data/local/all_unanonimized",
                                       "data/all_anonymized",
-                                      file_ending="mps.gz")
+                                      file_ending="mps.gz",
+                                      jobs=os.cpu_count())
     write_csv(file_name_mapping, "mapping.csv")
@@ -0,0 +1,65 @@
+import gzip
+import io
+import os
+
+import numpy as np
+from absl.testing import absltest
+
+import anonymize
+from common import mip_arrays
+from common import mps_writer
+
+
+def _gzip_name(path):
+    """The FNAME field of the gzip header of path."""
+    with open(path, "rb") as f:
+        header = f.read(1024)
+    if not header[3] & 0x08:
+        return None
+    return header[10:header.index(b"\0", 10)].decode("latin-1")
+
+
+def _write_model(path, seed):
+    builder = mip_arrays.MipArraysBuilder()
+    builder.AddVariables(mip_arrays.GridNames("x", 4), lower_bound=0.0,
+                         upper_bound=1.0, objective=[1.0, 2.0, 3.0, 4.0],
+                         is_integer=True)
+    builder.AddConstraints(mip_arrays.GridNames("ct", 2), lower_bound=1.0,
+                           upper_bound=np.inf,
+                           col_index=[[0, 1], [2, 3 - seed % 2]],
+                           coefficient=np.ones((2, 2)))
+    text = io.StringIO()
+    mps_writer.WriteMps(text, builder.Build(), name=f"model_{seed}")
+    with gzip.open(path, "wt") as f:
+        f.write(text.getvalue())
+
+
+class AnonymizeAllTest(absltest.TestCase):
+
+    def test_gzip_headers_name_the_final_files(self):
+        in_dir = self.create_tempdir().full_path
+        out_dir = self.create_tempdir().full_path
+        mapping_dir = self.create_tempdir().full_path
+        for seed in range(3):
+            _write_model(os.path.join(in_dir, f"model_{seed}.mps.gz"), seed)
+        mapping = anonymize.anonymize_all(in_dir, out_dir,
+                                          file_ending="mps.gz",
+                                          name_mapping_dir=mapping_dir,
+                                          seed=5)
+        self.assertCountEqual(mapping.values(),
+                              ["0.mps.gz", "1.mps.gz", "2.mps.gz"])
+        self.assertCountEqual(os.listdir(out_dir),
+                              ["0.mps.gz", "1.mps.gz", "2.mps.gz",
+                               anonymize.JOURNAL_FILE])
+        for i in range(3):
+            self.assertEqual(
+                _gzip_name(os.path.join(out_dir, f"{i}.mps.gz")), f"{i}.mps")
+            self.assertEqual(
+                _gzip_name(os.path.join(mapping_dir, f"{i}.csv.gz")),
+                f"{i}.csv")
+            with gzip.open(os.path.join(out_dir, f"{i}.mps.gz"), "rt") as f:
+                self.assertIn(f"NAME          {i}\n", f.read())
+
+
+if __name__ == "__main__":
+    absltest.main()
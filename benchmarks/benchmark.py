@@ -0,0 +1,343 @@
+'''Benchmarks the generators and compares them against stored baselines.
+
+Each generator is benchmarked in a sweep over the dimensions its instances
+grow with, starting from its shipped params.text_pb2 and scaling one dimension
+at a time:
+
+  knapsack        items (number of items), bins (number of bins)
+  load_balancing  workers (number of workers), probability (allowed worker
+                  probabilities, capped at 1)
+
+For every point, each stage of the generation pipeline is timed (best of
+--repeats runs), then run once more under tracemalloc to record its peak
+memory and the size of what it produced:
+
+  generate   sampling the instance (GenerateKnapsack,
+             GenerateLoadBalancingProblem), output = serialized instance
+  build      building the MIP (BuildMipArraysForKnapsack,
+             BuildMipForLoadBalancing), output = serialized MPModelProto
+  to_proto   MipArraysToMPModelProto (knapsack only)
+  build_compact
+             BuildSparseMipArraysForLoadBalancing with compact failure
+             constraints (load_balancing only)
+  write_mps  MPS export and gzip, as done by the generators, output = bytes
+             written
+
+Load-balancing stages whose model would exceed the _MAX_* sizes below are
+skipped: they need more memory than a plain box has (the failure rows alone
+grow quadratically with the number of allowed workers).
+
+Results are written as JSON to --results and compared with --baseline: a
+stage slower than --tolerance times its baseline (and by at least
+--min_slowdown_seconds), or using more than --tolerance times its baseline
+memory, is reported as a regression and makes the run fail. Outputs whose
+size changed are reported too, since generation is deterministic. Run with
+--update_baseline to store the results as the new baseline.
+
+Everything runs offline. Each generator runs in its own Python process (the
+generators define the same flags and proto file names), e.g.:
+
+  > python benchmarks/benchmark.py --scales=1,10,100
+'''
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from absl import app
+from absl import flags
+
+from google.protobuf import text_format
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append(ROOT_DIR)
+from common import mip_arrays
+from common import output as output_lib
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('generators', ['knapsack', 'load_balancing'],
+                  'Generators to benchmark.')
+
+flags.DEFINE_list('scales', ['1', '10', '100'],
+                  'Factors to scale each swept dimension by.')
+
+flags.DEFINE_integer('repeats', 3,
+                     'How many times to time each stage; the best is kept.')
+
+flags.DEFINE_string(
+    'baseline',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json'),
+    'JSON file of baseline results to compare against.')
+
+flags.DEFINE_bool('update_baseline', False,
+                  'Write the results to --baseline instead of comparing.')
+
+flags.DEFINE_string('results', '/tmp/benchmark_results.json',
+                    'Where to write the results of this run.')
+
+flags.DEFINE_float('tolerance', 1.5,
+                   'Ratio to the baseline above which a stage regressed.')
+
+flags.DEFINE_float(
+    'min_slowdown_seconds', 0.05,
+    'Slowdowns smaller than this are noise and never reported.')
+
+flags.DEFINE_string(
+    'child_generator', '',
+    'Internal: benchmark this generator in the current process and print the '
+    'results as JSON.')
+
+# Load-balancing models larger than this are not built.
+_MAX_DENSE_PAIRS = 250000
+_MAX_DENSE_NNZ = 2000000
+_MAX_NNZ = 20000000
+
+# A stage gets the outputs of the previous stages and returns (output, size of
+# the output in bytes).
+Stage = Callable[[Dict[str, Any]], Tuple[Any, int]]
+
+
+def _ImportGenerator(generator: str):
+  sys.path.insert(0, os.path.join(ROOT_DIR, generator))
+  return __import__(generator)
+
+
+def _ReadParams(generator: str, params_type):
+  params = params_type()
+  with open(os.path.join(ROOT_DIR, generator, 'params.text_pb2'), 'r') as f:
+    text_format.Merge(f.read(), params)
+  return params
+
+
+def _ScaleRange(message, scale: float):
+  message.i_min = int(round(message.i_min * scale))
+  message.i_max = int(round(message.i_max * scale))
+
+
+def _KnapsackPoints(knapsack, scales: List[float]):
+  base = _ReadParams('knapsack', knapsack.params_pb2.KnapsackParameters)
+  for sweep in ('items', 'bins'):
+    for scale in scales:
+      params = type(base)()
+      params.CopyFrom(base)
+      if sweep == 'items':
+        for item_param in params.item_param:
+          _ScaleRange(item_param, scale)
+      else:
+        params.b_min = int(round(params.b_min * scale))
+        params.b_max = int(round(params.b_max * scale))
+      yield sweep, scale, params
+
+
+def _KnapsackStages(knapsack, params, out_dir: str) -> List[Tuple[str, Stage]]:
+
+  def Generate(_):
+    instance = knapsack.GenerateKnapsack(params, 0)
+    return instance, instance.ByteSize()
+
+  def Build(outputs):
+    arrays = knapsack.BuildMipArraysForKnapsack(outputs['generate'])
+    return arrays, None
+
+  def ToProto(outputs):
+    model = mip_arrays.MipArraysToMPModelProto(outputs['build'])
+    return model, model.ByteSize()
+
+  def WriteMps(outputs):
+    filenames = output_lib.WriteModel(os.path.join(out_dir, 'knapsack'),
+                                      outputs['build'], ['mps'],
+                                      name='Knapsack_0')
+    return None, os.path.getsize(filenames[0])
+
+  return [('generate', Generate), ('build', Build), ('to_proto', ToProto),
+          ('write_mps', WriteMps)]
+
+
+def _LoadBalancingPoints(load_balancing, scales: List[float]):
+  base = _ReadParams('load_balancing',
+                     load_balancing.params_pb2.LoadBalancingParameters)
+  for sweep in ('workers', 'probability'):
+    for scale in scales:
+      params = type(base)()
+      params.CopyFrom(base)
+      if sweep == 'workers':
+        for worker_param in params.worker_parameter:
+          _ScaleRange(worker_param, scale)
+      else:
+        for workload_param in params.workload_parameter:
+          workload_param.allowed_worker_probability[:] = [
+              min(1.0, p * scale)
+              for p in workload_param.allowed_worker_probability
+          ]
+      yield sweep, scale, params
+
+
+def _LoadBalancingStages(load_balancing, params,
+                         out_dir: str) -> List[Tuple[str, Stage]]:
+  num_pairs = (
+      sum(p.i_max for p in params.workload_parameter) *
+      sum(p.i_max for p in params.worker_parameter))
+
+  def Generate(_):
+    problem = load_balancing.GenerateLoadBalancingProblem(params, 0)
+    return problem, problem.ByteSize()
+
+  def Build(outputs):
+    model = load_balancing.BuildMipForLoadBalancing(outputs['generate'])
+    return model, model.ByteSize()
+
+  def BuildCompact(outputs):
+    arrays = load_balancing.BuildSparseMipArraysForLoadBalancing(
+        outputs['generate'], compact_failures=True)
+    return arrays, None
+
+  def WriteMps(outputs):
+    filenames = output_lib.WriteModel(
+        os.path.join(out_dir, 'load_balancing'),
+        mip_arrays.MPModelProtoToMipArrays(outputs['build']), ['mps'],
+        name='LoadBalancing_0')
+    return None, os.path.getsize(filenames[0])
+
+  stages = [('generate', Generate)]
+  if load_balancing.EstimateModelSize(params, True, True) <= _MAX_NNZ:
+    stages.append(('build_compact', BuildCompact))
+  if (num_pairs <= _MAX_DENSE_PAIRS and
+      load_balancing.EstimateModelSize(params) <= _MAX_DENSE_NNZ):
+    stages += [('build', Build), ('write_mps', WriteMps)]
+  else:
+    logging.info('Skipping dense stages for %d pairs', num_pairs)
+  return stages
+
+
+def _RunStages(stages: List[Tuple[str, Stage]], repeats: int):
+  '''Returns {stage: {wall_seconds, peak_bytes, output_bytes}}.'''
+  results = {name: {'wall_seconds': float('inf')} for name, _ in stages}
+  for _ in range(repeats):
+    outputs = {}
+    for name, stage in stages:
+      start = time.perf_counter()
+      outputs[name], _ = stage(outputs)
+      results[name]['wall_seconds'] = min(results[name]['wall_seconds'],
+                                          time.perf_counter() - start)
+    del outputs
+  outputs = {}
+  tracemalloc.start()
+  try:
+    for name, stage in stages:
+      before, _ = tracemalloc.get_traced_memory()
+      tracemalloc.reset_peak()
+      outputs[name], output_bytes = stage(outputs)
+      _, peak = tracemalloc.get_traced_memory()
+      results[name]['peak_bytes'] = peak - before
+      results[name]['output_bytes'] = output_bytes
+  finally:
+    tracemalloc.stop()
+  return results
+
+
+def _RunChild(generator: str, scales: List[float], repeats: int):
+  module = _ImportGenerator(generator)
+  if generator == 'knapsack':
+    points, stages_fn = _KnapsackPoints(module, scales), _KnapsackStages
+  elif generator == 'load_balancing':
+    points, stages_fn = (_LoadBalancingPoints(module, scales),
+                         _LoadBalancingStages)
+  else:
+    raise ValueError('Unknown generator: %s' % generator)
+  results = {}
+  with tempfile.TemporaryDirectory() as out_dir:
+    for sweep, scale, params in points:
+      logging.info('Benchmarking %s %s x%g', generator, sweep, scale)
+      stage_results = _RunStages(stages_fn(module, params, out_dir), repeats)
+      for stage, values in stage_results.items():
+        results['%s/%s/x%g/%s' % (generator, sweep, scale, stage)] = values
+  print(json.dumps(results))
+
+
+def Compare(results: Dict[str, Dict[str, Any]],
+            baseline: Dict[str, Dict[str, Any]], tolerance: float,
+            min_slowdown_seconds: float) -> Tuple[List[str], List[str]]:
+  '''Returns the regressions and the output size changes wrt baseline.'''
+  regressions = []
+  changes = []
+  for key in sorted(results):
+    if key not in baseline:
+      continue
+    new = results[key]
+    old = baseline[key]
+    if (new['wall_seconds'] > tolerance * old['wall_seconds'] and
+        new['wall_seconds'] - old['wall_seconds'] > min_slowdown_seconds):
+      regressions.append('%s: %.3fs, baseline %.3fs' %
+                         (key, new['wall_seconds'], old['wall_seconds']))
+    if new['peak_bytes'] > tolerance * max(old['peak_bytes'], 1 << 20):
+      regressions.append('%s: peak %d bytes, baseline %d bytes' %
+                         (key, new['peak_bytes'], old['peak_bytes']))
+    if new['output_bytes'] != old['output_bytes']:
+      changes.append('%s: %s output bytes, baseline %s' %
+                     (key, new['output_bytes'], old['output_bytes']))
+  return regressions, changes
+
+
+def main(argv):
+  del argv
+  scales = [float(s) for s in FLAGS.scales]
+  if FLAGS.child_generator:
+    _RunChild(FLAGS.child_generator, scales, FLAGS.repeats)
+    return
+
+  results = {}
+  for generator in FLAGS.generators:
+    child = subprocess.run(
+        [sys.executable, os.path.abspath(__file__),
+         '--child_generator=' + generator,
+         '--scales=' + ','.join(FLAGS.scales),
+         '--repeats=%d' % FLAGS.repeats],
+        stdout=subprocess.PIPE, check=True, universal_newlines=True)
+    results.update(json.loads(child.stdout.splitlines()[-1]))
+
+  print('%-45s %10s %12s %12s' % ('stage', 'seconds', 'peak MB',
+                                  'output KB'))
+  for key, values in sorted(results.items()):
+    output_bytes = values['output_bytes']
+    print('%-45s %10.3f %12.1f %12s' %
+          (key, values['wall_seconds'], values['peak_bytes'] / 2**20,
+           '-' if output_bytes is None else '%.1f' % (output_bytes / 2**10)))
+  with open(FLAGS.results, 'w') as f:
+    json.dump(results, f, indent=1, sort_keys=True)
+
+  if FLAGS.update_baseline:
+    baseline = {}
+    if os.path.exists(FLAGS.baseline):
+      with open(FLAGS.baseline, 'r') as f:
+        baseline = json.load(f)
+    baseline.update(results)
+    with open(FLAGS.baseline, 'w') as f:
+      json.dump(baseline, f, indent=1, sort_keys=True)
+    logging.info('Updated baseline %s', FLAGS.baseline)
+    return
+
+  if not os.path.exists(FLAGS.baseline):
+    logging.warning('No baseline at %s, nothing to compare with',
+                    FLAGS.baseline)
+    return
+  with open(FLAGS.baseline, 'r') as f:
+    baseline = json.load(f)
+  regressions, changes = Compare(results, baseline, FLAGS.tolerance,
+                                 FLAGS.min_slowdown_seconds)
+  for change in changes:
+    logging.warning('Output size changed: %s', change)
+  for regression in regressions:
+    logging.error('Regression: %s', regression)
+  if regressions:
+    raise RuntimeError('%d benchmark regressions' % len(regressions))
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,208 @@
+'''On-disk cache of generated instances, addressed by their content.
+
+An entry holds the files written for one instance (one per output format).
+It is keyed by a hash of everything the files depend on: the generator
+parameters, the seed, the generation options and the code of the generator
+and of this package. Entries are stored as
+
+  <directory>/<key[:2]>/<key>/model<suffix>  the cached files
+  <directory>/<key[:2]>/<key>/MANIFEST       their sizes and SHA-256
+  <directory>/<key[:2]>/<key>/STATISTICS     the instance's statistics
+
+Files are stored, and a hit is served, by hard-linking (or copying, across
+file systems) them between the output paths and the entry, with their
+checksum files (see output). Sharing the files is safe because the
+generators never rewrite a file in place: output.AtomicOutput replaces a file
+by renaming a new one over its path, which leaves the linked copy alone. A
+file changed in place some other way fails the check of the cached files
+against the manifest on the next hit; entries that fail it are dropped and
+rebuilt. The manifest's mtime is the entry's last use, and Evict removes
+the least recently used entries until the cache fits in max_bytes.
+'''
+
+import functools
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional, Sequence
+
+from google.protobuf import text_format
+from google.protobuf.message import Message
+
+from common import output as output_lib
+
+_MANIFEST = 'MANIFEST'
+_STATISTICS = 'STATISTICS'
+_CACHED_FILE = 'model'
+
+DEFAULT_MAX_BYTES = 10 << 30
+
+
+@functools.lru_cache(maxsize=None)
+def _CodeVersion(generator_file: str) -> str:
+  '''Hash of the generator source and of the common package.'''
+  common_dir = os.path.dirname(os.path.abspath(__file__))
+  sha = hashlib.sha256()
+  for filename in [generator_file] + sorted(
+      glob.glob(os.path.join(common_dir, '*.py'))):
+    with open(filename, 'rb') as source:
+      sha.update(source.read())
+  return sha.hexdigest()
+
+
+def InstanceKey(generator_file: str, params: Message, seed: int,
+                options: Dict[str, Any]) -> str:
+  '''Returns the cache key of an instance.
+
+  generator_file is the source of the generator (its __file__), so that
+  editing it invalidates its entries. options holds everything else the files
+  depend on (formulation, output formats, model name, ...) and must be JSON
+  serializable.
+  '''
+  description = json.dumps({
+      'code': _CodeVersion(os.path.abspath(generator_file)),
+      'params_type': params.DESCRIPTOR.full_name,
+      'params': text_format.MessageToString(params),
+      'seed': seed,
+      'options': options,
+  }, sort_keys=True)
+  return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+
+def _LinkOrCopy(source: str, destination: str):
+  try:
+    os.link(source, destination)
+  except OSError:
+    shutil.copyfile(source, destination)
+
+
+def _Materialize(source: str, destination: str, digest: str):
+  with output_lib.AtomicOutput(destination, digest) as temp_destination:
+    _LinkOrCopy(source, temp_destination)
+
+
+class InstanceCache(object):
+  '''Cache of instance files under directory, bounded to max_bytes.
+
+  The cache only holds a path, so it can be passed to worker processes. Any
+  number of processes may fetch and store concurrently: entries are published
+  by an atomic rename.
+  '''
+
+  def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+    self.directory = directory
+    self.max_bytes = max_bytes
+
+  def _EntryDir(self, key: str) -> str:
+    return os.path.join(self.directory, key[:2], key)
+
+  def Fetch(self, key: str, prefix: str, suffixes: Sequence[str]) -> bool:
+    '''Writes the cached files of key to prefix + suffix, if all are cached.
+
+    Returns whether the entry was found and intact. A corrupt entry is
+    removed.
+    '''
+    entry_dir = self._EntryDir(key)
+    manifest_file = os.path.join(entry_dir, _MANIFEST)
+    try:
+      with open(manifest_file, 'r') as f:
+        manifest = json.load(f)
+    except (OSError, ValueError):
+      return False
+    if any(suffix not in manifest for suffix in suffixes):
+      return False
+    for suffix in suffixes:
+      cached = os.path.join(entry_dir, _CACHED_FILE + suffix)
+      expected = manifest[suffix]
+      try:
+        intact = (os.path.getsize(cached) == expected['size'] and
+                  output_lib.FileDigest(cached) == expected['sha256'])
+      except OSError:
+        intact = False
+      if not intact:
+        logging.warning('Dropping corrupt cache entry %s', entry_dir)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return False
+    for suffix in suffixes:
+      _Materialize(os.path.join(entry_dir, _CACHED_FILE + suffix),
+                   prefix + suffix, manifest[suffix]['sha256'])
+    try:
+      os.utime(manifest_file)
+    except OSError:
+      pass
+    return True
+
+  def Statistics(self, key: str) -> Optional[Dict[str, Any]]:
+    '''The statistics stored with the entry of key, if any.'''
+    try:
+      with open(os.path.join(self._EntryDir(key), _STATISTICS), 'r') as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return None
+
+  def Store(self, key: str, prefix: str, suffixes: Sequence[str],
+            statistics: Optional[Dict[str, Any]] = None):
+    '''Adds the files prefix + suffix to the cache under key.
+
+    statistics (see dataset_index.ModelStatistics) are kept with the files,
+    so that a hit does not lose them.
+    '''
+    entry_dir = self._EntryDir(key)
+    if os.path.exists(os.path.join(entry_dir, _MANIFEST)):
+      return
+    parent = os.path.dirname(entry_dir)
+    os.makedirs(parent, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(prefix='.' + key, dir=parent)
+    try:
+      manifest = {}
+      for suffix in suffixes:
+        # Linked like the files of a hit, see the module docstring.
+        staged = os.path.join(staging_dir, _CACHED_FILE + suffix)
+        _LinkOrCopy(prefix + suffix, staged)
+        manifest[suffix] = {
+            'size': os.path.getsize(staged),
+            'sha256': output_lib.FileDigest(staged),
+        }
+      if statistics is not None:
+        with open(os.path.join(staging_dir, _STATISTICS), 'w') as f:
+          json.dump(statistics, f, sort_keys=True)
+      with open(os.path.join(staging_dir, _MANIFEST), 'w') as f:
+        json.dump(manifest, f, sort_keys=True)
+      os.rename(staging_dir, entry_dir)
+    except OSError:
+      # Another process stored the same entry first, or the cache is not
+      # writable: either way the instance itself was built fine.
+      shutil.rmtree(staging_dir, ignore_errors=True)
+
+  def Evict(self) -> List[str]:
+    '''Removes least recently used entries until the cache fits max_bytes.
+
+    Returns the keys of the removed entries.
+    '''
+    entries = []
+    total = 0
+    for manifest_file in glob.glob(
+        os.path.join(self.directory, '*', '*', _MANIFEST)):
+      try:
+        with open(manifest_file, 'r') as f:
+          size = sum(v['size'] for v in json.load(f).values())
+        last_use = os.path.getmtime(manifest_file)
+      except (OSError, ValueError):
+        continue
+      entries.append((last_use, size, os.path.dirname(manifest_file)))
+      total += size
+    evicted = []
+    for _, size, entry_dir in sorted(entries):
+      if total <= self.max_bytes:
+        break
+      shutil.rmtree(entry_dir, ignore_errors=True)
+      total -= size
+      evicted.append(os.path.basename(entry_dir))
+    if evicted:
+      logging.info('Evicted %d cache entries, %d bytes left', len(evicted),
+                   total)
+    return evicted
@@ -0,0 +1,114 @@
+import os
+
+from absl.testing import absltest
+from ortools.linear_solver import linear_solver_pb2
+
+from common import cache
+from common import output
+
+
+class InstanceCacheTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.cache = cache.InstanceCache(self.create_tempdir().full_path)
+    self.directory = self.create_tempdir().full_path
+    self.params = linear_solver_pb2.MPModelProto(name='params')
+
+  def _Key(self, seed: int = 0, **options) -> str:
+    return cache.InstanceKey(__file__, self.params, seed, options)
+
+  def _Write(self, prefix: str, contents) -> str:
+    for suffix, content in contents.items():
+      with open(prefix + suffix, 'wb') as f:
+        f.write(content)
+    return prefix
+
+  def testInstanceKey(self):
+    self.assertEqual(self._Key(), self._Key())
+    keys = {self._Key(), self._Key(seed=1), self._Key(formats=['mps']),
+            cache.InstanceKey(__file__, linear_solver_pb2.MPModelProto(), 0,
+                              {})}
+    self.assertLen(keys, 4)
+
+  def testStoreAndFetch(self):
+    key = self._Key()
+    source = self._Write(os.path.join(self.directory, 'kn_0'),
+                         {'.mps.gz': b'mps', '.pb': b'pb'})
+    target = os.path.join(self.directory, 'copy_0')
+    self.assertFalse(self.cache.Fetch(key, target, ['.pb']))
+    self.cache.Store(key, source, ['.mps.gz', '.pb'], {'nnz': 12})
+    self.assertTrue(self.cache.Fetch(key, target, ['.pb']))
+    with open(target + '.pb', 'rb') as f:
+      self.assertEqual(f.read(), b'pb')
+    self.assertTrue(output.VerifyChecksum(target + '.pb'))
+    self.assertFalse(os.path.exists(target + '.mps.gz'))
+    self.assertEqual(self.cache.Statistics(key), {'nnz': 12})
+    # Formats that were not stored are a miss.
+    self.assertFalse(self.cache.Fetch(key, target, ['.npz']))
+
+  def _WriteAtomically(self, filename: str, content: bytes):
+    # As the generators write their files.
+    with output.AtomicOutput(filename) as temp_filename:
+      with open(temp_filename, 'wb') as f:
+        f.write(content)
+
+  def testRewrittenOutputKeepsTheEntry(self):
+    key = self._Key()
+    source = os.path.join(self.directory, 'kn_0')
+    self._WriteAtomically(source + '.pb', b'pb')
+    self.cache.Store(key, source, ['.pb'])
+    self._WriteAtomically(source + '.pb', b'pc')
+    target = os.path.join(self.directory, 'copy_0')
+    self.assertTrue(self.cache.Fetch(key, target, ['.pb']))
+    self._WriteAtomically(target + '.pb', b'pd')
+    target = os.path.join(self.directory, 'copy_1')
+    self.assertTrue(self.cache.Fetch(key, target, ['.pb']))
+    with open(target + '.pb', 'rb') as f:
+      self.assertEqual(f.read(), b'pb')
+
+  def testCorruptEntryIsDropped(self):
+    key = self._Key()
+    source = self._Write(os.path.join(self.directory, 'kn_0'), {'.pb': b'pb'})
+    self.cache.Store(key, source, ['.pb'])
+    entry_dir = self.cache._EntryDir(key)
+    with open(os.path.join(entry_dir, 'model.pb'), 'wb') as f:
+      f.write(b'pc')
+    target = os.path.join(self.directory, 'copy_0')
+    self.assertFalse(self.cache.Fetch(key, target, ['.pb']))
+    self.assertFalse(os.path.exists(entry_dir))
+    self.assertFalse(os.path.exists(target + '.pb'))
+
+  def testOutputChangedInPlaceIsDetected(self):
+    key = self._Key()
+    source = self._Write(os.path.join(self.directory, 'kn_0'), {'.pb': b'pb'})
+    self.cache.Store(key, source, ['.pb'])
+    # Rewriting the stored file in place (which the generators never do)
+    # changes the entry it may be linked to, which the next hit detects.
+    self._Write(source, {'.pb': b'pc'})
+    target = os.path.join(self.directory, 'copy_0')
+    if self.cache.Fetch(key, target, ['.pb']):
+      with open(target + '.pb', 'rb') as f:
+        self.assertEqual(f.read(), b'pb')
+
+  def testEvictLeastRecentlyUsed(self):
+    self.cache.max_bytes = 250
+    keys = [self._Key(seed) for seed in range(3)]
+    for seed, key in enumerate(keys):
+      source = self._Write(os.path.join(self.directory, 'kn_%d' % seed),
+                           {'.pb': b'x' * 100})
+      self.cache.Store(key, source, ['.pb'])
+      manifest = os.path.join(self.cache._EntryDir(key), cache._MANIFEST)
+      os.utime(manifest, (1000 + seed, 1000 + seed))
+    # Using the oldest entry makes the second one the least recently used.
+    self.assertTrue(self.cache.Fetch(
+        keys[0], os.path.join(self.directory, 'copy'), ['.pb']))
+    self.assertEqual(self.cache.Evict(), [keys[1]])
+    self.assertIsNone(self.cache.Statistics(keys[1]))
+    self.assertFalse(self.cache.Fetch(
+        keys[1], os.path.join(self.directory, 'copy'), ['.pb']))
+    self.assertEqual(self.cache.Evict(), [])
+
+
+if __name__ == '__main__':
+  absltest.main()
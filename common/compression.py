@@ -0,0 +1,214 @@
+'''Compression of the text files the generators write.
+
+A Compression names a method, its level and how many threads it may use:
+
+- gzip: single-threaded gzip, as written by the gzip module.
+- pgzip: block-parallel gzip. The text is cut into blocks that are deflated
+  on a pool of threads (zlib releases the GIL) and concatenated into a single
+  gzip member, as pigz does: each block is primed with the last 32 KiB of the
+  previous one and ends on a byte boundary with a sync flush. The result is a
+  standard .gz file, nearly as small as with gzip, and does not depend on the
+  number of threads.
+- zstd: Zstandard, through the optional zstandard package.
+- none: no compression.
+'''
+
+import collections
+import concurrent.futures
+import gzip
+import io
+import os
+import struct
+import zlib
+from typing import BinaryIO, Optional
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+# File suffix of each method.
+SUFFIXES = {
+    'gzip': '.gz',
+    'pgzip': '.gz',
+    'zstd': '.zst',
+    'none': '',
+}
+
+# Levels used when none is given. The gzip module defaults to 9, which the
+# generators have always used.
+_DEFAULT_LEVELS = {
+    'gzip': 9,
+    'pgzip': 9,
+    'zstd': 3,
+    'none': 0,
+}
+
+# Size of the blocks pgzip deflates independently, and of the window each
+# block is primed with.
+_BLOCK_SIZE = 1 << 20
+_WINDOW_SIZE = 1 << 15
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# method is one of SUFFIXES. level None means the default of the method.
+# threads 0 means one per CPU; it is ignored by gzip and none.
+Compression = collections.namedtuple('Compression',
+                                     ['method', 'level', 'threads'],
+                                     defaults=[None, 1])
+
+DEFAULT = Compression('gzip')
+
+
+def CheckCompression(compression: Compression):
+  if compression.method not in SUFFIXES:
+    raise ValueError('Compression method must be one of %s, got %s' %
+                     (sorted(SUFFIXES), compression.method))
+  if compression.method == 'zstd' and zstandard is None:
+    raise ValueError('zstd compression requires the zstandard package')
+
+
+def FromSuffix(filename: str) -> Compression:
+  '''The default compression of a file named filename.'''
+  if filename.endswith('.gz'):
+    return DEFAULT
+  if filename.endswith('.zst'):
+    return Compression('zstd')
+  return Compression('none')
+
+
+def OpenRead(filename: str) -> BinaryIO:
+  '''Opens filename for reading its bytes, decompressed.
+
+  The method is told from the first bytes of the file rather than its suffix.
+  '''
+  with open(filename, 'rb') as f:
+    magic = f.read(len(_ZSTD_MAGIC))
+  if magic.startswith(_GZIP_MAGIC):
+    return gzip.open(filename, 'rb')
+  if magic == _ZSTD_MAGIC:
+    CheckCompression(Compression('zstd'))
+    return zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'),
+                                                      closefd=True)
+  return open(filename, 'rb')
+
+
+def _Level(compression: Compression) -> int:
+  if compression.level is None:
+    return _DEFAULT_LEVELS[compression.method]
+  return compression.level
+
+
+def _Threads(compression: Compression) -> int:
+  return compression.threads or os.cpu_count() or 1
+
+
+def OpenBinary(filename: str, compression: Compression,
+               fileobj: Optional[BinaryIO] = None) -> BinaryIO:
+  '''Opens filename for writing bytes, compressed with compression.
+
+  If fileobj is given, the compressed bytes go to it (and it is left open
+  when the returned stream is closed), filename only naming the content in
+  the gzip header. gzip headers carry no timestamp, so that the same content
+  always gives the same bytes.
+  '''
+  CheckCompression(compression)
+  if compression.method == 'gzip':
+    return gzip.GzipFile(filename, 'wb', compresslevel=_Level(compression),
+                         fileobj=fileobj, mtime=0)
+  if compression.method == 'pgzip':
+    return _ParallelGzipFile(fileobj or open(filename, 'wb'),
+                             _Level(compression), _Threads(compression),
+                             close_file=fileobj is None)
+  if compression.method == 'zstd':
+    # zstandard counts the threads besides the calling one.
+    threads = _Threads(compression)
+    compressor = zstandard.ZstdCompressor(level=_Level(compression),
+                                          threads=threads if threads > 1 else 0)
+    return compressor.stream_writer(fileobj or open(filename, 'wb'),
+                                    closefd=fileobj is None)
+  if fileobj is not None:
+    return _Unclosed(fileobj)
+  return open(filename, 'wb')
+
+
+class _Unclosed(io.RawIOBase):
+  '''Writes to a file that closing this stream leaves open.'''
+
+  def __init__(self, raw: BinaryIO):
+    super().__init__()
+    self._raw = raw
+
+  def writable(self) -> bool:
+    return True
+
+  def write(self, data) -> int:
+    return self._raw.write(data)
+
+
+def _DeflateBlock(block: bytes, dictionary: bytes, level: int,
+                  last: bool) -> bytes:
+  if dictionary:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                  zdict=dictionary)
+  else:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+  return compressor.compress(block) + compressor.flush(
+      zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class _ParallelGzipFile(io.RawIOBase):
+  '''Writes a gzip file, deflating blocks of it on a pool of threads.'''
+
+  def __init__(self, fileobj: BinaryIO, level: int, threads: int,
+               close_file: bool = True):
+    super().__init__()
+    self._file = fileobj
+    self._close_file = close_file
+    # Magic, deflate, no flags, no mtime, no extra flags, unknown OS.
+    self._file.write(b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff')
+    self._level = level
+    self._max_pending = 2 * threads
+    self._pool = concurrent.futures.ThreadPoolExecutor(threads)
+    self._pending = collections.deque()
+    self._buffer = bytearray()
+    self._dictionary = b''
+    self._crc = 0
+    self._size = 0
+
+  def writable(self) -> bool:
+    return True
+
+  def write(self, data) -> int:
+    self._buffer += data
+    while len(self._buffer) >= _BLOCK_SIZE:
+      block = bytes(self._buffer[:_BLOCK_SIZE])
+      del self._buffer[:_BLOCK_SIZE]
+      self._Submit(block, last=False)
+    return len(data)
+
+  def _Submit(self, block: bytes, last: bool):
+    self._crc = zlib.crc32(block, self._crc)
+    self._size += len(block)
+    self._pending.append(
+        self._pool.submit(_DeflateBlock, block, self._dictionary, self._level,
+                          last))
+    self._dictionary = block[-_WINDOW_SIZE:]
+    # Bounds the memory held by blocks waiting to be written.
+    while len(self._pending) > self._max_pending:
+      self._file.write(self._pending.popleft().result())
+
+  def close(self):
+    if self.closed:
+      return
+    try:
+      self._Submit(bytes(self._buffer), last=True)
+      while self._pending:
+        self._file.write(self._pending.popleft().result())
+      self._file.write(struct.pack('<II', self._crc, self._size & 0xffffffff))
+    finally:
+      self._pool.shutdown()
+      if self._close_file:
+        self._file.close()
+      super().close()
@@ -0,0 +1,81 @@
+import gzip
+import io
+
+import numpy as np
+
+from absl.testing import absltest
+
+from common import compression
+
+
+def _Text(size: int) -> bytes:
+  '''size bytes of MPS-like lines, compressible but not trivially so.'''
+  rng = np.random.default_rng(0)
+  lines = []
+  length = 0
+  while length < size:
+    line = '    x_%d  ct_%d  %g\n' % (rng.integers(1 << 20),
+                                      rng.integers(1 << 16), rng.normal())
+    lines.append(line)
+    length += len(line)
+  return ''.join(lines).encode('utf-8')[:size]
+
+
+class CompressionTest(absltest.TestCase):
+
+  def _Compress(self, data: bytes, method: str, threads: int = 1,
+                write_size: int = 100000) -> bytes:
+    out = io.BytesIO()
+    with compression.OpenBinary('model.mps.gz',
+                                compression.Compression(method, 6, threads),
+                                out) as f:
+      for begin in range(0, len(data), write_size):
+        f.write(data[begin:begin + write_size])
+    self.assertFalse(out.closed)
+    return out.getvalue()
+
+  def testParallelGzipDoesNotDependOnThreads(self):
+    # Several blocks, the last one partial.
+    data = _Text(3 * compression._BLOCK_SIZE + 12345)
+    single = self._Compress(data, 'pgzip', threads=1)
+    self.assertEqual(gzip.decompress(single), data)
+    self.assertEqual(self._Compress(data, 'pgzip', threads=4), single)
+    # Nor on how the text is cut into writes.
+    self.assertEqual(
+        self._Compress(data, 'pgzip', threads=2, write_size=777777), single)
+    # Priming each block with the previous one keeps it close to gzip.
+    self.assertLess(len(single), 1.05 * len(self._Compress(data, 'gzip')))
+
+  def testParallelGzipOfSmallInputs(self):
+    for data in (b'', b'x', _Text(compression._BLOCK_SIZE)):
+      self.assertEqual(gzip.decompress(self._Compress(data, 'pgzip', 3)), data)
+
+  def testGzipIsDeterministic(self):
+    data = _Text(200000)
+    first = self._Compress(data, 'gzip')
+    self.assertEqual(gzip.decompress(first), data)
+    self.assertEqual(self._Compress(data, 'gzip'), first)
+
+  def testNoneWritesThrough(self):
+    self.assertEqual(self._Compress(b'text', 'none'), b'text')
+
+  def testOpenRead(self):
+    data = _Text(5000)
+    for method in ('gzip', 'pgzip', 'none'):
+      path = self.create_tempfile(
+          content=self._Compress(data, method), mode='wb').full_path
+      with compression.OpenRead(path) as f:
+        self.assertEqual(f.read(), data, method)
+
+  def testFromSuffix(self):
+    self.assertEqual(compression.FromSuffix('a.mps.gz'), compression.DEFAULT)
+    self.assertEqual(compression.FromSuffix('a.mps.zst').method, 'zstd')
+    self.assertEqual(compression.FromSuffix('a.mps').method, 'none')
+
+  def testCheckCompression(self):
+    with self.assertRaisesRegex(ValueError, 'must be one of'):
+      compression.CheckCompression(compression.Compression('bzip2'))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,286 @@
+'''Statistics of generated instances, and a columnar index of a dataset.
+
+ModelStatistics summarizes a MipArrays with a few NumPy passes over its
+arrays: the number of variables, constraints and non-zeros of each block, the
+ranges of the coefficients, objective and right-hand sides, and histograms of
+the row and column degrees. Blocks are given by the generator as the block of
+each variable and constraint (see Blocks), or else are the names that are
+equal once their numeric components are removed, place_3_12 being in block
+place. The generators add the counts of their problem (items, bins, workers,
+...) and return them in the statistics of each instance, under 'statistics'.
+
+An IndexWriter collects these records for a run and writes them as
+
+  <out>_index.csv  one row per instance, the scalar statistics
+  <out>_index.npz  one .npy member per column, histograms included
+
+so that instances can be selected without reading their files. LoadIndex
+maps the .npz lazily, and a query only reads the columns it uses:
+
+  index = dataset_index.LoadIndex('/data/lb_index.npz')
+  nnz = index['nnz']
+  selected = index['output'][(nnz >= 40000) & (nnz <= 60000)]
+'''
+
+import csv
+import hashlib
+import itertools
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from google.protobuf import text_format
+from google.protobuf.message import Message
+
+from common import mip_arrays
+from common import output as output_lib
+
+CSV_SUFFIX = '_index.csv'
+NPZ_SUFFIX = '_index.npz'
+
+# Rows and columns are counted by their number of non-zeros d in the bins 0,
+# 1, 2-3, 4-7, ..., the last bin holding all d >= 2**(NUM_DEGREE_BINS - 2).
+NUM_DEGREE_BINS = 24
+
+# Numeric components of names, such as _3 in place_3_12.
+_INDEX_COMPONENT = re.compile(r'_\d+(?=_|$)')
+
+_HISTOGRAMS = ('row_degree_histogram', 'col_degree_histogram')
+
+# Columns every row has, first in the CSV file.
+_KEY_COLUMNS = ('output', 'name', 'seed', 'params_hash')
+
+# Index of an instance at the end of its output prefix, such as 12 in kn_12.
+_OUTPUT_INDEX = re.compile(r'_(\d+)$')
+
+# The names of the blocks of the variables (or constraints) of a model, and
+# the position in names of the block of each variable (constraint).
+Blocks = Tuple[Sequence[str], np.ndarray]
+
+
+def ParamsHash(params: Message) -> str:
+  '''Short hash of the generator parameters of an instance.'''
+  text = text_format.MessageToString(params)
+  return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def _BlockName(name: str) -> str:
+  # place_3_12 -> place, workload_ct_3_failure_5 -> workload_ct_failure.
+  return _INDEX_COMPONENT.sub('', name)
+
+
+def _Blocks(names: Sequence[str],
+            contiguous: bool) -> List[Tuple[str, int, int]]:
+  '''(block name, start, end) of the runs of names with the same block name.
+
+  If each block is contiguous, as MipArraysBuilder lays them out, the end of
+  a run is found by galloping then bisection, so that only
+  O(#blocks * log(len(names))) names are looked at. Otherwise every name is.
+  '''
+  blocks = []
+  if not contiguous:
+    start = 0
+    for block, run in itertools.groupby(names, key=_BlockName):
+      end = start + sum(1 for _ in run)
+      blocks.append((block, start, end))
+      start = end
+    return blocks
+  start = 0
+  while start < len(names):
+    block = _BlockName(names[start])
+    # names[low] is in the block; names[high] is not, or high is the end.
+    low = start
+    step = 1
+    high = start + 1
+    while high < len(names) and _BlockName(names[high]) == block:
+      low = high
+      step *= 2
+      high = low + step
+    high = min(high, len(names))
+    while high - low > 1:
+      middle = (low + high) // 2
+      if _BlockName(names[middle]) == block:
+        low = middle
+      else:
+        high = middle
+    blocks.append((block, start, high))
+    start = high
+  return blocks
+
+
+def _DegreeHistogram(degree: np.ndarray) -> List[int]:
+  # frexp gives the exponent e with 2**(e - 1) <= d < 2**e, and 0 for d = 0.
+  bins = np.minimum(np.frexp(degree.astype(np.float64))[1],
+                    NUM_DEGREE_BINS - 1)
+  return np.bincount(bins, minlength=NUM_DEGREE_BINS).tolist()
+
+
+def _AbsRange(values: np.ndarray) -> Tuple[float, float]:
+  '''Smallest and largest non-zero finite absolute values, or (0, 0).'''
+  values = np.abs(values)
+  values = values[(values > 0) & np.isfinite(values)]
+  if not values.size:
+    return 0.0, 0.0
+  return float(values.min()), float(values.max())
+
+
+def _BlockCounts(names: Sequence[str], contiguous: bool,
+                 blocks: Optional[Blocks],
+                 degree: np.ndarray) -> List[Tuple[str, int, int]]:
+  '''(block name, size, sum of degree) of each non-empty block.'''
+  if blocks is None:
+    offsets = np.zeros(len(degree) + 1, dtype=np.int64)
+    np.cumsum(degree, out=offsets[1:])
+    return [(block, end - start, int(offsets[end] - offsets[start]))
+            for block, start, end in _Blocks(names, contiguous)]
+  block_names, block_of = blocks
+  sizes = np.bincount(block_of, minlength=len(block_names))
+  # Exact, as the counts are far below 2**53.
+  sums = np.bincount(block_of, weights=degree, minlength=len(block_names))
+  return [(block, size, int(total))
+          for block, size, total in zip(block_names, sizes.tolist(),
+                                        sums.tolist())
+          if size]
+
+
+def ModelStatistics(arrays: mip_arrays.MipArrays,
+                    contiguous_blocks: bool = True,
+                    var_blocks: Optional[Blocks] = None,
+                    con_blocks: Optional[Blocks] = None) -> Dict[str, Any]:
+  '''Size, structure and coefficient ranges of a model.
+
+  var_blocks and con_blocks are the blocks of the variables and constraints,
+  if the generator knows them. Otherwise they are found from the names, and
+  contiguous_blocks tells whether the variables and constraints of each block
+  are contiguous, which holds for the models of a MipArraysBuilder.
+  '''
+  num_vars = len(arrays.var_name)
+  row_degree = np.diff(arrays.row_start)
+  col_degree = np.bincount(arrays.col_index, minlength=num_vars)
+  is_binary = (arrays.is_integer & (arrays.var_lower_bound == 0.0) &
+               (arrays.var_upper_bound == 1.0))
+  statistics = {
+      'num_vars': num_vars,
+      'num_cons': len(arrays.con_name),
+      'nnz': len(arrays.col_index),
+      'num_integer_vars': int(np.count_nonzero(arrays.is_integer)),
+      'num_binary_vars': int(np.count_nonzero(is_binary)),
+      'row_degree_max': int(row_degree.max()) if row_degree.size else 0,
+      'col_degree_max': int(col_degree.max()) if col_degree.size else 0,
+      'row_degree_histogram': _DegreeHistogram(row_degree),
+      'col_degree_histogram': _DegreeHistogram(col_degree),
+  }
+  for field, values in [
+      ('coefficient', arrays.coefficient),
+      ('objective', arrays.objective),
+      ('rhs', np.concatenate([arrays.con_lower_bound,
+                              arrays.con_upper_bound])),
+  ]:
+    statistics[field + '_min'], statistics[field + '_max'] = _AbsRange(values)
+  for block, size, _ in _BlockCounts(arrays.var_name, contiguous_blocks,
+                                     var_blocks, col_degree):
+    statistics['num_vars.' + block] = (
+        statistics.get('num_vars.' + block, 0) + size)
+  for block, size, nnz in _BlockCounts(arrays.con_name, contiguous_blocks,
+                                       con_blocks, row_degree):
+    statistics['num_cons.' + block] = (
+        statistics.get('num_cons.' + block, 0) + size)
+    statistics['nnz.' + block] = statistics.get('nnz.' + block, 0) + nnz
+  return statistics
+
+
+def LoadIndex(index_file: str) -> Dict[str, np.ndarray]:
+  '''The columns of an index .npz, read from the file as they are used.'''
+  return np.load(index_file)
+
+
+def _Column(values: List[Any], num_rows: int) -> np.ndarray:
+  present = [v for v in values if v is not None]
+  if not present:
+    return np.full(num_rows, np.nan)
+  if any(isinstance(v, str) for v in present):
+    return np.array(['' if v is None else v for v in values], dtype=str)
+  if isinstance(present[0], list):
+    width = max(len(v) for v in present)
+    column = np.zeros((num_rows, width), dtype=np.int64)
+    for row, value in enumerate(values):
+      if value is not None:
+        column[row, :len(value)] = value
+    return column
+  if len(present) == num_rows and all(
+      isinstance(v, (int, np.integer)) for v in present):
+    return np.array(values, dtype=np.int64)
+  # Missing numbers are NaN.
+  return np.array([np.nan if v is None else v for v in values],
+                  dtype=np.float64)
+
+
+def _RowOrder(row: Dict[str, Any]) -> Tuple[Any, ...]:
+  '''Sorts rows by seed, then index of their instance, then output.'''
+  match = _OUTPUT_INDEX.search(row['output'])
+  seed = row.get('seed')
+  return (seed is None, seed or 0, int(match.group(1)) if match else -1,
+          row['output'])
+
+
+class IndexWriter(object):
+  '''Collects the rows of the instances of a run into the index of output.
+
+  Rows are keyed by the output prefix of their instance, and written in the
+  order of their seed and instance index (kn_2 before kn_10). The rows of an
+  existing index are kept unless the run rebuilds their instance, so that
+  instances skipped as complete keep their statistics.
+  '''
+
+  def __init__(self, output: str):
+    self._output = output
+    self._rows = {}
+    npz_file = output + NPZ_SUFFIX
+    if os.path.exists(npz_file):
+      with LoadIndex(npz_file) as index:
+        columns = {name: index[name] for name in index.files}
+      for row in range(len(columns['output'])):
+        values = {}
+        for name, column in columns.items():
+          value = column[row].tolist()
+          if isinstance(value, float) and np.isnan(value):
+            continue
+          values[name] = value
+        self._rows[values['output']] = values
+
+  def Add(self, record: Dict[str, Any]):
+    '''Adds the row of a record returned by BuildRandomizedModel.'''
+    if 'output' not in record:
+      return
+    statistics = record.get('statistics')
+    if statistics is None and record['output'] in self._rows:
+      return
+    row = {key: record.get(key) for key in _KEY_COLUMNS}
+    row.update(statistics or {})
+    self._rows[record['output']] = row
+
+  def Write(self):
+    '''Writes the .csv and .npz files of the index.'''
+    rows = sorted(self._rows.values(), key=_RowOrder)
+    names = sorted({name for row in rows for name in row} - set(_KEY_COLUMNS))
+    names = list(_KEY_COLUMNS) + names
+    columns = {
+        name: _Column([row.get(name) for row in rows], len(rows))
+        for name in names
+    }
+    with output_lib.AtomicOutput(self._output + NPZ_SUFFIX) as temp_file:
+      with open(temp_file, 'wb') as f:
+        np.savez(f, **columns)
+    scalar_names = [name for name in names if name not in _HISTOGRAMS]
+    with output_lib.AtomicOutput(self._output + CSV_SUFFIX) as temp_file:
+      with open(temp_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(scalar_names)
+        for row in rows:
+          writer.writerow(['' if row.get(name) is None else row[name]
+                           for name in scalar_names])
+    logging.info('Wrote the index of %d instances to %s', len(rows),
+                 self._output + NPZ_SUFFIX)
@@ -0,0 +1,150 @@
+import csv
+import os
+
+import numpy as np
+
+from absl.testing import absltest
+
+from common import dataset_index
+from common import mip_arrays
+
+
+def _Model() -> mip_arrays.MipArrays:
+  builder = mip_arrays.MipArraysBuilder()
+  builder.AddVariables(mip_arrays.GridNames('place', 3, 2), lower_bound=0.0,
+                       upper_bound=1.0, is_integer=True)
+  builder.AddVariables(mip_arrays.GridNames('load', 2), lower_bound=0.0,
+                       upper_bound=10.0, objective=[0.5, -4.0])
+  builder.AddConstraints(mip_arrays.GridNames('copies_ct', 3), lower_bound=1.0,
+                         upper_bound=1.0,
+                         col_index=[[0, 1], [2, 3], [4, 5]],
+                         coefficient=np.ones((3, 2)))
+  builder.AddConstraints(mip_arrays.GridNames('load_ct', 2),
+                         lower_bound=-np.inf, upper_bound=[0.0, 0.0],
+                         col_index=[[0, 2, 4, 6], [1, 3, 5, 7]],
+                         coefficient=[[2.0, 3.0, 0.25, -1.0]] * 2)
+  return builder.Build()
+
+
+class ModelStatisticsTest(absltest.TestCase):
+
+  def testStatistics(self):
+    statistics = dataset_index.ModelStatistics(_Model())
+    self.assertEqual(statistics['num_vars'], 8)
+    self.assertEqual(statistics['num_cons'], 5)
+    self.assertEqual(statistics['nnz'], 14)
+    self.assertEqual(statistics['num_integer_vars'], 6)
+    self.assertEqual(statistics['num_binary_vars'], 6)
+    self.assertEqual(statistics['row_degree_max'], 4)
+    self.assertEqual(statistics['col_degree_max'], 2)
+    # Rows of degree 2 and 4, columns of degree 2 and 1.
+    row_histogram = [0] * dataset_index.NUM_DEGREE_BINS
+    row_histogram[2], row_histogram[3] = 3, 2
+    self.assertEqual(statistics['row_degree_histogram'], row_histogram)
+    col_histogram = [0] * dataset_index.NUM_DEGREE_BINS
+    col_histogram[1], col_histogram[2] = 2, 6
+    self.assertEqual(statistics['col_degree_histogram'], col_histogram)
+    self.assertEqual(statistics['coefficient_min'], 0.25)
+    self.assertEqual(statistics['coefficient_max'], 3.0)
+    self.assertEqual(statistics['objective_min'], 0.5)
+    self.assertEqual(statistics['objective_max'], 4.0)
+    self.assertEqual(statistics['rhs_min'], 1.0)
+    self.assertEqual(statistics['rhs_max'], 1.0)
+    self.assertEqual(statistics['num_vars.place'], 6)
+    self.assertEqual(statistics['num_vars.load'], 2)
+    self.assertEqual(statistics['num_cons.copies_ct'], 3)
+    self.assertEqual(statistics['nnz.copies_ct'], 6)
+    self.assertEqual(statistics['num_cons.load_ct'], 2)
+    self.assertEqual(statistics['nnz.load_ct'], 8)
+
+  def testGivenBlocks(self):
+    # Interleaved blocks, and an empty one.
+    var_blocks = (['place', 'load', 'unused'],
+                  np.array([0, 0, 0, 1, 0, 0, 0, 1]))
+    con_blocks = (['copies_ct', 'load_ct'], np.array([0, 1, 0, 1, 0]))
+    arrays = _Model()
+    statistics = dataset_index.ModelStatistics(arrays, var_blocks=var_blocks,
+                                               con_blocks=con_blocks)
+    self.assertEqual(statistics['num_vars.place'], 6)
+    self.assertEqual(statistics['num_vars.load'], 2)
+    self.assertNotIn('num_vars.unused', statistics)
+    self.assertEqual(statistics['num_cons.copies_ct'], 3)
+    self.assertEqual(statistics['nnz.copies_ct'], 2 + 4 + 2)
+    self.assertEqual(statistics['num_cons.load_ct'], 2)
+    self.assertEqual(statistics['nnz.load_ct'], 2 + 4)
+
+  def testBlocks(self):
+    names = (['place_%d_%d' % (i, j) for i in range(7) for j in range(3)] +
+             ['load_%d' % i for i in range(100)] + ['max_load'] +
+             ['place_%d_%d' % (i, 0) for i in range(5)])
+    expected = [('place', 0, 21), ('load', 21, 121), ('max_load', 121, 122),
+                ('place', 122, 127)]
+    self.assertEqual(dataset_index._Blocks(names, contiguous=True), expected)
+    self.assertEqual(dataset_index._Blocks(names, contiguous=False), expected)
+
+
+class IndexWriterTest(absltest.TestCase):
+
+  def _Record(self, output: str, seed: int, **statistics):
+    return {'output': output, 'name': os.path.basename(output), 'seed': seed,
+            'params_hash': 'abc', 'statistics': statistics}
+
+  def testWriteAndLoad(self):
+    output = os.path.join(self.create_tempdir().full_path, 'kn')
+    writer = dataset_index.IndexWriter(output)
+    writer.Add(self._Record(output + '_0', 0, nnz=10,
+                            row_degree_histogram=[1, 2]))
+    writer.Add(self._Record(output + '_1', 1, nnz=20, num_items=3,
+                            row_degree_histogram=[0, 0, 5]))
+    # Failed instances have no output.
+    writer.Add({'index': 2, 'error': 'failed'})
+    writer.Write()
+
+    with dataset_index.LoadIndex(output + dataset_index.NPZ_SUFFIX) as index:
+      self.assertEqual(index['output'].tolist(),
+                       [output + '_0', output + '_1'])
+      self.assertEqual(index['nnz'].tolist(), [10, 20])
+      self.assertEqual(index['seed'].dtype, np.int64)
+      np.testing.assert_array_equal(index['num_items'], [np.nan, 3])
+      self.assertEqual(index['row_degree_histogram'].tolist(),
+                       [[1, 2, 0], [0, 0, 5]])
+    with open(output + dataset_index.CSV_SUFFIX, newline='') as f:
+      rows = list(csv.reader(f))
+    self.assertEqual(rows[0], ['output', 'name', 'seed', 'params_hash', 'nnz',
+                               'num_items'])
+    self.assertEqual(rows[1], [output + '_0', 'kn_0', '0', 'abc', '10', ''])
+
+  def testRowsAreInInstanceOrder(self):
+    output = os.path.join(self.create_tempdir().full_path, 'kn')
+    writer = dataset_index.IndexWriter(output)
+    for index in (10, 2, 1, 0):
+      writer.Add(self._Record('%s_%d' % (output, index), 100 + index))
+    writer.Write()
+    # Reloaded rows are sorted as well.
+    writer = dataset_index.IndexWriter(output)
+    writer.Add(self._Record(output + '_3', 103))
+    writer.Write()
+    with dataset_index.LoadIndex(output + dataset_index.NPZ_SUFFIX) as index:
+      self.assertEqual(index['seed'].tolist(), [100, 101, 102, 103, 110])
+    with open(output + dataset_index.CSV_SUFFIX, newline='') as f:
+      self.assertEqual([row[1] for row in list(csv.reader(f))[1:]],
+                       ['kn_0', 'kn_1', 'kn_2', 'kn_3', 'kn_10'])
+
+  def testKeepsRowsOfSkippedInstances(self):
+    output = os.path.join(self.create_tempdir().full_path, 'kn')
+    writer = dataset_index.IndexWriter(output)
+    writer.Add(self._Record(output + '_0', 0, nnz=10))
+    writer.Add(self._Record(output + '_1', 1, nnz=20))
+    writer.Write()
+    # A later run skips instance 0 as complete and rebuilds instance 1.
+    writer = dataset_index.IndexWriter(output)
+    writer.Add({'output': output + '_0', 'seed': 0, 'statistics': None})
+    writer.Add(self._Record(output + '_1', 1, nnz=30))
+    writer.Write()
+    with dataset_index.LoadIndex(output + dataset_index.NPZ_SUFFIX) as index:
+      self.assertEqual(index['nnz'].tolist(), [10, 30])
+      self.assertEqual(index['name'].tolist(), ['kn_0', 'kn_1'])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,236 @@
+'''Per-instance timing and resource statistics, written as JSON lines.
+
+Each instance is built with an InstanceStats that accumulates the time spent
+in every stage of its generation (sample, build, export, compress, ...) along
+with counters such as the model dimensions and the bytes written. Its ToDict()
+is what the generators return from BuildRandomizedModel, so that with a
+process pool the records travel back to the parent, where a RunSummary writes
+one JSON line per instance and a final summary line with the throughput.
+
+Memory is measured per instance: on Linux, the peak resident set size of the
+process is reset when the InstanceStats of an instance is created, so that the
+peak reported is the one of this instance rather than of the largest instance
+the worker built before. Elsewhere, it is the peak of the worker process so
+far.
+
+Recording only costs a couple of perf_counter() calls per stage and a few
+reads of /proc per instance, so it can stay on in production runs.
+'''
+
+import collections
+import contextlib
+import json
+import logging
+import resource
+import sys
+import time
+from typing import Any, Dict, Optional
+
+from common import mip_arrays
+
+
+# Counters of the instances that sampling had to fix, summed over a run.
+_SAMPLING_COUNTERS = ('rejected_samples', 'resampled_workloads',
+                      'repaired_workloads')
+
+# Memory statistics of the instances, of which a run keeps the largest.
+_PEAK_RSS_KEYS = ('peak_rss_bytes', 'peak_rss_delta_bytes')
+
+# Writing 5 to it resets the peak RSS (VmHWM) of the process to its current
+# RSS, see proc(5).
+_CLEAR_REFS_FILE = '/proc/self/clear_refs'
+_STATUS_FILE = '/proc/self/status'
+
+
+def _StatusBytes(key: bytes) -> Optional[int]:
+  '''A memory field of /proc/self/status, such as VmRSS, if available.'''
+  try:
+    with open(_STATUS_FILE, 'rb') as f:
+      for line in f:
+        if line.startswith(key + b':'):
+          return int(line.split()[1]) * 1024
+  except (OSError, ValueError):
+    pass
+  return None
+
+
+def ResetPeakRss() -> bool:
+  '''Makes the current RSS of this process its peak, where supported.'''
+  try:
+    with open(_CLEAR_REFS_FILE, 'w') as f:
+      f.write('5')
+  except OSError:
+    return False
+  return True
+
+
+def PeakRssBytes() -> int:
+  '''Peak resident set size of this process since the last ResetPeakRss.
+
+  Where the peak cannot be reset, this is the peak of the process so far.
+  '''
+  peak = _StatusBytes(b'VmHWM')
+  if peak is not None:
+    return peak
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Linux reports kilobytes, macOS bytes.
+  return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def RssBytes() -> int:
+  '''Resident set size of this process, or its peak if not available.'''
+  rss = _StatusBytes(b'VmRSS')
+  return PeakRssBytes() if rss is None else rss
+
+
+def _CompressionRatio(counters: Dict[str, int]) -> Dict[str, float]:
+  '''Uncompressed over compressed size of the MPS text, if any was written.'''
+  if not counters.get('mps_bytes') or not counters.get(
+      'mps_uncompressed_bytes'):
+    return {}
+  return {
+      'mps_compression_ratio':
+          counters['mps_uncompressed_bytes'] / counters['mps_bytes']
+  }
+
+
+class InstanceStats(object):
+  '''Statistics of the generation of one instance.
+
+  It should be created when the instance starts, which is the baseline of its
+  memory statistics (see ToDict). With reset_peak False, the peak RSS of the
+  process is left alone, for statistics that are not the ones of an instance
+  (e.g. of a single step within one).
+  '''
+
+  def __init__(self, reset_peak: bool = True, **fields):
+    self.fields = dict(fields)
+    self.seconds = collections.defaultdict(float)
+    self.counters = collections.defaultdict(int)
+    if reset_peak:
+      ResetPeakRss()
+    self._start_rss_bytes = RssBytes()
+
+  @contextlib.contextmanager
+  def Time(self, stage: str):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.seconds[stage] += time.perf_counter() - start
+
+  def AddModelSize(self, arrays: mip_arrays.MipArrays):
+    self.counters['num_vars'] = len(arrays.var_name)
+    self.counters['num_cons'] = len(arrays.con_name)
+    self.counters['nnz'] = len(arrays.col_index)
+
+  def ToDict(self) -> Dict[str, Any]:
+    '''The fields, counters and stage times of the instance.
+
+    peak_rss_bytes is the peak RSS of the process since the instance started
+    and peak_rss_delta_bytes how far it went above the RSS at the start, the
+    memory the instance needed. Where the peak cannot be reset (not Linux),
+    peak_rss_bytes is the peak of the worker process so far, and the delta
+    only counts how much the instance raised it.
+    '''
+    record = dict(self.fields)
+    record.update(self.counters)
+    record['seconds'] = dict(self.seconds)
+    peak_rss_bytes = PeakRssBytes()
+    record['peak_rss_bytes'] = peak_rss_bytes
+    record['peak_rss_delta_bytes'] = max(
+        0, peak_rss_bytes - self._start_rss_bytes)
+    record.update(_CompressionRatio(self.counters))
+    return record
+
+
+class RunSummary(object):
+  '''Collects the records of a run and writes them to stats_file.
+
+  Each record passed to Add is written as one JSON line. Finish writes a last
+  line {"summary": {...}} with the totals, and logs the throughput. The
+  totals count every instance, but output_mb_per_second only the bytes of the
+  instances built by the run, not of those taken from the cache or already
+  complete. Records
+  are also added to index_writer (a dataset_index.IndexWriter), if any,
+  which Finish writes out.
+  '''
+
+  def __init__(self, stats_file: Optional[str] = None, index_writer=None):
+    self._start = time.perf_counter()
+    self._file = open(stats_file, 'w') if stats_file else None
+    self._index_writer = index_writer
+    self._num_instances = 0
+    self._num_cached = 0
+    self._num_skipped = 0
+    self._seconds = collections.defaultdict(float)
+    self._counters = collections.defaultdict(int)
+    self._built_output_bytes = 0
+    self._peak_rss = {key: 0 for key in _PEAK_RSS_KEYS}
+
+  def Add(self, record: Dict[str, Any]):
+    self._num_instances += 1
+    self._num_cached += bool(record.get('cached'))
+    self._num_skipped += bool(record.get('skipped'))
+    if not record.get('cached') and not record.get('skipped'):
+      self._built_output_bytes += record.get('output_bytes', 0)
+    for stage, seconds in record.get('seconds', {}).items():
+      self._seconds[stage] += seconds
+    for key, value in record.items():
+      if key.endswith('bytes') and key not in _PEAK_RSS_KEYS:
+        self._counters[key] += value
+    self._counters['nnz'] += record.get('nnz', 0)
+    for key in _SAMPLING_COUNTERS:
+      self._counters[key] += record.get(key, 0)
+    for key in _PEAK_RSS_KEYS:
+      self._peak_rss[key] = max(self._peak_rss[key], record.get(key, 0))
+    if self._file:
+      self._file.write(json.dumps(record, sort_keys=True) + '\n')
+    if self._index_writer:
+      self._index_writer.Add(record)
+
+  def Finish(self, num_failures: int = 0) -> Dict[str, Any]:
+    wall_seconds = time.perf_counter() - self._start
+    rate = 1.0 / wall_seconds if wall_seconds > 0 else 0.0
+    summary = {
+        'instances': self._num_instances,
+        'cached': self._num_cached,
+        'skipped': self._num_skipped,
+        'failures': num_failures,
+        'wall_seconds': wall_seconds,
+        'instances_per_second': self._num_instances * rate,
+        'output_mb_per_second': self._built_output_bytes * rate / 2**20,
+        'seconds': dict(self._seconds),
+    }
+    summary.update(self._peak_rss)
+    summary.update(self._counters)
+    summary.update(_CompressionRatio(self._counters))
+    if self._file:
+      self._file.write(json.dumps({'summary': summary}, sort_keys=True) + '\n')
+      self._file.close()
+      self._file = None
+    if self._index_writer:
+      self._index_writer.Write()
+      self._index_writer = None
+    logging.info(
+        'Built %d instances (%d from the cache, %d already complete, %d '
+        'failed) in %.1fs: %.2f instances/s, %.2f MB/s written',
+        self._num_instances, self._num_cached, self._num_skipped,
+        num_failures, wall_seconds,
+        summary['instances_per_second'], summary['output_mb_per_second'])
+    if summary.get('rejected_samples'):
+      built = self._num_instances - self._num_cached - self._num_skipped
+      logging.info(
+          'Rejected %d samples that may be infeasible, accepted %d of %d '
+          '(%.1f%%)', summary['rejected_samples'], built,
+          built + summary['rejected_samples'],
+          100.0 * built / (built + summary['rejected_samples']))
+    if summary.get('resampled_workloads') or summary.get('repaired_workloads'):
+      logging.info('Resampled %d and repaired %d non-resilient workloads',
+                   summary['resampled_workloads'],
+                   summary['repaired_workloads'])
+    if 'mps_compression_ratio' in summary:
+      logging.info('Compressed MPS text %.2fx in %.1fs',
+                   summary['mps_compression_ratio'],
+                   self._seconds['compress'])
+    return summary
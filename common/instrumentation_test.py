@@ -0,0 +1,89 @@
+import json
+from unittest import mock
+
+import numpy as np
+
+from absl.testing import absltest
+
+from common import instrumentation
+
+
+class InstanceStatsTest(absltest.TestCase):
+
+  def testPeakRssIsPerInstance(self):
+    size = 64 << 20
+    large = instrumentation.InstanceStats(name='large')
+    data = np.ones(size, dtype=np.uint8)
+    del data
+    large_record = large.ToDict()
+    self.assertGreater(large_record['peak_rss_delta_bytes'], size * 3 // 4)
+    small = instrumentation.InstanceStats(name='small')
+    small_record = small.ToDict()
+    if not instrumentation.ResetPeakRss():
+      self.skipTest('The peak RSS cannot be reset')
+    # The instance built before does not count towards the peak.
+    self.assertLess(small_record['peak_rss_delta_bytes'], size // 4)
+    self.assertLess(small_record['peak_rss_bytes'],
+                    large_record['peak_rss_bytes'] - size // 2)
+
+  def testResetPeak(self):
+    with mock.patch.object(instrumentation, 'ResetPeakRss') as reset_peak_rss:
+      instrumentation.InstanceStats(name='kn_0')
+      reset_peak_rss.assert_called_once()
+      stats = instrumentation.InstanceStats(reset_peak=False, name='kn_0')
+      reset_peak_rss.assert_called_once()
+    self.assertEqual(stats.fields, {'name': 'kn_0'})
+
+  def testToDict(self):
+    stats = instrumentation.InstanceStats(name='kn_0')
+    with stats.Time('build'):
+      pass
+    stats.counters['mps_bytes'] = 10
+    stats.counters['mps_uncompressed_bytes'] = 40
+    record = stats.ToDict()
+    self.assertEqual(record['name'], 'kn_0')
+    self.assertEqual(list(record['seconds']), ['build'])
+    self.assertEqual(record['mps_compression_ratio'], 4.0)
+
+
+class RunSummaryTest(absltest.TestCase):
+
+  def testSummary(self):
+    stats_file = self.create_tempfile().full_path
+    summary = instrumentation.RunSummary(stats_file)
+    summary.Add({'nnz': 10, 'output_bytes': 100, 'peak_rss_bytes': 5000,
+                 'peak_rss_delta_bytes': 300, 'seconds': {'build': 1.0}})
+    summary.Add({'nnz': 20, 'output_bytes': 50, 'peak_rss_bytes': 4000,
+                 'peak_rss_delta_bytes': 700, 'seconds': {'build': 0.5},
+                 'cached': True})
+    result = summary.Finish(num_failures=1)
+    self.assertEqual(result['instances'], 2)
+    self.assertEqual(result['cached'], 1)
+    self.assertEqual(result['failures'], 1)
+    self.assertEqual(result['nnz'], 30)
+    self.assertEqual(result['output_bytes'], 150)
+    # Memory is the largest of the instances, not their sum.
+    self.assertEqual(result['peak_rss_bytes'], 5000)
+    self.assertEqual(result['peak_rss_delta_bytes'], 700)
+    self.assertEqual(result['seconds'], {'build': 1.5})
+    with open(stats_file) as f:
+      lines = [json.loads(line) for line in f]
+    self.assertLen(lines, 3)
+    self.assertEqual(lines[-1]['summary']['nnz'], 30)
+
+  def testOutputRate(self):
+    with mock.patch.object(instrumentation.time, 'perf_counter',
+                           side_effect=[10.0, 12.0]):
+      summary = instrumentation.RunSummary()
+      summary.Add({'output_bytes': 2 << 20})
+      summary.Add({'output_bytes': 7 << 20, 'cached': True})
+      summary.Add({'output_bytes': 9 << 20, 'skipped': True})
+      result = summary.Finish()
+    self.assertEqual(result['wall_seconds'], 2.0)
+    self.assertEqual(result['output_bytes'], 18 << 20)
+    # Only the bytes written by the run count towards its throughput.
+    self.assertEqual(result['output_mb_per_second'], 1.0)
+
+
+if __name__ == '__main__':
+  absltest.main()
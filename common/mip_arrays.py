@@ -0,0 +1,366 @@
+'''Array-based representation of MIP models shared by the generators.
+
+Models are assembled block by block with MipArraysBuilder and stored as a
+MipArrays tuple: per-variable and per-constraint NumPy arrays plus the
+constraint matrix in CSR form (row_start, col_index, coefficient). A MipArrays
+is converted into an MPModelProto in one bulk step by encoding the protobuf
+wire format with NumPy and parsing it once, instead of adding fields one at a
+time.
+'''
+
+import collections
+import itertools
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ortools.linear_solver import linear_solver_pb2
+
+MipArrays = collections.namedtuple('MipArrays', [
+    'var_name',
+    'var_lower_bound',
+    'var_upper_bound',
+    'objective',
+    'is_integer',
+    'con_name',
+    'con_lower_bound',
+    'con_upper_bound',
+    'row_start',
+    'col_index',
+    'coefficient',
+])
+
+
+class MipArraysBuilder(object):
+  '''Accumulates blocks of variables and constraints into a MipArrays.'''
+
+  def __init__(self):
+    self._num_vars = 0
+    self._var_blocks = []
+    self._con_blocks = []
+
+  @property
+  def num_vars(self) -> int:
+    return self._num_vars
+
+  def AddVariables(self, names: List[str], lower_bound, upper_bound,
+                   objective=0.0, is_integer=False) -> np.ndarray:
+    '''Adds len(names) variables and returns their indices.
+
+    The bounds, objective and integrality are broadcast to len(names).
+    '''
+    n = len(names)
+    self._var_blocks.append((
+        list(names),
+        np.broadcast_to(np.asarray(lower_bound, dtype=np.float64), (n,)),
+        np.broadcast_to(np.asarray(upper_bound, dtype=np.float64), (n,)),
+        np.broadcast_to(np.asarray(objective, dtype=np.float64), (n,)),
+        np.broadcast_to(np.asarray(is_integer, dtype=bool), (n,)),
+    ))
+    indices = np.arange(self._num_vars, self._num_vars + n, dtype=np.int64)
+    self._num_vars += n
+    return indices
+
+  def AddConstraints(self, names: List[str], lower_bound, upper_bound,
+                     col_index: np.ndarray, coefficient: np.ndarray,
+                     row_length=None):
+    '''Adds len(names) constraints.
+
+    If row_length is None, col_index and coefficient are (rows x k) arrays
+    holding the k terms of each row. Otherwise they are flat arrays holding
+    row_length[j] terms for the j-th row, one row after the other.
+    '''
+    n = len(names)
+    col_index = np.asarray(col_index, dtype=np.int64)
+    coefficient = np.broadcast_to(
+        np.asarray(coefficient, dtype=np.float64), col_index.shape).reshape(-1)
+    if row_length is None:
+      assert col_index.shape[0] == n
+      row_length = np.full(n, col_index[0].size if n else 0, dtype=np.int64)
+    col_index = col_index.reshape(-1)
+    row_length = np.asarray(row_length, dtype=np.int64)
+    assert row_length.shape == (n,) and row_length.sum() == col_index.size
+    self._con_blocks.append((
+        list(names),
+        np.broadcast_to(np.asarray(lower_bound, dtype=np.float64), (n,)),
+        np.broadcast_to(np.asarray(upper_bound, dtype=np.float64), (n,)),
+        row_length,
+        col_index,
+        coefficient,
+    ))
+
+  def Build(self) -> MipArrays:
+    var_columns = list(zip(*self._var_blocks)) or [[]] * 5
+    con_columns = list(zip(*self._con_blocks)) or [[]] * 6
+    row_length = _Concatenate(con_columns[3], np.int64)
+    row_start = np.zeros(len(row_length) + 1, dtype=np.int64)
+    np.cumsum(row_length, out=row_start[1:])
+    return MipArrays(
+        var_name=[name for block in var_columns[0] for name in block],
+        var_lower_bound=_Concatenate(var_columns[1], np.float64),
+        var_upper_bound=_Concatenate(var_columns[2], np.float64),
+        objective=_Concatenate(var_columns[3], np.float64),
+        is_integer=_Concatenate(var_columns[4], bool),
+        con_name=[name for block in con_columns[0] for name in block],
+        con_lower_bound=_Concatenate(con_columns[1], np.float64),
+        con_upper_bound=_Concatenate(con_columns[2], np.float64),
+        row_start=row_start,
+        col_index=_Concatenate(con_columns[4], np.int64),
+        coefficient=_Concatenate(con_columns[5], np.float64),
+    )
+
+
+def GridNames(prefix: str, *shape: int) -> List[str]:
+  '''Returns the names prefix_i_j_... for all indices of shape, row-major.'''
+  names = [prefix]
+  for n in shape:
+    suffixes = ['_%d' % k for k in range(n)]
+    names = [name + suffix for name in names for suffix in suffixes]
+  return names
+
+
+def _Concatenate(blocks: Sequence[np.ndarray], dtype) -> np.ndarray:
+  if not blocks:
+    return np.zeros(0, dtype=dtype)
+  return np.concatenate(blocks).astype(dtype, copy=False)
+
+
+def MipArraysToMPModelProto(
+    arrays: MipArrays,
+    name: Optional[str] = None) -> linear_solver_pb2.MPModelProto:
+  '''Converts a MipArrays into an MPModelProto.
+
+  Every variable gets its name, bounds and is_integer set, and its objective
+  coefficient when non-zero. Every constraint gets its name and its finite
+  bounds. This is the set of fields the knapsack generator used to set one by
+  one, so its models serialize to the same bytes. A MipArrays does not record
+  which fields were set, though: the model of MPModelProtoToMipArrays(model)
+  has the same field values as model, but a field holding its default value
+  (e.g. is_integer False or an infinite upper bound) may be present in one and
+  not the other, so the two may serialize differently. The model is named
+  name, if given.
+  '''
+  model_proto = linear_solver_pb2.MPModelProto()
+  model_proto.MergeFromString(MipArraysToBytes(arrays, name))
+  return model_proto
+
+
+def MipArraysToBytes(arrays: MipArrays, name: Optional[str] = None) -> bytes:
+  '''Returns the serialized MPModelProto of arrays, named name if given.
+
+  Same bytes as MipArraysToMPModelProto(arrays) with name set, serialized,
+  without building the message.
+  '''
+  serialized = (_EncodeVariables(arrays).tobytes() +
+                _EncodeConstraints(arrays).tobytes())
+  if name is not None:
+    # MPModelProto.name = 5.
+    serialized += _Interleave(_StringField(5, [name]))[1].tobytes()
+  return serialized
+
+
+# The rest of this file encodes messages in the protobuf wire format. A segment
+# is a pair (lengths, flat): the number of bytes it contributes to each message,
+# and all those bytes concatenated in message order. Fields are encoded as lists
+# of segments, and each top-level repeated field is assembled by a single call
+# to _Interleave.
+
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+
+
+def _Tag(field_number: int, wire_type: int) -> int:
+  tag = (field_number << 3) | wire_type
+  assert tag < 0x80
+  return tag
+
+
+def _EncodeVarints(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  values = np.asarray(values, dtype=np.int64)
+  assert not np.any(values < 0)
+  max_value = int(values.max()) if len(values) else 0
+  if max_value < 1 << 32:
+    values = values.astype(np.uint32)
+  num_bytes = max(1, (max_value.bit_length() + 6) // 7)
+  # lengths[j] is the number of bytes of values[j], byte k holding bits
+  # [7k, 7k + 7) and the continuation bit set on all but the last byte.
+  lengths = np.ones(len(values), dtype=np.int64)
+  for k in range(1, num_bytes):
+    lengths += values >= (1 << (7 * k))
+  chunks = np.empty((len(values), num_bytes), dtype=np.uint8)
+  for k in range(num_bytes):
+    chunks[:, k] = (values >> (7 * k)) & 0x7f
+    chunks[:, k] |= (lengths > k + 1).view(np.uint8) << 7
+  if num_bytes == 1:
+    return lengths, chunks.reshape(-1)
+  return lengths, chunks[np.arange(num_bytes) < lengths[:, None]]
+
+
+# Segments averaging more bytes per message than this are copied one slice per
+# message, which beats scattering them byte by byte.
+_SLICE_COPY_MIN_BYTES = 256
+
+
+def _Interleave(segments) -> Tuple[np.ndarray, np.ndarray]:
+  '''Concatenates, for each message, its bytes from every segment in order.'''
+  lengths = np.stack([seg_lengths for seg_lengths, _ in segments], axis=1)
+  offsets = (np.cumsum(lengths.ravel()) - lengths.ravel()).reshape(
+      lengths.shape)
+  out = np.empty(lengths.sum(), dtype=np.uint8)
+  for j, (seg_lengths, seg_flat) in enumerate(segments):
+    width = int(seg_lengths.max()) if len(seg_lengths) else 0
+    if len(seg_flat) == width * np.count_nonzero(seg_lengths):
+      # Fixed width: every message gets either nothing or width bytes.
+      dest = offsets[seg_lengths > 0, j][:, None] + np.arange(width)
+      out[dest.reshape(-1)] = seg_flat
+      continue
+    seg_starts = np.cumsum(seg_lengths) - seg_lengths
+    if len(seg_flat) > _SLICE_COPY_MIN_BYTES * len(seg_lengths):
+      for dst, src, n in zip(offsets[:, j].tolist(), seg_starts.tolist(),
+                             seg_lengths.tolist()):
+        out[dst:dst + n] = seg_flat[src:src + n]
+      continue
+    dest = np.repeat(offsets[:, j] - seg_starts, seg_lengths)
+    dest += np.arange(len(seg_flat), dtype=np.int64)
+    out[dest] = seg_flat
+  return lengths.sum(axis=1), out
+
+
+def _Constant(num_messages: int, value: int) -> Tuple[np.ndarray, np.ndarray]:
+  return (np.ones(num_messages, dtype=np.int64),
+          np.full(num_messages, value, dtype=np.uint8))
+
+
+def _Masked(mask: np.ndarray,
+            segment: Tuple[np.ndarray, np.ndarray]) -> Tuple[np.ndarray,
+                                                              np.ndarray]:
+  '''Expands a segment encoded only for messages where mask is set.'''
+  lengths = np.zeros(len(mask), dtype=np.int64)
+  lengths[mask] = segment[0]
+  return lengths, segment[1]
+
+
+def _DoubleField(field_number: int, values: np.ndarray, present: np.ndarray):
+  rows = np.empty((np.count_nonzero(present), 9), dtype=np.uint8)
+  rows[:, 0] = _Tag(field_number, _FIXED64)
+  rows[:, 1:] = np.ascontiguousarray(
+      values[present], dtype='<f8').view(np.uint8).reshape(-1, 8)
+  return [(present.astype(np.int64) * 9, rows.reshape(-1))]
+
+
+def _BoolField(field_number: int, values: np.ndarray):
+  rows = np.empty((len(values), 2), dtype=np.uint8)
+  rows[:, 0] = _Tag(field_number, _VARINT)
+  rows[:, 1] = values
+  return [(np.full(len(values), 2, dtype=np.int64), rows.reshape(-1))]
+
+
+def _LengthDelimitedField(field_number: int, payload, present=None):
+  payload_lengths = sum(seg_lengths for seg_lengths, _ in payload)
+  if present is None:
+    present = np.ones(len(payload_lengths), dtype=bool)
+  num_present = np.count_nonzero(present)
+  return [
+      _Masked(present,
+              _Constant(num_present, _Tag(field_number, _LENGTH_DELIMITED))),
+      _Masked(present, _EncodeVarints(payload_lengths[present])),
+  ] + payload
+
+
+def _StringField(field_number: int, strings: List[str]):
+  joined = ''.join(strings).encode('utf-8')
+  if len(joined) == sum(map(len, strings)):
+    # Only ASCII, so string lengths are byte lengths.
+    lengths = np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+  else:
+    lengths = np.fromiter((len(s.encode('utf-8')) for s in strings),
+                          dtype=np.int64, count=len(strings))
+  flat = np.frombuffer(joined, dtype=np.uint8)
+  return _LengthDelimitedField(field_number, [(lengths, flat)])
+
+
+def _EncodeVariables(arrays: MipArrays) -> np.ndarray:
+  # MPVariableProto fields: lower_bound = 1, upper_bound = 2,
+  # objective_coefficient = 3, is_integer = 4, name = 5.
+  lb = arrays.var_lower_bound
+  ub = arrays.var_upper_bound
+  obj = arrays.objective
+  body = (
+      _DoubleField(1, lb, np.isfinite(lb)) +
+      _DoubleField(2, ub, np.isfinite(ub)) +
+      _DoubleField(3, obj, obj != 0.0) +
+      _BoolField(4, arrays.is_integer) +
+      _StringField(5, arrays.var_name))
+  # MPModelProto.variable = 3.
+  return _Interleave(_LengthDelimitedField(3, body))[1]
+
+
+def _EncodeConstraints(arrays: MipArrays) -> np.ndarray:
+  # MPConstraintProto fields: lower_bound = 2, upper_bound = 3, name = 4,
+  # var_index = 6 (packed), coefficient = 7 (packed).
+  lb = arrays.con_lower_bound
+  ub = arrays.con_upper_bound
+  row_start = arrays.row_start
+  non_empty = row_start[1:] > row_start[:-1]
+  index_lengths, index_flat = _EncodeVarints(arrays.col_index)
+  index_offsets = np.zeros(len(index_lengths) + 1, dtype=np.int64)
+  np.cumsum(index_lengths, out=index_offsets[1:])
+  index_payload = (index_offsets[row_start[1:]] - index_offsets[row_start[:-1]],
+                   index_flat)
+  coefficient_payload = (
+      8 * (row_start[1:] - row_start[:-1]),
+      np.ascontiguousarray(arrays.coefficient, dtype='<f8').view(np.uint8))
+  body = (
+      _DoubleField(2, lb, np.isfinite(lb)) +
+      _DoubleField(3, ub, np.isfinite(ub)) +
+      _StringField(4, arrays.con_name) +
+      _LengthDelimitedField(6, [index_payload], non_empty) +
+      _LengthDelimitedField(7, [coefficient_payload], non_empty))
+  # MPModelProto.constraint = 4.
+  return _Interleave(_LengthDelimitedField(4, body))[1]
+
+
+def MPModelProtoToMipArrays(
+    model_proto: linear_solver_pb2.MPModelProto) -> MipArrays:
+  '''Converts an MPModelProto into a MipArrays (the inverse conversion).
+
+  Fields that are not set read as their default value; which fields were set
+  is not kept, see MipArraysToMPModelProto.
+  '''
+  variables = model_proto.variable
+  constraints = model_proto.constraint
+  num_vars = len(variables)
+  num_cons = len(constraints)
+  row_length = np.fromiter((len(c.var_index) for c in constraints),
+                           dtype=np.int64, count=num_cons)
+  row_start = np.zeros(num_cons + 1, dtype=np.int64)
+  np.cumsum(row_length, out=row_start[1:])
+  nnz = int(row_start[-1])
+
+  def VarField(field):
+    return np.fromiter((getattr(v, field) for v in variables),
+                       dtype=np.float64, count=num_vars)
+
+  def ConField(field):
+    return np.fromiter((getattr(c, field) for c in constraints),
+                       dtype=np.float64, count=num_cons)
+
+  return MipArrays(
+      var_name=[v.name for v in variables],
+      var_lower_bound=VarField('lower_bound'),
+      var_upper_bound=VarField('upper_bound'),
+      objective=VarField('objective_coefficient'),
+      is_integer=np.fromiter((v.is_integer for v in variables), dtype=bool,
+                             count=num_vars),
+      con_name=[c.name for c in constraints],
+      con_lower_bound=ConField('lower_bound'),
+      con_upper_bound=ConField('upper_bound'),
+      row_start=row_start,
+      col_index=np.fromiter(
+          itertools.chain.from_iterable(c.var_index for c in constraints),
+          dtype=np.int64, count=nnz),
+      coefficient=np.fromiter(
+          itertools.chain.from_iterable(c.coefficient for c in constraints),
+          dtype=np.float64, count=nnz),
+  )
@@ -0,0 +1,177 @@
+'''Streaming anonymization of free MPS files, without a solver.
+
+Renames the problem, its rows and its columns the way anonymize.py does with
+CPLEX: with CPLEX's numbering (rows in ROWS order, without the objective;
+columns in order of first appearance), the i-th column is renamed
+str(column_permutation[i]) and the i-th row str(row_permutation[i]), both
+permutations being drawn from rng in that order by random.shuffle. The
+objective row keeps its name, and comment lines (which may mention the
+original names) are dropped. Free rows other than the objective are dropped
+as CPLEX does when reading them.
+
+The input is read twice, line by line: once to number the names, once to
+rewrite them. Memory holds the name mappings, not the model.
+
+Free MPS with the RHS, RANGES and BOUNDS set names present is supported,
+which is what the generators and most solvers write.
+'''
+
+import csv
+import gzip
+import random
+from typing import BinaryIO, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from common import output as output_lib
+
+
+def _OpenText(filename: str) -> TextIO:
+  if filename.endswith('.gz'):
+    return gzip.open(filename, 'rt', encoding='utf-8')
+  return open(filename, 'r', encoding='utf-8')
+
+
+def _Lines(mps_file: TextIO) -> Iterator[Tuple[str, str, List[str]]]:
+  '''Yields (section, line, tokens) for each data line of mps_file.
+
+  Section header lines are yielded with tokens == [] and line being the
+  header; comments and blank lines are skipped.
+  '''
+  section = ''
+  for line in mps_file:
+    tokens = line.split()
+    if not tokens or line[0] == '*':
+      continue
+    if line[0] in ' \t':
+      yield section, line, tokens
+    else:
+      section = tokens[0]
+      yield section, line.rstrip('\n'), []
+
+
+class _Names(object):
+  '''Numbering of the rows and columns of an MPS file, as CPLEX reads it.'''
+
+  def __init__(self):
+    self.objective = None
+    self.rows = {}
+    self.dropped_rows = set()
+    self.columns = {}
+
+  def Read(self, mps_file: TextIO):
+    for section, _, tokens in _Lines(mps_file):
+      if not tokens:
+        continue
+      if section == 'ROWS':
+        row_type, row = tokens
+        if row_type.upper() == 'N':
+          if self.objective is None:
+            self.objective = row
+          else:
+            self.dropped_rows.add(row)
+        else:
+          self.rows.setdefault(row, len(self.rows))
+      elif section == 'COLUMNS':
+        if "'MARKER'" not in tokens:
+          self.columns.setdefault(tokens[0], len(self.columns))
+      elif section == 'BOUNDS':
+        self.columns.setdefault(tokens[2], len(self.columns))
+
+
+def _Permutation(n: int, rng) -> List[int]:
+  # Same as anonymize.permutation, with rng instead of the random module.
+  all_ints = list(range(n))
+  rng.shuffle(all_ints)
+  return all_ints
+
+
+def AnonymizeMps(in_file: str,
+                 out_file: str,
+                 name: str,
+                 rng=random,
+                 mapping_file: Optional[str] = None,
+                 out_fileobj: Optional[BinaryIO] = None,
+                 mapping_fileobj: Optional[BinaryIO] = None) -> Dict[str, int]:
+  '''Writes an anonymized copy of the MPS file in_file to out_file.
+
+  Both are gzipped if their names end with .gz. rng is the random module or a
+  random.Random; with the random module in the same state, the new names are
+  the ones anonymize.anonymize_problem gives. If mapping_file is set, a CSV
+  (gzipped if it ends with .gz) of kind, original name, new name is written
+  there to reverse the renaming. If out_fileobj (mapping_fileobj) is given,
+  the bytes go there instead, out_file (mapping_file) only naming them, see
+  output.OpenTextOutput.
+
+  Returns the number of rows and columns.
+  '''
+  names = _Names()
+  with _OpenText(in_file) as mps_file:
+    names.Read(mps_file)
+  # Same order as anonymize_problem: columns first, then rows.
+  column_permutation = _Permutation(len(names.columns), rng)
+  row_permutation = _Permutation(len(names.rows), rng)
+  new_columns = {
+      column: str(column_permutation[i]) for column, i in names.columns.items()
+  }
+  new_rows = {row: str(row_permutation[i]) for row, i in names.rows.items()}
+  if names.objective is not None:
+    new_rows[names.objective] = names.objective
+
+  if mapping_file:
+    with output_lib.OpenTextOutput(mapping_file,
+                                   fileobj=mapping_fileobj) as f:
+      writer = csv.writer(f)
+      writer.writerow(['kind', 'original', 'anonymized'])
+      for column, new_column in new_columns.items():
+        writer.writerow(['column', column, new_column])
+      for row, new_row in new_rows.items():
+        writer.writerow(['row', row, new_row])
+
+  with _OpenText(in_file) as mps_file, output_lib.OpenTextOutput(
+      out_file, fileobj=out_fileobj) as out:
+    _Rewrite(mps_file, out, name, new_rows, new_columns, names.dropped_rows)
+  return {'rows': len(names.rows), 'columns': len(names.columns)}
+
+
+def _Rewrite(mps_file: TextIO, out: TextIO, name: str, new_rows: Dict[str, str],
+             new_columns: Dict[str, str], dropped_rows):
+  chunk = []
+  chunk_size = 0
+  for section, line, tokens in _Lines(mps_file):
+    if not tokens:
+      if section == 'NAME':
+        line = 'NAME          %s' % name
+      chunk.append(line + '\n')
+    elif section == 'ROWS':
+      if tokens[1] in dropped_rows:
+        continue
+      chunk.append(' %s  %s\n' % (tokens[0], new_rows[tokens[1]]))
+    elif section == 'COLUMNS':
+      if "'MARKER'" in tokens:
+        chunk.append(line)
+        continue
+      pairs = [
+          '  %s  %s' % (new_rows[tokens[k]], tokens[k + 1])
+          for k in range(1, len(tokens), 2)
+          if tokens[k] not in dropped_rows
+      ]
+      if pairs:
+        chunk.append('    %s%s\n' % (new_columns[tokens[0]], ''.join(pairs)))
+    elif section in ('RHS', 'RANGES'):
+      pairs = [
+          '  %s  %s' % (new_rows[tokens[k]], tokens[k + 1])
+          for k in range(1, len(tokens), 2)
+          if tokens[k] not in dropped_rows
+      ]
+      if pairs:
+        chunk.append('    %s%s\n' % (tokens[0], ''.join(pairs)))
+    elif section == 'BOUNDS':
+      tokens[2] = new_columns[tokens[2]]
+      chunk.append(' ' + ' '.join(tokens) + '\n')
+    else:
+      chunk.append(line)
+    chunk_size += 1
+    if chunk_size >= 4096:
+      out.write(''.join(chunk))
+      chunk = []
+      chunk_size = 0
+  out.write(''.join(chunk))
@@ -0,0 +1,117 @@
+import csv
+import io
+import os
+import random
+
+import numpy as np
+
+from absl.testing import absltest
+
+from common import mip_arrays
+from common import mps_anonymizer
+from common import mps_reader
+from common import mps_writer
+
+
+def _Model() -> mip_arrays.MipArrays:
+  '''Integer and continuous columns, and rows of each sense.'''
+  rng = np.random.default_rng(0)
+  builder = mip_arrays.MipArraysBuilder()
+  builder.AddVariables(mip_arrays.GridNames('b', 8), lower_bound=0.0,
+                       upper_bound=rng.integers(1, 5, 8),
+                       objective=rng.choice([-3, -1, 2, 7], 8),
+                       is_integer=True)
+  builder.AddVariables(mip_arrays.GridNames('x', 12),
+                       lower_bound=np.round(rng.normal(size=12), 2),
+                       upper_bound=np.inf,
+                       objective=np.round(rng.uniform(0.5, 20, 12), 3))
+  col_index = np.sort(np.stack(
+      [rng.choice(20, 5, replace=False) for _ in range(10)]), axis=1)
+  rhs = np.round(rng.normal(size=10) * 10, 1)
+  sense = np.arange(10) % 3
+  builder.AddConstraints(
+      mip_arrays.GridNames('ct', 10),
+      lower_bound=np.where(sense == 1, -np.inf, rhs),
+      upper_bound=np.where(sense == 0, np.inf, rhs),
+      col_index=col_index,
+      coefficient=np.round(rng.uniform(1, 5, (10, 5)), 2))
+  return builder.Build()
+
+
+class AnonymizeMpsTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    text = io.StringIO()
+    mps_writer.WriteMps(text, _Model(), name='original')
+    self.in_file = self.create_tempfile('in.mps',
+                                        content=text.getvalue()).full_path
+
+  def _Anonymize(self, seed: int):
+    directory = self.create_tempdir().full_path
+    out_file = os.path.join(directory, 'out.mps.gz')
+    mapping_file = os.path.join(directory, 'mapping.csv')
+    self.assertEqual(
+        mps_anonymizer.AnonymizeMps(self.in_file, out_file, 'anonymous',
+                                    random.Random(seed), mapping_file),
+        {'rows': 10, 'columns': 20})
+    return out_file, mapping_file
+
+  def testSameModelUpToRenaming(self):
+    out_file, mapping_file = self._Anonymize(3)
+    original, _ = mps_reader.ReadMps(self.in_file)
+    anonymized, metadata = mps_reader.ReadMps(out_file)
+    self.assertEqual(metadata['name'], 'anonymous')
+
+    new_names = {'column': {}, 'row': {}}
+    with open(mapping_file, newline='') as f:
+      reader = csv.reader(f)
+      self.assertEqual(next(reader), ['kind', 'original', 'anonymized'])
+      for kind, name, new_name in reader:
+        new_names[kind][name] = new_name
+    columns, rows = new_names['column'], new_names['row']
+    self.assertCountEqual(columns, original.var_name)
+    self.assertCountEqual(columns.values(), [str(i) for i in range(20)])
+    # The objective row keeps its name.
+    self.assertEqual(rows.pop('COST'), 'COST')
+    self.assertCountEqual(rows, original.con_name)
+    self.assertCountEqual(rows.values(), [str(i) for i in range(10)])
+
+    var_index = {name: i for i, name in enumerate(anonymized.var_name)}
+    permutation = [var_index[columns[name]] for name in original.var_name]
+    self.assertCountEqual(permutation, range(20))
+    for field in ('var_lower_bound', 'var_upper_bound', 'objective',
+                  'is_integer'):
+      np.testing.assert_array_equal(
+          getattr(anonymized, field)[permutation], getattr(original, field),
+          err_msg=field)
+
+    def Rows(arrays, column_names):
+      return {
+          con_name: (arrays.con_lower_bound[i], arrays.con_upper_bound[i], {
+              column_names[arrays.var_name[j]]: c for j, c in zip(
+                  arrays.col_index[arrays.row_start[i]:
+                                   arrays.row_start[i + 1]],
+                  arrays.coefficient[arrays.row_start[i]:
+                                     arrays.row_start[i + 1]])
+          }) for i, con_name in enumerate(arrays.con_name)
+      }
+
+    expected_rows = Rows(original, columns)
+    self.assertEqual(
+        Rows(anonymized, {name: name for name in anonymized.var_name}),
+        {rows[name]: row for name, row in expected_rows.items()})
+
+  def testDeterministic(self):
+    outputs = []
+    for seed in (3, 3, 4):
+      out_file, mapping_file = self._Anonymize(seed)
+      with open(out_file, 'rb') as f, open(mapping_file, 'rb') as g:
+        outputs.append((f.read(), g.read()))
+    self.assertEqual(outputs[1], outputs[0])
+    self.assertNotEqual(outputs[2][0], outputs[0][0])
+    self.assertNotEqual(outputs[2][1], outputs[0][1])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,709 @@
+'''Vectorized reader of models in MPS format.
+
+ReadMps loads an MPS file, plain, gzip or zstd compressed, into a MipArrays.
+The text is read in chunks of whole lines and each chunk is tokenized at once
+with NumPy: tokens are the runs of bytes that are not whitespace, names are
+gathered as fixed-width byte strings and looked up by their 64-bit hashes in
+an open-addressing table, and numbers are parsed by a NumPy cast. No Python
+object is made per line, name or non-zero, and names are returned as
+npz_format.PackedNames.
+
+Free MPS is read as mps_writer.WriteMps and most solvers write it, with or
+without the RHS, RANGES and BOUNDS set names. With fixed_format, the fields of
+data lines are instead taken at their columns (2, 5, 15, 25, 40 and 50), each
+running up to the next one, so that names may hold spaces and set names may
+be blank. Fixed MPS files whose names have no spaces are read the same way in
+both formats.
+
+Rows are numbered in ROWS order. The objective is the first N row, and the
+other N rows are free constraints. Columns are numbered in order of first
+appearance, in COLUMNS then in BOUNDS: for the files of WriteMps, that is the
+order of the variables of the model when its integer variables come first,
+and otherwise the integer ones are moved to the front. Numbers are the values
+written in the file, i.e. rounded to the precision of WriteMps: writing the
+MipArrays read from a file of WriteMps again gives back the same text, up to
+that order.
+'''
+
+import math
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from common import compression
+from common import mip_arrays
+from common import npz_format
+
+# Size of the blocks of text tokenized at once.
+_CHUNK_SIZE = 4 << 20
+
+# Bounds and right-hand sides of at least this magnitude are infinite.
+_INFINITY = 1e30
+
+# Keys of the comment lines WriteMps writes for every model.
+_STANDARD_HEADER_FIELDS = frozenset(
+    ['Name', 'Format', 'Constraints', 'Variables', 'Binary', 'Integer',
+     'Continuous'])
+
+_SPACE = ord(' ')
+_NEWLINE = ord('\n')
+_COMMENT = ord('*')
+_QUOTE = ord("'")
+
+# Multiplier combining the 8-byte words of a name into its hash.
+_HASH_MULTIPLIER = np.uint64(0x9e3779b97f4a7c15)
+
+_ROW_TYPES = np.frombuffer(b'NELG', dtype=np.uint8)
+
+# Offsets in their line of the six fields of fixed MPS data lines.
+_FIELD_STARTS = np.array([1, 4, 14, 24, 39, 49])
+
+# The low i bytes of a word, for i in [0, 8].
+_BYTE_MASKS = np.array([(1 << (8 * i)) - 1 for i in range(9)], dtype=np.uint64)
+
+# Integers of up to 8 digits are parsed from a word holding one digit per
+# byte: bytes of digits turn into bytes of at most 9 when xor-ed with '0',
+# and into bytes of at least 0x80 when _DIGIT_OVERFLOW is added to them
+# otherwise. Each of the _SWAR_STEPS (mask, multiplier, shift) merges pairs of
+# numbers of 1, 2 then 4 digits.
+_ZERO_DIGITS = np.uint64(0x3030303030303030)
+_DIGIT_OVERFLOW = np.uint64(0x7676767676767676)
+_HIGH_BITS = np.uint64(0x8080808080808080)
+_SWAR_STEPS = [
+    (np.uint64(0x0f0f0f0f0f0f0f0f), np.uint64(10 * (1 << 8) + 1),
+     np.uint64(8)),
+    (np.uint64(0x00ff00ff00ff00ff), np.uint64(100 * (1 << 16) + 1),
+     np.uint64(16)),
+    (np.uint64(0x0000ffff0000ffff), np.uint64(10000 * (1 << 32) + 1),
+     np.uint64(32)),
+]
+
+# Bound types: what they set the lower and upper bounds to ('value' for the
+# value on the line, None to leave it unchanged) and whether they make the
+# column integer.
+_BOUND_TYPES = [
+    (b'UP', None, 'value', False),
+    (b'LO', 'value', None, False),
+    (b'FX', 'value', 'value', False),
+    (b'FR', -math.inf, math.inf, False),
+    (b'MI', -math.inf, None, False),
+    (b'PL', None, math.inf, False),
+    (b'BV', 0.0, 1.0, True),
+    (b'LI', 'value', None, True),
+    (b'UI', None, 'value', True),
+]
+# Bound types whose value may be left out.
+_OPTIONAL_VALUE = np.array([b'FR', b'MI', b'PL', b'BV'])
+
+_SECTIONS = frozenset(
+    ['NAME', 'OBJSENSE', 'ROWS', 'COLUMNS', 'RHS', 'RANGES', 'BOUNDS',
+     'ENDATA'])
+
+
+def _Tokens(buf: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  '''Start and end offsets of the whitespace-separated tokens of buf.'''
+  word = buf > _SPACE
+  edge = np.empty(len(buf) + 1, dtype=bool)
+  edge[0] = word[0]
+  np.not_equal(word[1:], word[:-1], out=edge[1:-1])
+  edge[-1] = word[-1]
+  edges = np.flatnonzero(edge)
+  return edges[0::2], edges[1::2]
+
+
+def _Fields(buf: np.ndarray,
+            line_start: np.ndarray,
+            line_end: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  '''Start and end offsets of the non-blank fields of fixed MPS lines.
+
+  Field k runs from column _FIELD_STARTS[k] of its line up to the next field,
+  or up to the end of the line for the last one. Fields are stripped of the
+  blanks around them and may hold spaces.
+  '''
+  begin = np.minimum(line_start[:, None] + _FIELD_STARTS, line_end[:, None])
+  end = np.empty_like(begin)
+  end[:, :-1] = begin[:, 1:]
+  end[:, -1] = line_end
+  nonblank = np.flatnonzero(buf > _SPACE)
+  first = np.searchsorted(nonblank, begin.reshape(-1))
+  last = np.searchsorted(nonblank, end.reshape(-1))
+  present = last > first
+  return nonblank[first[present]], nonblank[last[present] - 1] + 1
+
+
+def _Keys(buf: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+  '''The tokens as byte strings padded to a multiple of 8 bytes.
+
+  The keys are compared, hashed and parsed as numbers by NumPy. They are
+  gathered 8 bytes at a time, as little-endian words read at any offset of
+  buf whose bytes past the end of the token are shifted out.
+  '''
+  if not len(starts):
+    return np.zeros(0, dtype='S8')
+  lengths = ends - starts
+  num_words = -(-int(lengths.max()) // 8)
+  if int(starts.max()) + 8 * num_words > len(buf):
+    buf = np.concatenate([buf, np.zeros(8 * num_words, dtype=np.uint8)])
+  words_at = np.ndarray((len(buf) - 7,), dtype='<u8', buffer=buf,
+                        strides=(1,))
+  keys = np.zeros((len(starts), num_words), dtype='<u8')
+  for j in range(num_words):
+    present = np.flatnonzero(lengths > 8 * j) if j else slice(None)
+    words = words_at[starts[present] + 8 * j]
+    drop = (8 * np.maximum(8 * (j + 1) - lengths[present], 0)).astype(
+        np.uint64)
+    keys[present, j] = (words << drop) >> drop
+  return keys.view('S%d' % (8 * num_words)).reshape(-1)
+
+
+def _Hashes(keys: np.ndarray) -> np.ndarray:
+  '''64-bit hashes of keys, distinct for distinct keys of up to 8 bytes.'''
+  words = keys.view(np.uint64).reshape(len(keys), keys.itemsize // 8)
+  hashes = words[:, 0].copy()
+  for j in range(1, words.shape[1]):
+    # Padding words are skipped, so that hashes do not depend on the width.
+    hashes = np.where(words[:, j] != 0,
+                      (hashes * _HASH_MULTIPLIER) ^ words[:, j], hashes)
+  # The finalizer of splitmix64, a bijection mixing every bit into the low
+  # ones the hash table uses.
+  hashes ^= hashes >> np.uint64(30)
+  hashes *= np.uint64(0xbf58476d1ce4e5b9)
+  hashes ^= hashes >> np.uint64(27)
+  hashes *= np.uint64(0x94d049bb133111eb)
+  hashes ^= hashes >> np.uint64(31)
+  return hashes
+
+
+def _Numbers(buf: np.ndarray, starts: np.ndarray,
+             ends: np.ndarray) -> np.ndarray:
+  '''The tokens parsed as numbers.
+
+  Integers of up to 8 bytes, most numbers of generated models, are parsed
+  from their first word by SWAR arithmetic; the other numbers by a NumPy cast
+  of their keys.
+  '''
+  keys = _Keys(buf, starts, ends)
+  lengths = ends - starts
+  first = keys.view(np.uint64).reshape(len(keys), keys.itemsize // 8)[:, 0]
+  negative = (first & np.uint64(0xff)) == np.uint64(ord('-'))
+  num_digits = np.clip(lengths - negative, 0, 8)
+  # One digit per byte, the first one in the lowest byte, moved up so that
+  # the last digit is in the highest byte and the missing ones are zeros.
+  digits = (np.where(negative, first >> np.uint64(8), first) ^
+            _ZERO_DIGITS) & _BYTE_MASKS[num_digits]
+  is_integer = ((lengths <= 8) & (num_digits > 0) &
+                ((digits + _DIGIT_OVERFLOW) & _HIGH_BITS == 0))
+  digits <<= (8 * (8 - np.maximum(num_digits, 1))).astype(np.uint64)
+  for mask, multiplier, shift in _SWAR_STEPS:
+    digits = ((digits & mask) * multiplier) >> shift
+  values = digits.astype(np.float64)
+  np.negative(values, out=values, where=negative)
+  others = np.flatnonzero(~is_integer)
+  if others.size:
+    values[others] = keys[others].astype(np.float64)
+  return values
+
+
+def _Gather(buf: np.ndarray, starts: np.ndarray,
+            ends: np.ndarray) -> np.ndarray:
+  '''The bytes of the tokens, concatenated.'''
+  lengths = ends - starts
+  offsets = np.cumsum(lengths) - lengths
+  return buf[np.arange(lengths.sum()) - np.repeat(offsets - starts, lengths)]
+
+
+def _Pairs(first_token: np.ndarray, count: np.ndarray,
+           skip) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  '''Tokens of the (name, value) pairs of lines holding one or two of them.
+
+  Returns the name and value token of each pair, in line order, and the
+  number of pairs of each line. skip is the number of tokens before the
+  pairs, for all lines or per line.
+  '''
+  num_pairs = (count - skip) // 2
+  if np.any(((count - skip) % 2 != 0) | (num_pairs < 1) | (num_pairs > 2)):
+    raise ValueError('Lines must hold one or two (name, value) pairs')
+  first = np.stack([first_token + skip, first_token + skip + 2], axis=1)
+  present = np.stack([num_pairs >= 1, num_pairs == 2], axis=1)
+  names = first[present]
+  return names, names + 1, num_pairs
+
+
+def _Infinite(values: np.ndarray) -> np.ndarray:
+  values[values >= _INFINITY] = math.inf
+  values[values <= -_INFINITY] = -math.inf
+  return values
+
+
+def _Concatenate(chunks: List[np.ndarray], dtype) -> np.ndarray:
+  if not chunks:
+    return np.zeros(0, dtype=dtype)
+  return np.concatenate(chunks).astype(dtype, copy=False)
+
+
+def _StableOrder(values: np.ndarray, size: int) -> np.ndarray:
+  '''Stable argsort of values in [0, size), by radix sorts of 16-bit digits.'''
+  order = np.argsort(values.astype(np.uint16), kind='stable')
+  for shift in range(16, (size - 1).bit_length(), 16):
+    digits = (values[order] >> shift).astype(np.uint16)
+    order = order[np.argsort(digits, kind='stable')]
+  return order
+
+
+class _HashTable(object):
+  '''Open-addressing table of the first index of each of a set of hashes.
+
+  Entries are inserted and looked up in vectorized rounds, each probing the
+  next slot for the entries that collided in the previous one. The table
+  doubles when more than half full. Each slot holds a hash and its index plus
+  one (0 for empty slots) side by side, so that a probe reads one cache line.
+  '''
+
+  def __init__(self, hashes: np.ndarray):
+    self._Allocate(len(hashes))
+    self.Insert(hashes, 0)
+
+  def _Allocate(self, num_entries: int):
+    size = 1 << max(3, (2 * num_entries).bit_length())
+    self._mask = size - 1
+    self._slots = np.zeros((size, 2), dtype=np.uint64)
+    self._size = 0
+
+  def Insert(self, hashes: np.ndarray, first_index: int):
+    '''Adds hashes, numbered from first_index on, after those in the table.'''
+    if 2 * (self._size + len(hashes)) > len(self._slots):
+      used = self._slots[self._slots[:, 1] != 0]
+      used = used[np.argsort(used[:, 1], kind='stable')]
+      self._Allocate(self._size + len(hashes))
+      self._Insert(used[:, 0], used[:, 1])
+    self._Insert(hashes, np.arange(first_index + 1,
+                                   first_index + len(hashes) + 1,
+                                   dtype=np.uint64))
+
+  def _Insert(self, hashes: np.ndarray, index_plus_one: np.ndarray):
+    pending = np.arange(len(hashes))
+    slots = self._Slots(hashes)
+    while pending.size:
+      free = np.flatnonzero(self._slots[slots, 1] == 0)
+      # Of the entries probing the same free slot, the first one takes it, so
+      # that a repeated hash is found at its first index.
+      taken, first = np.unique(slots[free], return_index=True)
+      self._slots[taken, 0] = hashes[pending[free[first]]]
+      self._slots[taken, 1] = index_plus_one[pending[free[first]]]
+      left = np.ones(len(pending), dtype=bool)
+      left[free[first]] = False
+      pending = pending[left]
+      slots = (slots[left] + 1) & self._mask
+    self._size += len(hashes)
+
+  def _Slots(self, hashes: np.ndarray) -> np.ndarray:
+    return (hashes & np.uint64(self._mask)).astype(np.int64)
+
+  def _Probe(self, slots: np.ndarray,
+             hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''Whether the slots hold hashes, and their index (-1 if empty).'''
+    entries = np.take(self._slots, slots, axis=0)
+    index = entries[:, 1].astype(np.int64) - 1
+    return entries[:, 0] == hashes, index
+
+  def Find(self, hashes: np.ndarray) -> np.ndarray:
+    '''First index of each of hashes, -1 for those not in the table.'''
+    slots = self._Slots(hashes)
+    found, index = self._Probe(slots, hashes)
+    indices = np.where(found, index, -1)
+    # Hashes that collided with another one probe the next slots, until they
+    # are found or reach an empty slot.
+    pending = np.flatnonzero(~found & (index >= 0))
+    while pending.size:
+      slots[pending] = (slots[pending] + 1) & self._mask
+      found, index = self._Probe(slots[pending], hashes[pending])
+      indices[pending[found]] = index[found]
+      pending = pending[~found & (index >= 0)]
+    return indices
+
+
+class _Names(object):
+  '''Names in order of appearance, found by their hashes.'''
+
+  def __init__(self, kind: str):
+    self._kind = kind
+    self._keys = []
+    self._data = []
+    self._lengths = []
+    self._table = None
+    self._sorted = None
+    self.size = 0
+
+  def Add(self, buf: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+    keys = _Keys(buf, starts, ends)
+    if self._table is not None:
+      self._table.Insert(_Hashes(keys), self.size)
+    self._keys.append(keys)
+    self._data.append(_Gather(buf, starts, ends))
+    self._lengths.append(ends - starts)
+    self._sorted = None
+    self.size += len(starts)
+
+  def Find(self, keys: np.ndarray, missing_ok: bool = False) -> np.ndarray:
+    '''Indices of the names keys, -1 for those not found if missing_ok.'''
+    if not self.size:
+      indices = np.full(len(keys), -1, dtype=np.int64)
+    else:
+      indices = self._FindHashed(keys)
+    if not missing_ok and np.any(indices < 0):
+      raise ValueError('Unknown %s %s' % (self._kind, keys[np.argmax(
+          indices < 0)].decode('utf-8', errors='replace')))
+    return indices
+
+  def _FindHashed(self, keys: np.ndarray) -> np.ndarray:
+    if len(self._keys) != 1:
+      self._keys = [np.concatenate(self._keys)]
+    names = self._keys[0]
+    if self._table is None:
+      self._table = _HashTable(_Hashes(names))
+    indices = self._table.Find(_Hashes(keys))
+    if names.itemsize > 8 or keys.itemsize > 8:
+      # Names longer than 8 bytes may share their hash with another name: the
+      # keys found as another name are looked up by binary search. Keys whose
+      # hash is not in the table are not names.
+      found = np.flatnonzero(indices >= 0)
+      wrong = found[names[indices[found]] != keys[found]]
+      if wrong.size:
+        indices[wrong] = self._Search(keys[wrong])
+    return indices
+
+  def _Search(self, keys: np.ndarray) -> np.ndarray:
+    names = self._keys[0]
+    if self._sorted is None:
+      order = np.argsort(names, kind='stable')
+      self._sorted = (names[order], order)
+    sorted_names, order = self._sorted
+    if not len(sorted_names):
+      return np.full(len(keys), -1, dtype=np.int64)
+    position = np.minimum(np.searchsorted(sorted_names, keys),
+                          len(sorted_names) - 1)
+    return np.where(sorted_names[position] == keys, order[position], -1)
+
+  def Packed(self, dropped: int = -1) -> npz_format.PackedNames:
+    '''The names, except the dropped-th one.'''
+    data = _Concatenate(self._data, np.uint8)
+    start = np.zeros(self.size + 1, dtype=np.int64)
+    np.cumsum(_Concatenate(self._lengths, np.int64), out=start[1:])
+    if dropped >= 0:
+      begin, end = start[dropped], start[dropped + 1]
+      data = np.concatenate([data[:begin], data[end:]])
+      start = np.concatenate([start[:dropped],
+                              start[dropped + 1:] - (end - begin)])
+    return npz_format.PackedNames(data, start)
+
+
+class _MpsParser(object):
+  '''Collects the sections of an MPS file, one chunk of lines at a time.'''
+
+  def __init__(self, fixed_format: bool):
+    self._fixed_format = fixed_format
+    self.name = None
+    self.maximize = False
+    self.header_fields = []
+    self._section = None
+    self._rows = _Names('row')
+    self._row_types = []
+    self._columns = _Names('column')
+    self._column_integer = []
+    # Whether the last COLUMNS line was between INTORG and INTEND markers,
+    # and the name of its column.
+    self._integer = False
+    self._last_column = None
+    # (column, row, value) chunks of the COLUMNS section, (row, value) chunks
+    # of RHS and RANGES, and (column, bound type, value) chunks of BOUNDS.
+    self._terms = ([], [], [])
+    self._rhs = ([], [])
+    self._ranges = ([], [])
+    self._bounds = ([], [], [])
+
+  def Read(self, text: bytes):
+    '''Parses text, made of whole lines.'''
+    buf = np.frombuffer(text, dtype=np.uint8)
+    line_end = np.flatnonzero(buf == _NEWLINE)
+    line_start = np.concatenate([[0], line_end[:-1] + 1])
+    first_byte = buf[line_start]
+    if self._fixed_format:
+      starts, ends = _Fields(buf, line_start, line_end)
+    else:
+      starts, ends = _Tokens(buf)
+    # The tokens of each line, none for comment lines.
+    line_token = np.searchsorted(starts, line_start)
+    line_count = np.diff(np.append(line_token, len(starts)))
+    line_count[first_byte == _COMMENT] = 0
+    header_lines = np.flatnonzero((first_byte > _SPACE) &
+                                  (first_byte != _COMMENT))
+    if self._section is None:
+      for line in np.flatnonzero(first_byte == _COMMENT).tolist():
+        if header_lines.size and line > header_lines[0]:
+          break
+        self._HeaderField(text[line_start[line] + 1:line_end[line]])
+    # Each section header ends the data lines of the previous section.
+    begin = 0
+    for end in header_lines.tolist() + [len(line_start)]:
+      lines = slice(begin, end)
+      data = line_count[lines] > 0
+      self._Data(buf, starts, ends, line_token[lines][data],
+                 line_count[lines][data])
+      if end < len(line_start):
+        self._Header(text[line_start[end]:line_end[end]].decode('utf-8'))
+      begin = end + 1
+
+  def _HeaderField(self, line: bytes):
+    key, colon, value = line.decode('utf-8').partition(':')
+    key = key.strip()
+    if colon and key not in _STANDARD_HEADER_FIELDS:
+      self.header_fields.append((key, value.strip()))
+
+  def _Header(self, line: str):
+    tokens = line.split()
+    section = tokens[0].upper()
+    if section not in _SECTIONS:
+      raise ValueError('Unsupported MPS section %s' % tokens[0])
+    if section == 'NAME':
+      self.name = line[len(tokens[0]):].strip() or None
+    elif section == 'OBJSENSE' and len(tokens) > 1:
+      self._ObjectiveSense(tokens[1])
+    self._section = section
+
+  def _ObjectiveSense(self, sense: str):
+    if sense.upper() not in ('MAX', 'MAXIMIZE', 'MIN', 'MINIMIZE'):
+      raise ValueError('Unknown objective sense %s' % sense)
+    self.maximize = sense.upper().startswith('MAX')
+
+  def _Data(self, buf: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+            first_token: np.ndarray, count: np.ndarray):
+    '''Parses data lines, given by their first token and number of tokens.'''
+    if not len(first_token):
+      return
+    if self._section == 'ROWS':
+      self._ReadRows(buf, starts, ends, first_token, count)
+    elif self._section == 'COLUMNS':
+      self._ReadColumns(buf, starts, ends, first_token, count)
+    elif self._section in ('RHS', 'RANGES'):
+      rows, values = self._rhs if self._section == 'RHS' else self._ranges
+      names, value_tokens, _ = _Pairs(first_token, count, count % 2)
+      rows.append(self._rows.Find(_Keys(buf, starts[names], ends[names])))
+      values.append(_Numbers(buf, starts[value_tokens], ends[value_tokens]))
+    elif self._section == 'BOUNDS':
+      self._ReadBounds(buf, starts, ends, first_token, count)
+    elif self._section == 'OBJSENSE' and len(first_token) == 1:
+      sense = slice(starts[first_token[0]], ends[first_token[0]])
+      self._ObjectiveSense(buf[sense].tobytes().decode('utf-8'))
+    else:
+      raise ValueError('Unexpected data lines in MPS section %s' %
+                       self._section)
+
+  def _ReadRows(self, buf, starts, ends, first_token, count):
+    type_length = ends[first_token] - starts[first_token]
+    if np.any(count != 2) or np.any(type_length != 1):
+      raise ValueError('ROWS lines must hold a row type and a row name')
+    # Upper case.
+    row_types = buf[starts[first_token]] & 0xdf
+    if not np.all(np.isin(row_types, _ROW_TYPES)):
+      raise ValueError('Unknown row type %s' % chr(
+          row_types[~np.isin(row_types, _ROW_TYPES)][0]))
+    self._row_types.append(row_types)
+    self._rows.Add(buf, starts[first_token + 1], ends[first_token + 1])
+
+  def _ReadColumns(self, buf, starts, ends, first_token, count):
+    # Marker lines: name 'MARKER' 'INTORG' (or 'INTEND').
+    second = np.minimum(first_token + 1, len(starts) - 1)
+    is_marker = ((count == 3) & (ends[second] - starts[second] == 8) &
+                 (buf[starts[second]] == _QUOTE))
+    candidates = np.flatnonzero(is_marker)
+    is_marker[candidates] = _Keys(buf, starts[second[candidates]],
+                                  ends[second[candidates]]) == b"'MARKER'"
+    markers = np.flatnonzero(is_marker)
+    kinds = _Keys(buf, starts[first_token[markers] + 2],
+                  ends[first_token[markers] + 2])
+    if np.any((kinds != b"'INTORG'") & (kinds != b"'INTEND'")):
+      raise ValueError('Unknown marker %s' % kinds[0].decode('utf-8'))
+    marker_integer = np.append(self._integer, kinds == b"'INTORG'")
+    line_integer = marker_integer[np.searchsorted(markers,
+                                                  np.arange(len(count)))]
+    self._integer = bool(marker_integer[-1])
+
+    data = ~is_marker
+    first_token = first_token[data]
+    count = count[data]
+    line_integer = line_integer[data]
+    if not len(first_token):
+      return
+    names = _Keys(buf, starts[first_token], ends[first_token])
+    new_column = np.ones(len(names), dtype=bool)
+    new_column[1:] = names[1:] != names[:-1]
+    if self._last_column is not None:
+      new_column[0] = names[0] != self._last_column
+    self._last_column = names[-1]
+    line_column = self._columns.size + np.cumsum(new_column) - 1
+    self._columns.Add(buf, starts[first_token[new_column]],
+                      ends[first_token[new_column]])
+    self._column_integer.append(line_integer[new_column])
+
+    row_tokens, value_tokens, num_pairs = _Pairs(first_token, count, 1)
+    cols, rows, values = self._terms
+    cols.append(np.repeat(line_column, num_pairs))
+    rows.append(self._rows.Find(_Keys(buf, starts[row_tokens],
+                                      ends[row_tokens])))
+    values.append(_Numbers(buf, starts[value_tokens], ends[value_tokens]))
+
+  def _ReadBounds(self, buf, starts, ends, first_token, count):
+    types = np.char.upper(_Keys(buf, starts[first_token], ends[first_token]))
+    codes = np.full(len(types), -1, dtype=np.int64)
+    for code, bound_type in enumerate(_BOUND_TYPES):
+      codes[types == bound_type[0]] = code
+    if np.any(codes < 0):
+      raise ValueError('Unsupported bound type %s' %
+                       types[codes < 0][0].decode('utf-8'))
+    # Type, set name (may be left out), column and value (may be left out for
+    # some types).
+    has_value = ~np.isin(types, _OPTIONAL_VALUE) | (count == 4)
+    num_names = count - has_value
+    if np.any((num_names < 2) | (num_names > 3)):
+      raise ValueError('BOUNDS lines must hold a bound type, a bound name, a '
+                       'column and a value')
+    column_tokens = first_token + num_names - 1
+    keys = _Keys(buf, starts[column_tokens], ends[column_tokens])
+    cols = self._columns.Find(keys, missing_ok=True)
+    missing = np.flatnonzero(cols < 0)
+    if missing.size:
+      # Columns without terms, numbered in order of first appearance.
+      _, first, inverse = np.unique(keys[missing], return_index=True,
+                                    return_inverse=True)
+      appearance = np.argsort(first, kind='stable')
+      rank = np.empty_like(appearance)
+      rank[appearance] = np.arange(len(appearance))
+      cols[missing] = self._columns.size + rank[inverse.reshape(-1)]
+      new_tokens = column_tokens[missing[first[appearance]]]
+      self._columns.Add(buf, starts[new_tokens], ends[new_tokens])
+      self._column_integer.append(np.zeros(len(first), dtype=bool))
+    values = np.zeros(len(first_token), dtype=np.float64)
+    value_tokens = (first_token + count - 1)[has_value]
+    values[has_value] = _Numbers(buf, starts[value_tokens], ends[value_tokens])
+    for chunks, array in zip(self._bounds, (cols, codes, values)):
+      chunks.append(array)
+
+  def Finish(self) -> Tuple[mip_arrays.MipArrays, float]:
+    '''The model read, and its objective offset.'''
+    row_types = _Concatenate(self._row_types, np.uint8)
+    free = np.flatnonzero(row_types == ord('N'))
+    objective_row = int(free[0]) if free.size else -1
+    is_constraint = np.ones(len(row_types), dtype=bool)
+    if objective_row >= 0:
+      is_constraint[objective_row] = False
+    constraint_of_row = np.cumsum(is_constraint) - 1
+    num_cons = int(np.count_nonzero(is_constraint))
+    num_vars = self._columns.size
+
+    cols, rows, values = (_Concatenate(chunks, dtype) for chunks, dtype in zip(
+        self._terms, (np.int64, np.int64, np.float64)))
+    in_objective = rows == objective_row
+    objective = np.zeros(num_vars, dtype=np.float64)
+    objective[cols[in_objective]] = values[in_objective]
+    cols = cols[~in_objective]
+    rows = constraint_of_row[rows[~in_objective]]
+    values = values[~in_objective]
+    order = _StableOrder(rows, num_cons)
+    row_start = np.zeros(num_cons + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_cons), out=row_start[1:])
+
+    rhs = np.zeros(len(row_types), dtype=np.float64)
+    rhs[_Concatenate(self._rhs[0], np.int64)] = _Infinite(
+        _Concatenate(self._rhs[1], np.float64))
+    ranges = np.full(len(row_types), np.nan)
+    ranges[_Concatenate(self._ranges[0], np.int64)] = _Concatenate(
+        self._ranges[1], np.float64)
+    objective_offset = 0.0
+    if objective_row >= 0:
+      objective_offset -= float(rhs[objective_row])
+    row_types = row_types[is_constraint]
+    rhs = rhs[is_constraint]
+    ranges = ranges[is_constraint]
+    con_lb = np.where((row_types == ord('E')) | (row_types == ord('G')), rhs,
+                      -math.inf)
+    con_ub = np.where((row_types == ord('E')) | (row_types == ord('L')), rhs,
+                      math.inf)
+    # E rows range from rhs to rhs + R, L rows from rhs - |R| to rhs and G
+    # rows from rhs to rhs + |R|.
+    has_range = ~np.isnan(ranges)
+    extend_up = has_range & ((row_types == ord('G')) |
+                             ((row_types == ord('E')) & (ranges >= 0.0)))
+    extend_down = has_range & ((row_types == ord('L')) |
+                               ((row_types == ord('E')) & (ranges < 0.0)))
+    con_ub[extend_up] = rhs[extend_up] + np.abs(ranges[extend_up])
+    con_lb[extend_down] = rhs[extend_down] - np.abs(ranges[extend_down])
+
+    var_lb = np.zeros(num_vars, dtype=np.float64)
+    var_ub = np.full(num_vars, math.inf)
+    is_integer = _Concatenate(self._column_integer, bool)
+    bound_cols, codes, bound_values = (
+        _Concatenate(chunks, dtype) for chunks, dtype in zip(
+            self._bounds, (np.int64, np.int64, np.float64)))
+    _Infinite(bound_values)
+    # Lines of the same column apply in file order, the last one winning.
+    new_lb = np.full(len(codes), np.nan)
+    new_ub = np.full(len(codes), np.nan)
+    for code, (_, lb, ub, integer) in enumerate(_BOUND_TYPES):
+      lines = codes == code
+      for new_bound, bound in ((new_lb, lb), (new_ub, ub)):
+        if bound is not None:
+          new_bound[lines] = bound_values[lines] if bound == 'value' else bound
+      if integer:
+        is_integer[bound_cols[lines]] = True
+    for bounds, new_bound in ((var_lb, new_lb), (var_ub, new_ub)):
+      lines = ~np.isnan(new_bound)
+      bounds[bound_cols[lines]] = new_bound[lines]
+
+    arrays = mip_arrays.MipArrays(
+        var_name=self._columns.Packed(),
+        var_lower_bound=var_lb,
+        var_upper_bound=var_ub,
+        objective=objective,
+        is_integer=is_integer,
+        con_name=self._rows.Packed(dropped=objective_row),
+        con_lower_bound=con_lb,
+        con_upper_bound=con_ub,
+        row_start=row_start,
+        col_index=cols[order],
+        coefficient=values[order],
+    )
+    return arrays, objective_offset
+
+
+def ReadMps(
+    filename: str,
+    fixed_format: bool = False) -> Tuple[mip_arrays.MipArrays, Dict[str, Any]]:
+  '''Reads the model of an MPS file, in free or fixed format.
+
+  Returns the MipArrays and the metadata: 'maximize', 'objective_offset',
+  'header_fields' (the (key, value) comment lines before the first section,
+  other than those WriteMps always writes) and 'name' when the model has one.
+  '''
+  parser = _MpsParser(fixed_format)
+  rest = b''
+  with compression.OpenRead(filename) as f:
+    while True:
+      chunk = f.read(_CHUNK_SIZE)
+      if not chunk:
+        break
+      text = rest + chunk
+      end = text.rfind(b'\n') + 1
+      rest = text[end:]
+      if end:
+        parser.Read(text[:end])
+  if rest:
+    parser.Read(rest + b'\n')
+  arrays, objective_offset = parser.Finish()
+  metadata = {
+      'maximize': parser.maximize,
+      'objective_offset': objective_offset,
+      'header_fields': parser.header_fields,
+  }
+  if parser.name is not None:
+    metadata['name'] = parser.name
+  return arrays, metadata
@@ -0,0 +1,227 @@
+import io
+from unittest import mock
+
+import numpy as np
+
+from absl.testing import absltest
+from ortools.linear_solver.python import model_builder
+
+from common import mip_arrays
+from common import mps_reader
+from common import mps_writer
+
+
+def _RandomModel(seed: int, num_integer: int, num_continuous: int,
+                 num_cons: int, row_length: int) -> mip_arrays.MipArrays:
+  '''A model that WriteMps and ReadMps round-trip exactly.
+
+  Integer variables come first, every variable has a non-zero objective so
+  that it appears in COLUMNS, rows hold distinct columns in increasing order
+  and values have few significant digits.
+  '''
+  rng = np.random.default_rng(seed)
+  builder = mip_arrays.MipArraysBuilder()
+  builder.AddVariables(
+      mip_arrays.GridNames('b', num_integer), lower_bound=0.0,
+      upper_bound=rng.integers(1, 5, num_integer),
+      objective=rng.choice([-3, -1, 2, 7], num_integer), is_integer=True)
+  lower_bound = np.round(rng.normal(size=num_continuous) * 10, 2)
+  builder.AddVariables(
+      mip_arrays.GridNames('x', num_continuous), lower_bound=lower_bound,
+      upper_bound=np.where(
+          rng.random(num_continuous) < 0.2, np.inf,
+          np.round(lower_bound + rng.integers(0, 100, num_continuous), 2)),
+      objective=np.round(rng.uniform(0.5, 20, num_continuous), 3))
+  num_vars = num_integer + num_continuous
+  col_index = np.sort(np.stack(
+      [rng.choice(num_vars, row_length, replace=False)
+       for _ in range(num_cons)]), axis=1)
+  coefficient = np.round(rng.normal(size=(num_cons, row_length)) * 5, 2)
+  rhs = np.round(rng.normal(size=num_cons) * 100, 1)
+  sense = rng.integers(0, 4, num_cons)
+  builder.AddConstraints(
+      mip_arrays.GridNames('ct', num_cons),
+      lower_bound=np.where(sense == 1, -np.inf, rhs),
+      upper_bound=np.where(sense == 0, np.inf,
+                           np.where(sense == 3, rhs + 12.5, rhs)),
+      col_index=col_index,
+      coefficient=np.where(coefficient == 0, 1.0, coefficient))
+  return builder.Build()
+
+
+def _MpsText(arrays: mip_arrays.MipArrays, **kwargs) -> str:
+  out = io.StringIO()
+  mps_writer.WriteMps(out, arrays, **kwargs)
+  return out.getvalue()
+
+
+class ReadMpsTest(absltest.TestCase):
+
+  def _Read(self, text: str, **kwargs):
+    return mps_reader.ReadMps(self.create_tempfile(content=text).full_path,
+                              **kwargs)
+
+  def assertArraysEqual(self, actual: mip_arrays.MipArrays,
+                        expected: mip_arrays.MipArrays):
+    for field, a, b in zip(mip_arrays.MipArrays._fields, actual, expected):
+      if field.endswith('_name'):
+        self.assertEqual(list(a), list(b), field)
+      else:
+        np.testing.assert_array_equal(a, b, err_msg=field)
+
+  def testRoundTripWithWriter(self):
+    arrays = _RandomModel(0, num_integer=30, num_continuous=70, num_cons=50,
+                          row_length=6)
+    text = _MpsText(arrays, name='round trip', maximize=True,
+                    objective_offset=1.5,
+                    header_fields=[('Generator', 'test')])
+    read, metadata = self._Read(text)
+    self.assertArraysEqual(read, arrays)
+    self.assertEqual(metadata, {
+        'maximize': True,
+        'objective_offset': 1.5,
+        'header_fields': [('Generator', 'test')],
+        'name': 'round trip',
+    })
+    self.assertEqual(_MpsText(read, name='round trip', maximize=True,
+                              objective_offset=1.5,
+                              header_fields=[('Generator', 'test')]), text)
+
+  def testRoundTripAcrossChunks(self):
+    arrays = _RandomModel(1, num_integer=200, num_continuous=300,
+                          num_cons=300, row_length=4)
+    path = self.create_tempfile(content=_MpsText(arrays)).full_path
+    # Chunks of a few lines, and columns added to the names in many steps.
+    with mock.patch.object(mps_reader, '_CHUNK_SIZE', 100):
+      read, _ = mps_reader.ReadMps(path)
+    self.assertArraysEqual(read, arrays)
+
+  def testSameAsOrTools(self):
+    arrays = _RandomModel(2, num_integer=20, num_continuous=40, num_cons=30,
+                          row_length=5)
+    path = self.create_tempfile(
+        content=_MpsText(arrays, objective_offset=-4.0)).full_path
+    builder = model_builder.ModelBuilder()
+    self.assertTrue(builder.import_from_mps_file(path))
+    model_proto = builder.export_to_proto()
+    read, metadata = mps_reader.ReadMps(path)
+    self.assertArraysEqual(
+        read, mip_arrays.MPModelProtoToMipArrays(model_proto))
+    self.assertEqual(metadata['objective_offset'],
+                     model_proto.objective_offset)
+
+  def testFixedFormat(self):
+    text = ('NAME          FIXED MODEL\n'
+            'ROWS\n'
+            ' N  COST\n'
+            ' L  LIM 1\n'
+            ' G  LIM 2\n'
+            ' E  MYEQN\n'
+            'COLUMNS\n'
+            "    MARKER    'MARKER'                           'INTORG'\n"
+            '    X ONE     COST      1.0            LIM 1     1.0\n'
+            '    X ONE     LIM 2     1.0\n'
+            "    MARKER    'MARKER'                           'INTEND'\n"
+            '    Y         COST      -2.5           MYEQN     -1\n'
+            '    Z         LIM 2     1.0            MYEQN     1\n'
+            'RHS\n'
+            '              LIM 1     4              LIM 2     1\n'
+            '    RHS       MYEQN     7\n'
+            'RANGES\n'
+            '    RNG       MYEQN     2\n'
+            'BOUNDS\n'
+            ' UP BND       X ONE     4.0\n'
+            ' MI           Y\n'
+            ' UP BND       Y         1\n'
+            'ENDATA\n')
+    arrays, metadata = self._Read(text, fixed_format=True)
+    self.assertEqual(list(arrays.var_name), ['X ONE', 'Y', 'Z'])
+    self.assertEqual(list(arrays.con_name), ['LIM 1', 'LIM 2', 'MYEQN'])
+    np.testing.assert_array_equal(arrays.objective, [1.0, -2.5, 0.0])
+    np.testing.assert_array_equal(arrays.var_lower_bound, [0.0, -np.inf, 0.0])
+    np.testing.assert_array_equal(arrays.var_upper_bound, [4.0, 1.0, np.inf])
+    np.testing.assert_array_equal(arrays.is_integer, [True, False, False])
+    np.testing.assert_array_equal(arrays.con_lower_bound, [-np.inf, 1.0, 7.0])
+    np.testing.assert_array_equal(arrays.con_upper_bound, [4.0, np.inf, 9.0])
+    np.testing.assert_array_equal(arrays.row_start, [0, 1, 3, 5])
+    np.testing.assert_array_equal(arrays.col_index, [0, 0, 2, 1, 2])
+    np.testing.assert_array_equal(arrays.coefficient, [1, 1, 1, -1, 1])
+    self.assertEqual(metadata['name'], 'FIXED MODEL')
+    # Spaces in names split them in free format.
+    with self.assertRaises(ValueError):
+      self._Read(text)
+
+    # Without spaces in names nor blank set names, which OR-Tools does not
+    # read, both formats read the file as OR-Tools does.
+    text = (text.replace('X ONE', 'X_ONE').replace('LIM ', 'LIM_')
+            .replace('          LIM_1     4', 'RHS       LIM_1     4')
+            .replace(' MI           Y', ' MI BND       Y'))
+    path = self.create_tempfile(content=text).full_path
+    builder = model_builder.ModelBuilder()
+    self.assertTrue(builder.import_from_mps_file(path))
+    expected = mip_arrays.MPModelProtoToMipArrays(builder.export_to_proto())
+    for fixed_format in (True, False):
+      self.assertArraysEqual(
+          mps_reader.ReadMps(path, fixed_format=fixed_format)[0], expected)
+
+  def testNumbers(self):
+    values = ['0', '-0', '7', '-12', '12345678', '-9999999', '123456789',
+              '-123456789', '1.5', '-0.25', '1e+30', '-1e+30', '2.5e-07',
+              '+3', '007', '1E5', '99999999']
+    text = 'ROWS\n N  COST\nCOLUMNS\n'
+    for i, value in enumerate(values):
+      text += '    x%d  COST  %s\n' % (i, value)
+    arrays, _ = self._Read(text + 'ENDATA\n')
+    expected = np.array([float(value) for value in values])
+    np.testing.assert_array_equal(arrays.objective, expected)
+    np.testing.assert_array_equal(np.signbit(arrays.objective),
+                                  np.signbit(expected))
+
+  def testColumnsOnlyInBounds(self):
+    arrays, metadata = self._Read(
+        'NAME          bounds_only\n'
+        'ROWS\n'
+        ' N  COST\n'
+        ' L  c\n'
+        'COLUMNS\n'
+        'RHS\n'
+        '    RHS       COST      -2   c         3\n'
+        'BOUNDS\n'
+        ' UP BND       x         4\n'
+        ' BV BND       y\n'
+        ' LO BND       x         1\n'
+        'ENDATA\n')
+    self.assertEqual(list(arrays.var_name), ['x', 'y'])
+    np.testing.assert_array_equal(arrays.var_lower_bound, [1.0, 0.0])
+    np.testing.assert_array_equal(arrays.var_upper_bound, [4.0, 1.0])
+    np.testing.assert_array_equal(arrays.is_integer, [False, True])
+    np.testing.assert_array_equal(arrays.objective, [0.0, 0.0])
+    self.assertEqual(list(arrays.con_name), ['c'])
+    np.testing.assert_array_equal(arrays.con_upper_bound, [3.0])
+    np.testing.assert_array_equal(arrays.row_start, [0, 0])
+    self.assertEqual(metadata['objective_offset'], 2.0)
+    self.assertEqual(metadata['name'], 'bounds_only')
+
+  def testManyColumnsOnlyInBounds(self):
+    text = 'ROWS\n N  COST\nCOLUMNS\n    x0  COST  1\nBOUNDS\n'
+    for i in range(1000):
+      text += ' UP BND  x%d  %d\n' % (i, i + 1)
+    path = self.create_tempfile(content=text + 'ENDATA\n').full_path
+    # The columns are added to the names looked up, a few lines at a time.
+    with mock.patch.object(mps_reader, '_CHUNK_SIZE', 100):
+      arrays, _ = mps_reader.ReadMps(path)
+    self.assertEqual(list(arrays.var_name), ['x%d' % i for i in range(1000)])
+    np.testing.assert_array_equal(arrays.var_upper_bound, np.arange(1, 1001))
+
+  def testNoColumns(self):
+    arrays, _ = self._Read('NAME\nROWS\n N  COST\nCOLUMNS\nENDATA\n')
+    self.assertEmpty(arrays.var_name)
+    self.assertEmpty(arrays.con_name)
+
+  def testUnknownRow(self):
+    with self.assertRaisesRegex(ValueError, 'Unknown row c'):
+      self._Read('ROWS\n N  COST\nCOLUMNS\n    x  c  1\nENDATA\n')
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,408 @@
+'''Streaming writer for models in free MPS format.
+
+Writes the same text as pywraplp.ExportModelAsMpsFormat (free format, names
+not obfuscated), section by section into a file object. Text is formatted in
+batches and buffered up to buffer_size characters between writes, so memory
+used by the MPS text does not grow with the model.
+'''
+
+import math
+from typing import Iterator, List, Optional, Sequence, TextIO, Tuple
+
+import numpy as np
+
+from ortools.linear_solver import linear_solver_pb2
+
+from common import mip_arrays
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+# Both the name and the value columns are at least this wide.
+_MIN_WIDTH = 6
+
+# Fewest terms of the matrix gathered at once for the COLUMNS section, each
+# batch of columns costing a scan of the matrix.
+_MIN_COLUMN_TERMS = 1 << 14
+
+# The matrix is scanned in chunks of this many times the terms of a batch.
+# Each chunk records which of _NUM_BUCKETS buckets of consecutive columns it
+# has, so that a batch of columns only scans the chunks that may hold them.
+_SCAN_CHUNK_FACTOR = 4
+_NUM_BUCKETS = 1024
+
+
+class _BufferedWriter(object):
+
+  def __init__(self, out: TextIO, buffer_size: int):
+    self._out = out
+    self._buffer_size = max(1, buffer_size)
+    self._chunks = []
+    self._size = 0
+
+  def Write(self, text: str):
+    if self._size + len(text) > self._buffer_size:
+      self.Flush()
+    self._chunks.append(text)
+    self._size += len(text)
+
+  def Flush(self):
+    if self._chunks:
+      self._out.write(''.join(self._chunks))
+      self._chunks = []
+      self._size = 0
+
+
+def _FormatNumber(value: float) -> str:
+  return '%g' % value
+
+
+def _CheckNames(names: Sequence[str]):
+  # Names are written with their spaces replaced by underscores.
+  if not all(names):
+    raise ValueError('MPS export requires every variable and constraint to '
+                     'have a non-empty name.')
+
+
+def _Batches(size: int, batch_size: int) -> Iterator[slice]:
+  for begin in range(0, size, batch_size):
+    yield slice(begin, min(size, begin + batch_size))
+
+
+def _ValueWidth(arrays: mip_arrays.MipArrays, batch_size: int) -> int:
+  # The value column fits the longest number in the model (except the
+  # objective offset), computed over the distinct values of each batch.
+  width = _MIN_WIDTH
+  for values in (arrays.objective, arrays.var_lower_bound,
+                 arrays.var_upper_bound, arrays.coefficient,
+                 arrays.con_lower_bound, arrays.con_upper_bound):
+    for batch in _Batches(len(values), batch_size):
+      for value in np.unique(values[batch]).tolist():
+        width = max(width, len(_FormatNumber(value)))
+  return width
+
+
+def _WritePairs(writer: _BufferedWriter, header: str, pairs: List[str]):
+  for k in range(0, len(pairs), 2):
+    writer.Write(header + ''.join(pairs[k:k + 2]) + '\n')
+
+
+def _RowTypes(con_lb: np.ndarray, con_ub: np.ndarray) -> np.ndarray:
+  # E for equalities, L and G for one-sided rows, G with a range for
+  # two-sided rows, and N for free rows.
+  row_type = np.full(len(con_lb), 'G')
+  row_type[np.isinf(con_lb) & np.isfinite(con_ub)] = 'L'
+  row_type[np.isinf(con_lb) & np.isinf(con_ub)] = 'N'
+  row_type[con_lb == con_ub] = 'E'
+  return row_type
+
+
+def _ColumnTerms(arrays: mip_arrays.MipArrays, integer: bool,
+                 max_terms: int
+                ) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+  '''Yields the (column, row, value) terms of the integer or other columns.
+
+  Terms come in column order, then row order after the objective, which has
+  row -1; zeros are skipped. The matrix is stored by rows, so the terms of a
+  range of columns are gathered by scanning it in chunks, skipping the
+  chunks without any column of the range's buckets. Ranges are sized to hold
+  about max_terms terms: a range that turns out to hold more than
+  2 * max_terms is scanned again in halves, and a single column with more is
+  yielded in pieces as the scan finds them, as they are already in order.
+  '''
+  num_vars = len(arrays.var_name)
+  row_start = arrays.row_start
+  nnz = len(arrays.col_index)
+  chunk_size = _SCAN_CHUNK_FACTOR * max_terms
+  chunks = list(_Batches(nnz, chunk_size))
+  # has_bucket[k, b] tells whether chunk k has a column of bucket b, the
+  # columns of bucket b being those with j * num_buckets // num_vars == b.
+  num_buckets = min(num_vars, _NUM_BUCKETS) or 1
+  has_bucket = np.zeros((len(chunks), num_buckets), dtype=bool)
+  for k, chunk in enumerate(chunks):
+    has_bucket[k, np.unique(arrays.col_index[chunk] * num_buckets //
+                            num_vars)] = True
+  width = max(1, num_vars * max_terms // max(1, nnz))
+  begin = 0
+  while begin < num_vars:
+    end = min(num_vars, begin + width)
+    cols = np.flatnonzero((arrays.is_integer[begin:end] == integer) &
+                          (arrays.objective[begin:end] != 0.0)) + begin
+    pieces = [(cols, np.full(len(cols), -1, dtype=np.int64),
+               arrays.objective[cols])]
+    num_terms = len(cols)
+    streaming = False
+    scanned = np.flatnonzero(has_bucket[
+        :, begin * num_buckets // num_vars:
+        (end - 1) * num_buckets // num_vars + 1].any(axis=1))
+    for k in scanned.tolist():
+      chunk = chunks[k]
+      col_index = arrays.col_index[chunk]
+      # begin <= j < end, as one unsigned comparison.
+      selected = np.flatnonzero(
+          (col_index - begin).view(np.uint64) < np.uint64(end - begin))
+      selected = selected[arrays.coefficient[chunk][selected] != 0.0]
+      selected = selected[arrays.is_integer[col_index[selected]] == integer]
+      if not len(selected):
+        continue
+      # The rows of the selected entries of the chunk.
+      first_row = np.searchsorted(row_start, chunk.start, side='right') - 1
+      last_row = np.searchsorted(row_start, chunk.stop, side='left')
+      row_bounds = np.clip(row_start[first_row:last_row + 1], chunk.start,
+                           chunk.stop) - chunk.start
+      rows = np.searchsorted(row_bounds, selected, side='right') - 1 + first_row
+      pieces.append((col_index[selected], rows,
+                     arrays.coefficient[chunk][selected]))
+      num_terms += len(selected)
+      if num_terms > 2 * max_terms:
+        if end - begin > 1:
+          break
+        streaming = True
+        yield tuple(np.concatenate(p) for p in zip(*pieces))
+        pieces = []
+        num_terms = 0
+    else:
+      if pieces:
+        cols, rows, values = (np.concatenate(p) for p in zip(*pieces))
+        del pieces
+        # Stable, so that rows stay in order within each column.
+        order = np.argsort(cols, kind='stable')
+        yield cols[order], rows[order], values[order]
+        del cols, rows, values, order
+      begin = end
+      # Aims the next range at max_terms terms.
+      width = int(min(4 * width,
+                      max(1, width * max_terms // max(1, num_terms))))
+      continue
+    assert not streaming
+    width = max(1, (end - begin) // 2)
+
+
+def WriteMps(out: TextIO,
+             arrays: mip_arrays.MipArrays,
+             name: Optional[str] = None,
+             maximize: bool = False,
+             objective_offset: float = 0.0,
+             buffer_size: int = DEFAULT_BUFFER_SIZE,
+             header_fields: Sequence[Tuple[str, str]] = ()):
+  '''Writes arrays to out in free MPS format.
+
+  header_fields are extra (key, value) pairs describing the instance, written
+  as comment lines after the standard header (e.g. how it was generated).
+  Every section is formatted by batches of a fraction of buffer_size
+  characters, the terms of COLUMNS being gathered at least _MIN_COLUMN_TERMS
+  at a time, so that besides arrays, the memory used is bounded by a small
+  multiple of buffer_size rather than growing with the model.
+  '''
+  writer = _BufferedWriter(out, buffer_size)
+  var_names = arrays.var_name
+  con_names = arrays.con_name
+  num_vars = len(var_names)
+  num_cons = len(con_names)
+  _CheckNames(var_names)
+  _CheckNames(con_names)
+  name_width = max(_MIN_WIDTH, max(map(len, var_names), default=0),
+                   max(map(len, con_names), default=0))
+  # Each batch formats about a quarter of buffer_size characters, as the
+  # Python strings it goes through take a few times more memory than that.
+  batch_size = max(
+      1, buffer_size // (4 * (2 * name_width + _MIN_WIDTH + 8)))
+  value_width = _ValueWidth(arrays, batch_size)
+  batch_size = max(
+      1, buffer_size // (4 * (2 * name_width + value_width + 8)))
+  pair_format = '  %%-%ds  %%%ds' % (name_width, value_width)
+
+  def Pair(key: str, value: float) -> str:
+    return pair_format % (key, _FormatNumber(value))
+
+  def Header(key: str) -> str:
+    return '    %-*s' % (name_width, key)
+
+  var_lb = arrays.var_lower_bound
+  var_ub = arrays.var_upper_bound
+  is_integer = arrays.is_integer
+  # Integer variables whose rounded bounds are [0, 1] are binary.
+  num_binary = 0
+  for batch in _Batches(num_vars, batch_size):
+    num_binary += int(np.count_nonzero(
+        is_integer[batch] & (np.ceil(var_lb[batch]) == 0.0) &
+        (np.floor(var_ub[batch]) == 1.0)))
+  num_integer = int(np.count_nonzero(is_integer)) - num_binary
+  writer.Write(
+      '* Generated by MPModelProtoExporter\n'
+      '*   Name             : %s\n'
+      '*   Format           : Free\n'
+      '*   Constraints      : %d\n'
+      '*   Variables        : %d\n'
+      '*     Binary         : %d\n'
+      '*     Integer        : %d\n'
+      '*     Continuous     : %d\n' %
+      ('NoName' if name is None else name, num_cons, num_vars, num_binary,
+       num_integer, num_vars - num_binary - num_integer))
+  for key, value in header_fields:
+    writer.Write('*   %-17s: %s\n' % (key, value))
+  writer.Write('NAME          %s\n' % (name or ''))
+  if maximize:
+    writer.Write('OBJSENSE\n  MAX\n')
+
+  con_lb = arrays.con_lower_bound
+  con_ub = arrays.con_upper_bound
+  writer.Write('ROWS\n N  COST\n')
+  for batch in _Batches(num_cons, batch_size):
+    writer.Write(''.join(
+        ' %s  %s\n' % (row_type, con_name.replace(' ', '_'))
+        for row_type, con_name in zip(
+            _RowTypes(con_lb[batch], con_ub[batch]).tolist(),
+            con_names[batch])))
+
+  # Columns: integer variables first (between markers), then continuous ones,
+  # each in index order. Terms are listed by row, after the objective, skipping
+  # zeros; variables without any term are skipped. A line holds two terms of
+  # a column, and ends before the next line starts, as the terms of a column
+  # may come in several batches.
+  padded_cost = '  %-*s  ' % (name_width, 'COST')
+  # The column and the position in it of the last term written.
+  last_term = [-1, 0]
+
+  def WriteTerms(cols: np.ndarray, rows: np.ndarray, values: np.ndarray):
+    new_column = np.ones(len(cols), dtype=bool)
+    new_column[1:] = cols[1:] != cols[:-1]
+    column_begin = np.flatnonzero(new_column)
+    position = np.arange(len(cols)) - np.repeat(
+        column_begin, np.diff(np.append(column_begin, len(cols))))
+    if cols[0] == last_term[0]:
+      # The first column continues from the previous batch.
+      position[:column_begin[1] if len(column_begin) > 1 else len(cols)] += (
+          last_term[1] + 1)
+    starts_line = position % 2 == 0
+    distinct, value_index = np.unique(values, return_inverse=True)
+    value_strs = np.array(
+        ['%*s' % (value_width, _FormatNumber(v)) for v in distinct.tolist()],
+        dtype=object)
+    distinct_rows, row_index = np.unique(rows, return_inverse=True)
+    row_strs = np.array([
+        '  %-*s  ' % (name_width, con_names[r].replace(' ', '_'))
+        if r >= 0 else padded_cost for r in distinct_rows.tolist()
+    ], dtype=object)
+    pieces = np.full((len(cols), 2), '', dtype=object)
+    pieces[starts_line, 0] = [
+        '\n    %-*s' % (name_width, var_names[j].replace(' ', '_'))
+        for j in cols[starts_line].tolist()
+    ]
+    pieces[:, 1] = row_strs[row_index] + value_strs[value_index]
+    text = ''.join(pieces.ravel().tolist())
+    # The first line of the section starts without a line break.
+    writer.Write(text[1:] if last_term[0] == -1 else text)
+    last_term[0] = int(cols[-1])
+    last_term[1] = int(position[-1])
+
+  def WriteColumns(integer: bool):
+    for cols, rows, values in _ColumnTerms(
+        arrays, integer, max(batch_size, _MIN_COLUMN_TERMS)):
+      if len(cols):
+        if last_term[0] == -1:
+          writer.Write('COLUMNS\n')
+          if integer:
+            writer.Write("  INTSTART  'MARKER'                            "
+                         "'INTORG'\n")
+        for batch in _Batches(len(cols), batch_size):
+          WriteTerms(cols[batch], rows[batch], values[batch])
+
+  WriteColumns(True)
+  if last_term[0] != -1:
+    writer.Write("\n  INTEND    'MARKER'                            "
+                 "'INTEND'")
+  WriteColumns(False)
+  if last_term[0] != -1:
+    writer.Write('\n')
+
+  # Right-hand sides (the objective offset goes on the COST row, negated),
+  # then ranges of two-sided rows.
+  rhs_pairs = [Pair('COST', -objective_offset)] if objective_offset else []
+  header = Header('RHS')
+  has_rhs = False
+  for batch in _Batches(num_cons, batch_size):
+    lb = con_lb[batch]
+    ub = con_ub[batch]
+    row_type = _RowTypes(lb, ub)
+    rhs = np.where(row_type == 'L', ub, lb)
+    rows = np.flatnonzero(row_type != 'N')
+    rhs_pairs.extend(
+        Pair(con_names[batch.start + r].replace(' ', '_'), v)
+        for r, v in zip(rows.tolist(), rhs[rows].tolist()))
+    if rhs_pairs and not has_rhs:
+      writer.Write('RHS\n')
+      has_rhs = True
+    # Keep an odd trailing pair for the next line.
+    num_written = len(rhs_pairs) - len(rhs_pairs) % 2
+    _WritePairs(writer, header, rhs_pairs[:num_written])
+    rhs_pairs = rhs_pairs[num_written:]
+  if rhs_pairs and not has_rhs:
+    writer.Write('RHS\n')
+  _WritePairs(writer, header, rhs_pairs)
+
+  range_pairs = []
+  header = Header('RANGE')
+  has_ranges = False
+  for batch in _Batches(num_cons, batch_size):
+    lb = con_lb[batch]
+    ub = con_ub[batch]
+    rows = np.flatnonzero((_RowTypes(lb, ub) == 'G') & np.isfinite(ub))
+    range_pairs.extend(
+        Pair(con_names[batch.start + r].replace(' ', '_'), v)
+        for r, v in zip(rows.tolist(), (ub[rows] - lb[rows]).tolist()))
+    if range_pairs and not has_ranges:
+      writer.Write('RANGES\n')
+      has_ranges = True
+    num_written = len(range_pairs) - len(range_pairs) % 2
+    _WritePairs(writer, header, range_pairs[:num_written])
+    range_pairs = range_pairs[num_written:]
+  _WritePairs(writer, header, range_pairs)
+
+  # Bounds, in variable index order.
+  bound_prefix = ' %%-2s %%-%ds  ' % name_width
+  bound_format = bound_prefix + pair_format[2:] + '\n'
+  bound_prefix += '%s\n'
+  has_bounds = False
+  for batch in _Batches(num_vars, batch_size):
+    lines = []
+    for var_name, lb, ub, integer in zip(var_names[batch],
+                                         var_lb[batch].tolist(),
+                                         var_ub[batch].tolist(),
+                                         is_integer[batch].tolist()):
+      var_name = var_name.replace(' ', '_')
+      if lb == ub:
+        lines.append(bound_format % ('FX', 'BOUND', var_name,
+                                     _FormatNumber(lb)))
+      elif lb == -math.inf and ub == math.inf:
+        lines.append(bound_prefix % ('FR', 'BOUND', var_name))
+      elif integer and -1.0 < lb <= 0.0 and 1.0 <= ub < 2.0:
+        lines.append(bound_prefix % ('BV', 'BOUND', var_name))
+      elif not integer and lb == 0.0 and ub == math.inf:
+        lines.append(bound_prefix % ('PL', 'BOUND', var_name))
+      else:
+        if lb == -math.inf:
+          lines.append(bound_prefix % ('MI', 'BOUND', var_name))
+        elif lb != 0.0 or ub == math.inf:
+          # Integer variables get an explicit lower bound even when it is 0,
+          # so that readers do not take them for binary ones.
+          lines.append(bound_format % ('LI' if integer else 'LO', 'BOUND',
+                                       var_name, _FormatNumber(lb)))
+        if ub != math.inf:
+          lines.append(bound_format % ('UI' if integer else 'UP', 'BOUND',
+                                       var_name, _FormatNumber(ub)))
+    if lines and not has_bounds:
+      writer.Write('BOUNDS\n')
+      has_bounds = True
+    writer.Write(''.join(lines))
+  writer.Write('ENDATA\n')
+  writer.Flush()
+
+
+def WriteMPModelProtoAsMps(out: TextIO,
+                           model_proto: linear_solver_pb2.MPModelProto,
+                           buffer_size: int = DEFAULT_BUFFER_SIZE):
+  WriteMps(out, mip_arrays.MPModelProtoToMipArrays(model_proto),
+           name=model_proto.name if model_proto.HasField('name') else None,
+           maximize=model_proto.maximize,
+           objective_offset=model_proto.objective_offset,
+           buffer_size=buffer_size)
@@ -0,0 +1,101 @@
+import io
+import tracemalloc
+
+import numpy as np
+
+from absl.testing import absltest
+from ortools.linear_solver import pywraplp
+
+from common import mip_arrays
+from common import mps_writer
+
+
+class _CountingSink(object):
+  '''A text file that only counts what is written to it.'''
+
+  def __init__(self):
+    self.size = 0
+
+  def write(self, text: str):
+    self.size += len(text)
+
+
+def _LargeModel(num_vars: int, num_cons: int, row_length: int,
+                seed: int = 0) -> mip_arrays.MipArrays:
+  rng = np.random.default_rng(seed)
+  builder = mip_arrays.MipArraysBuilder()
+  builder.AddVariables(
+      mip_arrays.GridNames('x', num_vars), lower_bound=0.0,
+      upper_bound=rng.integers(1, 10, num_vars),
+      objective=rng.integers(-3, 4, num_vars),
+      is_integer=rng.random(num_vars) < 0.5)
+  builder.AddConstraints(
+      mip_arrays.GridNames('ct', num_cons),
+      lower_bound=np.where(rng.random(num_cons) < 0.5, -np.inf, -1.0),
+      upper_bound=rng.integers(1, 100, num_cons),
+      col_index=rng.integers(0, num_vars, (num_cons, row_length)),
+      coefficient=rng.integers(-9, 10, (num_cons, row_length)))
+  return builder.Build()
+
+
+def _MixedModel(seed: int) -> mip_arrays.MipArrays:
+  '''Binary, integer and free variables, and every kind of row.'''
+  rng = np.random.default_rng(seed)
+  builder = mip_arrays.MipArraysBuilder()
+  builder.AddVariables(mip_arrays.GridNames('place', 4, 3), lower_bound=0.0,
+                       upper_bound=1.0, is_integer=True)
+  builder.AddVariables(mip_arrays.GridNames('count', 5), lower_bound=-2.0,
+                       upper_bound=rng.integers(1, 50, 5),
+                       objective=rng.normal(size=5), is_integer=True)
+  builder.AddVariables(
+      mip_arrays.GridNames('load', 6), lower_bound=[-np.inf, 0, 1.5, 0, -3, 0],
+      upper_bound=[np.inf, np.inf, 2.5, 0.25, 4, 1e30],
+      objective=rng.uniform(-1, 1, 6) / 3)
+  num_vars = builder.num_vars
+  builder.AddConstraints(
+      mip_arrays.GridNames('ct', 8),
+      lower_bound=[-np.inf, 1, 2, 0, -5, -np.inf, 1 / 3, 0],
+      upper_bound=[3, np.inf, 2, 7.5, -5, np.inf, 1e6, 0],
+      col_index=rng.integers(0, num_vars, (8, 4)),
+      coefficient=np.round(rng.normal(size=(8, 4)) * 100, 5))
+  return builder.Build()
+
+
+class WriteMpsTest(absltest.TestCase):
+
+  def testSameAsOrTools(self):
+    for seed in range(3):
+      for arrays in (_MixedModel(seed), _LargeModel(40, 30, 4, seed)):
+        for name, maximize, objective_offset in [(None, False, 0.0),
+                                                 ('model_%d' % seed, True,
+                                                  -2.5)]:
+          model_proto = mip_arrays.MipArraysToMPModelProto(arrays, name)
+          model_proto.maximize = maximize
+          model_proto.objective_offset = objective_offset
+          out = io.StringIO()
+          # Small buffers, so that every section is written in many batches.
+          mps_writer.WriteMps(out, arrays, name=name, maximize=maximize,
+                              objective_offset=objective_offset,
+                              buffer_size=256)
+          self.assertEqual(out.getvalue(),
+                           pywraplp.ExportModelAsMpsFormat(model_proto))
+
+  def testPeakMemoryIsBoundedByBufferSize(self):
+    arrays = _LargeModel(num_vars=50000, num_cons=40000, row_length=10)
+    buffer_size = 1 << 20
+    # One-time allocations of the first write are not held by the writer.
+    mps_writer.WriteMps(_CountingSink(), _LargeModel(10, 5, 3))
+    sink = _CountingSink()
+    tracemalloc.start()
+    try:
+      mps_writer.WriteMps(sink, arrays, buffer_size=buffer_size)
+      peak = tracemalloc.get_traced_memory()[1]
+    finally:
+      tracemalloc.stop()
+    # The text is many times larger than what the writer may hold.
+    self.assertGreater(sink.size, 12 * buffer_size)
+    self.assertLess(peak, 6 * buffer_size)
+
+
+if __name__ == '__main__':
+  absltest.main()
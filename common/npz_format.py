@@ -0,0 +1,134 @@
+'''Columnar .npz files holding a MipArrays, and a loader that maps them.
+
+Each field of the MipArrays is stored as an uncompressed .npy member of the
+archive. Names are stored as their concatenated UTF-8 bytes (<field>_data)
+plus CSR-style offsets (<field>_start), so that no member needs pickling.
+The model name and generator metadata are a JSON object in the 'metadata'
+member.
+
+Because members are stored without compression, LoadNpz can memory-map every
+array straight from the file: loading costs a few header reads whatever the
+size of the model, and pages are only read when the arrays are used.
+'''
+
+import json
+import struct
+import zipfile
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+from common import mip_arrays
+
+_NAME_FIELDS = ('var_name', 'con_name')
+
+# Size of the fixed part of a zip local file header, and the offsets in it of
+# the file name and extra field lengths.
+_LOCAL_HEADER_SIZE = 30
+_LOCAL_HEADER_LENGTHS = 26
+
+
+class PackedNames(Sequence[str]):
+  '''Names stored as UTF-8 bytes with offsets, decoded on access.'''
+
+  def __init__(self, data: np.ndarray, start: np.ndarray):
+    self._data = data
+    self._start = start
+
+  def __len__(self) -> int:
+    return len(self._start) - 1
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self[i] for i in range(*index.indices(len(self)))]
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError('name index out of range')
+    begin, end = self._start[index], self._start[index + 1]
+    return self._data[begin:end].tobytes().decode('utf-8')
+
+  def __iter__(self) -> Iterator[str]:
+    data = self._data.tobytes()
+    start = self._start.tolist()
+    for begin, end in zip(start[:-1], start[1:]):
+      yield data[begin:end].decode('utf-8')
+
+
+def _PackNames(names: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+  encoded = [name.encode('utf-8') for name in names]
+  start = np.zeros(len(encoded) + 1, dtype=np.int64)
+  np.cumsum([len(e) for e in encoded], out=start[1:])
+  return np.frombuffer(b''.join(encoded), dtype=np.uint8), start
+
+
+def WriteNpz(filename: str,
+             arrays: mip_arrays.MipArrays,
+             name: Optional[str] = None,
+             metadata: Sequence[Tuple[str, str]] = ()):
+  '''Writes arrays to filename (which should end with .npz).'''
+  members = {}
+  for field, value in zip(arrays._fields, arrays):
+    if field in _NAME_FIELDS:
+      members[field + '_data'], members[field + '_start'] = _PackNames(value)
+    else:
+      members[field] = np.asarray(value)
+  info = dict(metadata)
+  if name is not None:
+    info['name'] = name
+  members['metadata'] = np.frombuffer(
+      json.dumps(info, sort_keys=True).encode('utf-8'), dtype=np.uint8)
+  with open(filename, 'wb') as npz_file:
+    np.savez(npz_file, **members)
+
+
+def _MapMember(npz_file, filename: str, info: zipfile.ZipInfo) -> np.ndarray:
+  if info.compress_type != zipfile.ZIP_STORED:
+    raise ValueError('%s: member %s is compressed and cannot be mapped' %
+                     (filename, info.filename))
+  npz_file.seek(info.header_offset + _LOCAL_HEADER_LENGTHS)
+  name_length, extra_length = struct.unpack('<HH', npz_file.read(4))
+  npz_file.seek(info.header_offset + _LOCAL_HEADER_SIZE + name_length +
+                extra_length)
+  version = np.lib.format.read_magic(npz_file)
+  if version == (1, 0):
+    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(npz_file)
+  else:
+    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(npz_file)
+  if dtype.hasobject:
+    raise ValueError('%s: member %s holds Python objects' %
+                     (filename, info.filename))
+  if not np.prod(shape, dtype=np.int64):
+    return np.zeros(shape, dtype=dtype)
+  return np.memmap(filename, dtype=dtype, mode='r', offset=npz_file.tell(),
+                   shape=shape, order='F' if fortran_order else 'C')
+
+
+def LoadNpz(filename: str,
+            mmap: bool = True) -> Tuple[mip_arrays.MipArrays, Dict[str, str]]:
+  '''Loads a file written by WriteNpz.
+
+  Returns the MipArrays and the metadata (including 'name' when the model has
+  one). With mmap, the arrays are read-only memory maps of the file; names are
+  decoded when accessed.
+  '''
+  if mmap:
+    members = {}
+    with open(filename, 'rb') as npz_file:
+      with zipfile.ZipFile(npz_file) as archive:
+        for info in archive.infolist():
+          members[info.filename[:-len('.npy')]] = _MapMember(
+              npz_file, filename, info)
+  else:
+    with np.load(filename, allow_pickle=False) as npz:
+      members = {key: npz[key] for key in npz.files}
+  fields = {}
+  for field in mip_arrays.MipArrays._fields:
+    if field in _NAME_FIELDS:
+      fields[field] = PackedNames(members[field + '_data'],
+                                  members[field + '_start'])
+    else:
+      fields[field] = members[field]
+  metadata = json.loads(np.asarray(members['metadata']).tobytes().decode(
+      'utf-8'))
+  return mip_arrays.MipArrays(**fields), metadata
@@ -0,0 +1,77 @@
+import numpy as np
+
+from absl.testing import absltest
+
+from common import mip_arrays
+from common import npz_format
+
+
+def _Model(seed: int) -> mip_arrays.MipArrays:
+  '''Integer and continuous variables, some unbounded, in rows of 4.'''
+  rng = np.random.default_rng(seed)
+  builder = mip_arrays.MipArraysBuilder()
+  builder.AddVariables(mip_arrays.GridNames('b', 10), lower_bound=0.0,
+                       upper_bound=rng.integers(1, 5, 10),
+                       objective=rng.integers(-3, 4, 10), is_integer=True)
+  builder.AddVariables(
+      mip_arrays.GridNames('x', 20), lower_bound=rng.normal(size=20),
+      upper_bound=np.where(rng.random(20) < 0.2, np.inf, 100.0),
+      objective=rng.uniform(0.5, 20, 20))
+  builder.AddConstraints(
+      mip_arrays.GridNames('ct', 15), lower_bound=-np.inf,
+      upper_bound=rng.normal(size=15) * 100,
+      col_index=rng.integers(0, 30, (15, 4)),
+      coefficient=rng.normal(size=(15, 4)))
+  return builder.Build()
+
+
+class NpzFormatTest(absltest.TestCase):
+
+  def _RoundTrip(self, arrays: mip_arrays.MipArrays, mmap: bool, **kwargs):
+    path = self.create_tempfile(file_path='model.npz').full_path
+    npz_format.WriteNpz(path, arrays, **kwargs)
+    return npz_format.LoadNpz(path, mmap=mmap)
+
+  def testRoundTrip(self):
+    arrays = _Model(0)
+    for mmap in (True, False):
+      loaded, metadata = self._RoundTrip(arrays, mmap, name='kn_0',
+                                         metadata=[('seed', '0')])
+      self.assertEqual(metadata, {'name': 'kn_0', 'seed': '0'})
+      for field, a, b in zip(mip_arrays.MipArrays._fields, loaded, arrays):
+        if field.endswith('_name'):
+          self.assertEqual(list(a), list(b), field)
+        else:
+          np.testing.assert_array_equal(a, b, err_msg=field)
+          self.assertEqual(a.dtype, np.asarray(b).dtype, field)
+      if mmap:
+        self.assertIsInstance(loaded.coefficient, np.memmap)
+
+  def testEmptyModel(self):
+    arrays = mip_arrays.MipArraysBuilder().Build()
+    loaded, metadata = self._RoundTrip(arrays, mmap=True)
+    self.assertEqual(metadata, {})
+    self.assertEmpty(loaded.var_name)
+    self.assertEqual(loaded.row_start.tolist(), [0])
+
+  def testPackedNames(self):
+    names = ['place_0_0', '', 'ünï', 'x']
+    names_data, start = npz_format._PackNames(names)
+    packed = npz_format.PackedNames(names_data, start)
+    self.assertLen(packed, 4)
+    self.assertEqual(list(packed), names)
+    self.assertEqual(packed[2], 'ünï')
+    self.assertEqual(packed[-1], 'x')
+    self.assertEqual(packed[1:3], ['', 'ünï'])
+    with self.assertRaises(IndexError):
+      packed[4]  # pylint: disable=pointless-statement
+
+  def testCompressedMembersAreNotMapped(self):
+    path = self.create_tempfile(file_path='model.npz').full_path
+    np.savez_compressed(path, coefficient=np.ones(10))
+    with self.assertRaisesRegex(ValueError, 'compressed'):
+      npz_format.LoadNpz(path)
+
+
+if __name__ == '__main__':
+  absltest.main()
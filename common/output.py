@@ -0,0 +1,221 @@
+'''Opening of the files the generators write instances to.
+
+Every file is written under a temporary name and renamed once complete, so
+that an interrupted run never leaves a truncated file under the final name.
+Next to it, <file>.sha256 holds its SHA-256 in the format of sha256sum: a
+file is complete if it matches its checksum, see VerifyChecksum.
+'''
+
+import contextlib
+import hashlib
+import io
+import os
+import time
+from typing import BinaryIO, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+from common import compression as compression_lib
+from common import instrumentation
+from common import mip_arrays
+from common import mps_writer
+from common import npz_format
+
+# Formats a model can be written in, and the suffix of the corresponding file:
+# - mps: compressed free MPS text, for solvers. The suffix is the one of the
+#   default gzip compression, see OutputSuffix for the others.
+# - pb: serialized MPModelProto.
+# - npz: columnar arrays, see npz_format.
+OUTPUT_FORMATS = {
+    'mps': '.mps.gz',
+    'pb': '.pb',
+    'npz': '.npz',
+}
+
+CHECKSUM_SUFFIX = '.sha256'
+
+
+def OutputSuffix(
+    output_format: str,
+    compression: compression_lib.Compression = compression_lib.DEFAULT
+) -> str:
+  '''Suffix of the files of output_format, MPS text being compressed so.'''
+  if output_format == 'mps':
+    return '.mps' + compression_lib.SUFFIXES[compression.method]
+  return OUTPUT_FORMATS[output_format]
+
+
+class _TimedWriter(io.RawIOBase):
+  '''Binary writer recording the time spent compressing and writing.'''
+
+  def __init__(self, raw, stats: instrumentation.InstanceStats):
+    super().__init__()
+    self._raw = raw
+    self._stats = stats
+
+  def writable(self) -> bool:
+    return True
+
+  def write(self, data) -> int:
+    start = time.perf_counter()
+    self._raw.write(data)
+    self._stats.seconds['compress'] += time.perf_counter() - start
+    self._stats.counters['mps_uncompressed_bytes'] += len(data)
+    return len(data)
+
+  def flush(self):
+    # Also called by close, once the raw stream is closed.
+    if not self._raw.closed:
+      self._raw.flush()
+
+  def close(self):
+    if not self.closed:
+      # Flushing the last blocks is compression work too.
+      start = time.perf_counter()
+      self._raw.close()
+      self._stats.seconds['compress'] += time.perf_counter() - start
+    super().close()
+
+
+def OpenTextOutput(
+    filename: str,
+    stats: Optional[instrumentation.InstanceStats] = None,
+    compression: Optional[compression_lib.Compression] = None,
+    fileobj: Optional[BinaryIO] = None) -> TextIO:
+  '''Opens filename for writing text, compressed with compression.
+
+  By default, the compression follows the suffix of filename: .gz is gzip,
+  .zst is zstd, anything else is left uncompressed. The same text always gives
+  the same bytes, so that generating the same instance twice (e.g. serially
+  and in a process pool) gives identical files. If stats is given, the time
+  spent in compression goes to its 'compress' stage. If fileobj is given, the
+  bytes go there instead, see compression.OpenBinary.
+  '''
+  compression = compression or compression_lib.FromSuffix(filename)
+  raw = compression_lib.OpenBinary(filename, compression, fileobj)
+  if stats is not None:
+    stats.fields['compression'] = compression.method
+    raw = _TimedWriter(raw, stats)
+  return io.TextIOWrapper(raw, encoding='utf-8')
+
+
+def FileDigest(filename: str) -> str:
+  '''Hex SHA-256 of the content of filename.'''
+  sha = hashlib.sha256()
+  with open(filename, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      sha.update(block)
+  return sha.hexdigest()
+
+
+def _TempName(filename: str) -> str:
+  # Same directory, for the rename to be atomic, and same suffix, which some
+  # writers rely on.
+  directory, basename = os.path.split(filename)
+  return os.path.join(directory, '.tmp%d.%s' % (os.getpid(), basename))
+
+
+def _ReplaceWithChecksum(temp_filename: str, filename: str,
+                         digest: Optional[str] = None):
+  '''Renames temp_filename to filename, then writes its checksum file.'''
+  digest = digest or FileDigest(temp_filename)
+  checksum_file = filename + CHECKSUM_SUFFIX
+  # Dropped first, so that filename is never next to the checksum of an older
+  # version of it.
+  if os.path.lexists(checksum_file):
+    os.remove(checksum_file)
+  os.replace(temp_filename, filename)
+  WriteChecksum(filename, digest)
+
+
+def WriteChecksum(filename: str, digest: Optional[str] = None):
+  '''Writes the checksum file of filename, computing digest if not given.'''
+  digest = digest or FileDigest(filename)
+  checksum_file = filename + CHECKSUM_SUFFIX
+  temp_checksum_file = _TempName(checksum_file)
+  with open(temp_checksum_file, 'w') as f:
+    f.write('%s  %s\n' % (digest, os.path.basename(filename)))
+  os.replace(temp_checksum_file, checksum_file)
+
+
+def VerifyChecksum(filename: str) -> bool:
+  '''Whether filename exists and matches its checksum file.'''
+  try:
+    with open(filename + CHECKSUM_SUFFIX, 'r') as f:
+      expected = f.read().split()
+    return bool(expected) and FileDigest(filename) == expected[0]
+  except OSError:
+    return False
+
+
+@contextlib.contextmanager
+def AtomicOutput(filename: str, digest: Optional[str] = None) -> Iterator[str]:
+  '''Yields a temporary name to write filename to.
+
+  Once the block completes, the temporary file is renamed to filename and its
+  checksum file written, with digest if the caller knows it already. If the
+  block raises, the temporary file is removed.
+  '''
+  temp_filename = _TempName(filename)
+  try:
+    yield temp_filename
+    _ReplaceWithChecksum(temp_filename, filename, digest)
+  finally:
+    if os.path.lexists(temp_filename):
+      os.remove(temp_filename)
+
+
+def CheckOutputFormats(formats: Sequence[str], allow_empty: bool = False):
+  unknown = sorted(set(formats) - set(OUTPUT_FORMATS))
+  if unknown or not (formats or allow_empty):
+    raise ValueError('Output formats must be a non-empty subset of %s, got %s' %
+                     (sorted(OUTPUT_FORMATS), list(formats)))
+
+
+def WriteModel(prefix: str,
+               arrays: mip_arrays.MipArrays,
+               formats: Sequence[str] = ('mps',),
+               name: Optional[str] = None,
+               mps_buffer_size: int = mps_writer.DEFAULT_BUFFER_SIZE,
+               metadata: Sequence[Tuple[str, str]] = (),
+               stats: Optional[instrumentation.InstanceStats] = None,
+               compression: compression_lib.Compression = (
+                   compression_lib.DEFAULT)) -> List[str]:
+  '''Writes arrays to prefix + suffix for each format and returns the files.
+
+  metadata are (key, value) pairs describing how the model was generated. They
+  go to the MPS header and to the .npz metadata; the .pb file only holds the
+  model. The MPS text is compressed with compression, which determines the
+  suffix of its file (see OutputSuffix).
+
+  If stats is given, it records the time spent writing each format (for MPS,
+  split into 'export' and 'compress') and the bytes written. Each file is
+  written atomically along with its checksum file, see AtomicOutput.
+  '''
+  CheckOutputFormats(formats)
+  compression_lib.CheckCompression(compression)
+  stats = stats or instrumentation.InstanceStats(reset_peak=False)
+  filenames = []
+  for output_format in formats:
+    filename = prefix + OutputSuffix(output_format, compression)
+    with AtomicOutput(filename) as temp_filename:
+      if output_format == 'mps':
+        compress_seconds = stats.seconds['compress']
+        with stats.Time('export'), open(temp_filename, 'wb') as raw_file:
+          # Named after filename, which the gzip header records.
+          with OpenTextOutput(filename, stats, compression,
+                              raw_file) as mps_file:
+            mps_writer.WriteMps(mps_file, arrays, name=name,
+                                buffer_size=mps_buffer_size,
+                                header_fields=metadata)
+        # Compression happens within the export, count it only once.
+        stats.seconds['export'] -= stats.seconds['compress'] - compress_seconds
+      elif output_format == 'pb':
+        with stats.Time('write_pb'), open(temp_filename, 'wb') as pb_file:
+          pb_file.write(mip_arrays.MipArraysToBytes(arrays, name))
+      else:
+        with stats.Time('write_npz'):
+          npz_format.WriteNpz(temp_filename, arrays, name, metadata)
+    num_bytes = os.path.getsize(filename)
+    stats.counters[output_format + '_bytes'] += num_bytes
+    stats.counters['output_bytes'] += num_bytes
+    filenames.append(filename)
+  return filenames
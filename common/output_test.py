@@ -0,0 +1,148 @@
+import gzip
+import os
+from unittest import mock
+
+import numpy as np
+
+from absl.testing import absltest
+from ortools.linear_solver import linear_solver_pb2
+
+from common import compression
+from common import instrumentation
+from common import mip_arrays
+from common import mps_reader
+from common import npz_format
+from common import output
+
+
+def _Model(seed: int, num_vars: int, num_cons: int) -> mip_arrays.MipArrays:
+  '''A model whose MPS text reads back exactly.
+
+  Every variable has an objective, so that it appears in COLUMNS, and rows
+  hold distinct columns in increasing order.
+  '''
+  rng = np.random.default_rng(seed)
+  builder = mip_arrays.MipArraysBuilder()
+  builder.AddVariables(
+      mip_arrays.GridNames('x', num_vars), lower_bound=0.0,
+      upper_bound=rng.integers(1, 10, num_vars),
+      objective=rng.integers(1, 5, num_vars),
+      is_integer=np.arange(num_vars) < num_vars // 3)
+  builder.AddConstraints(
+      mip_arrays.GridNames('ct', num_cons), lower_bound=-np.inf,
+      upper_bound=rng.integers(1, 100, num_cons),
+      col_index=np.sort(np.stack([rng.choice(num_vars, 3, replace=False)
+                                  for _ in range(num_cons)]), axis=1),
+      coefficient=rng.integers(1, 10, (num_cons, 3)))
+  return builder.Build()
+
+
+def _GzipName(filename: str) -> bytes:
+  '''The FNAME field of the gzip header of filename.'''
+  with open(filename, 'rb') as f:
+    header = f.read(1024)
+  assert header[3] & 0x08, 'no FNAME'
+  return header[10:header.index(b'\0', 10)]
+
+
+class AtomicOutputTest(absltest.TestCase):
+
+  def testWritesFileAndChecksum(self):
+    filename = os.path.join(self.create_tempdir().full_path, 'model.pb')
+    with output.AtomicOutput(filename) as temp_filename:
+      self.assertNotEqual(temp_filename, filename)
+      with open(temp_filename, 'wb') as f:
+        f.write(b'model')
+      self.assertFalse(os.path.exists(filename))
+    self.assertCountEqual(os.listdir(os.path.dirname(filename)),
+                          ['model.pb', 'model.pb.sha256'])
+    self.assertTrue(output.VerifyChecksum(filename))
+    with open(filename + output.CHECKSUM_SUFFIX) as f:
+      self.assertEqual(f.read(), '%s  model.pb\n' % output.FileDigest(filename))
+    with open(filename, 'ab') as f:
+      f.write(b'!')
+    self.assertFalse(output.VerifyChecksum(filename))
+
+  def testFailureLeavesNothing(self):
+    directory = self.create_tempdir().full_path
+    filename = os.path.join(directory, 'model.pb')
+    with self.assertRaises(RuntimeError):
+      with output.AtomicOutput(filename) as temp_filename:
+        with open(temp_filename, 'wb') as f:
+          f.write(b'partial')
+        raise RuntimeError('interrupted')
+    self.assertEmpty(os.listdir(directory))
+    self.assertFalse(output.VerifyChecksum(filename))
+
+
+class WriteModelTest(absltest.TestCase):
+
+  def testWritesEveryFormat(self):
+    arrays = _Model(0, num_vars=15, num_cons=8)
+    prefix = os.path.join(self.create_tempdir().full_path, 'kn_3')
+    stats = instrumentation.InstanceStats()
+    filenames = output.WriteModel(prefix, arrays, ('mps', 'pb', 'npz'),
+                                  name='kn_3', metadata=[('seed', '3')],
+                                  stats=stats)
+    self.assertEqual(filenames,
+                     [prefix + '.mps.gz', prefix + '.pb', prefix + '.npz'])
+    for filename in filenames:
+      self.assertTrue(output.VerifyChecksum(filename), filename)
+    self.assertEqual(
+        sum(os.path.getsize(filename) for filename in filenames),
+        stats.counters['output_bytes'])
+
+    # The gzip header is named after the file, not its temporary name.
+    self.assertEqual(_GzipName(prefix + '.mps.gz'), b'kn_3.mps')
+    read, metadata = mps_reader.ReadMps(prefix + '.mps.gz')
+    self.assertEqual(metadata['name'], 'kn_3')
+    self.assertEqual(metadata['header_fields'], [('seed', '3')])
+    model_proto = linear_solver_pb2.MPModelProto()
+    with open(prefix + '.pb', 'rb') as f:
+      model_proto.ParseFromString(f.read())
+    self.assertEqual(model_proto,
+                     mip_arrays.MipArraysToMPModelProto(arrays, 'kn_3'))
+    loaded, npz_metadata = npz_format.LoadNpz(prefix + '.npz')
+    self.assertEqual(npz_metadata, {'name': 'kn_3', 'seed': '3'})
+    for field in ('var_upper_bound', 'col_index', 'coefficient'):
+      self.assertEqual(getattr(read, field).tolist(),
+                       getattr(arrays, field).tolist(), field)
+      self.assertEqual(getattr(loaded, field).tolist(),
+                       getattr(arrays, field).tolist(), field)
+
+  def testCompressionSetsSuffix(self):
+    arrays = _Model(1, num_vars=5, num_cons=2)
+    prefix = os.path.join(self.create_tempdir().full_path, 'lb_0')
+    texts = []
+    for method in ('gzip', 'pgzip', 'none'):
+      filename, = output.WriteModel(
+          prefix + method, arrays,
+          compression=compression.Compression(method))
+      self.assertEqual(filename, prefix + method +
+                       output.OutputSuffix('mps',
+                                           compression.Compression(method)))
+      with compression.OpenRead(filename) as f:
+        texts.append(f.read())
+    self.assertEqual(texts[0], texts[1])
+    self.assertEqual(texts[0], texts[2])
+    with gzip.open(prefix + 'gzip.mps.gz') as f:
+      self.assertEqual(f.read(), texts[0])
+
+  def testKeepsThePeakRss(self):
+    # Writing without stats must not reset the peak RSS of the instance being
+    # written.
+    prefix = os.path.join(self.create_tempdir().full_path, 'kn_0')
+    with mock.patch.object(instrumentation, 'ResetPeakRss') as reset_peak_rss:
+      output.WriteModel(prefix, _Model(0, num_vars=5, num_cons=2), ['pb'])
+    reset_peak_rss.assert_not_called()
+
+  def testUnknownFormat(self):
+    with self.assertRaisesRegex(ValueError, 'Output formats'):
+      output.CheckOutputFormats(['lp'])
+    with self.assertRaisesRegex(ValueError, 'Output formats'):
+      output.CheckOutputFormats([])
+    output.CheckOutputFormats([], allow_empty=True)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,105 @@
+'''Runs the generation of many instances on a pool of processes.'''
+
+import collections
+import functools
+import itertools
+import logging
+import multiprocessing
+import traceback
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
+
+# A chunk of instances sent to a worker process holds about this many
+# non-zeros in total, so that small instances are batched to amortize the
+# dispatch overhead while large ones are dispatched one by one.
+_CHUNK_NNZ = 1000000
+
+# Each process gets at least this many chunks so that the load stays balanced
+# when instance sizes vary.
+_MIN_CHUNKS_PER_JOB = 4
+
+
+def ChunkSize(num_instances: int, jobs: int, instance_nnz: int) -> int:
+  by_size = max(1, _CHUNK_NNZ // max(1, instance_nnz))
+  by_balance = max(1, num_instances // (jobs * _MIN_CHUNKS_PER_JOB))
+  return min(by_size, by_balance)
+
+
+def _RunOne(build_fn: Callable[[int], Any],
+            index: int) -> Tuple[int, Optional[str], Any]:
+  try:
+    result = build_fn(index)
+  except Exception:  # pylint: disable=broad-except
+    return index, traceback.format_exc(), None
+  return index, None, result
+
+
+def RunInstances(build_fn: Callable[[int], Any], num_instances: int,
+                 jobs: int = 1, instance_nnz: int = 0,
+                 result_fn: Optional[Callable[[Any], None]] = None,
+                 indices: Optional[Sequence[int]] = None) -> List[int]:
+  '''Calls build_fn(i) for every i in range(num_instances), or in indices.
+
+  With jobs > 1, the calls are spread over a pool of that many processes, so
+  build_fn must be picklable (e.g. a functools.partial of a module-level
+  function) and must derive everything it does from i. instance_nnz is the
+  expected size of one instance and drives how many instances are sent to a
+  process at once.
+
+  A failing instance does not stop the others. Each failure is logged with
+  its traceback, and the sorted indices of the failed instances are returned.
+  The values returned by build_fn for the other instances (which must be
+  picklable) are passed to result_fn in this process, in completion order.
+  '''
+  run_one = functools.partial(_RunOne, build_fn)
+  if indices is None:
+    indices = range(num_instances)
+  if jobs <= 1 or len(indices) <= 1:
+    results = map(run_one, indices)
+    return _CollectFailures(results, result_fn)
+  chunksize = ChunkSize(len(indices), jobs, instance_nnz)
+  logging.info('Building %d models on %d processes, %d per chunk',
+               len(indices), jobs, chunksize)
+  with multiprocessing.Pool(jobs) as pool:
+    return _CollectFailures(
+        pool.imap_unordered(run_one, indices, chunksize), result_fn)
+
+
+def _CollectFailures(results, result_fn) -> List[int]:
+  failures = []
+  for index, error, result in results:
+    if error is not None:
+      logging.error('Failed to build model %d:\n%s', index, error)
+      failures.append(index)
+    elif result_fn is not None:
+      result_fn(result)
+  return sorted(failures)
+
+
+def IterResults(fn: Callable[[int], Any], num_items: Optional[int] = None,
+                jobs: int = 1, prefetch: int = 0) -> Iterator[Any]:
+  '''Yields fn(i) for every i in range(num_items), or forever if None.
+
+  With jobs = 0, each call runs in this process when the consumer asks for
+  the next result. Otherwise the calls run on a pool of jobs processes, ahead
+  of the consumer by at most prefetch calls (2 * jobs by default): the pool
+  waits for the consumer once that many results are pending, which bounds the
+  memory they take. fn must then be picklable, as for RunInstances.
+
+  Results are yielded in order of i. An exception raised by fn(i) is raised
+  by the iterator when it reaches i. Closing the iterator (or dropping it)
+  terminates the pool.
+  '''
+  indices = itertools.count() if num_items is None else range(num_items)
+  if jobs <= 0:
+    for index in indices:
+      yield fn(index)
+    return
+  prefetch = max(1, prefetch or 2 * jobs)
+  with multiprocessing.Pool(jobs) as pool:
+    pending = collections.deque()
+    for index in indices:
+      pending.append(pool.apply_async(fn, (index,)))
+      if len(pending) >= prefetch:
+        yield pending.popleft().get()
+    while pending:
+      yield pending.popleft().get()
@@ -0,0 +1,108 @@
+import functools
+import itertools
+import os
+import random
+import time
+from unittest import mock
+
+from absl.testing import absltest
+
+from common import parallel
+
+
+def _Square(index: int) -> int:
+  if index % 3 == 1:
+    raise ValueError('Instance %d fails' % index)
+  return index * index
+
+
+def _SlowSquare(directory: str, index: int, failing: int = -1) -> int:
+  # Marks the call as started, then finishes at a random time so that the
+  # calls complete out of order.
+  open(os.path.join(directory, str(index)), 'w').close()
+  time.sleep(random.Random(index).uniform(0.0, 0.02))
+  if index == failing:
+    raise ValueError('Item %d fails' % index)
+  return index * index
+
+
+class RunInstancesTest(absltest.TestCase):
+
+  def testFailuresDoNotStopTheRun(self):
+    for jobs in (0, 1, 3):
+      results = []
+      failures = parallel.RunInstances(_Square, 20, jobs=jobs,
+                                       result_fn=results.append)
+      self.assertEqual(failures, [1, 4, 7, 10, 13, 16, 19])
+      self.assertCountEqual(
+          results, [i * i for i in range(20) if i % 3 != 1])
+
+  def testIndices(self):
+    results = []
+    self.assertEqual(
+        parallel.RunInstances(_Square, 20, jobs=2, result_fn=results.append,
+                              indices=[7, 2, 6, 4]), [4, 7])
+    self.assertCountEqual(results, [4, 36])
+
+  def testInline(self):
+    # Without a pool, build_fn need not be picklable and runs in this
+    # process, in order.
+    calls = []
+    with mock.patch.object(parallel.multiprocessing, 'Pool') as pool:
+      for jobs in (0, 1):
+        self.assertEqual(
+            parallel.RunInstances(lambda i: calls.append((i, os.getpid())),
+                                  3, jobs=jobs), [])
+      pool.assert_not_called()
+    self.assertEqual(calls, [(i, os.getpid()) for i in range(3)] * 2)
+
+  def testChunkSize(self):
+    self.assertEqual(parallel.ChunkSize(1000, 4, 0), 62)
+    self.assertEqual(parallel.ChunkSize(1000, 4, 100000), 10)
+    self.assertEqual(parallel.ChunkSize(1000, 4, 10 ** 7), 1)
+    self.assertEqual(parallel.ChunkSize(3, 4, 0), 1)
+
+
+class IterResultsTest(absltest.TestCase):
+
+  def testResultsAreInOrder(self):
+    directory = self.create_tempdir().full_path
+    fn = functools.partial(_SlowSquare, directory)
+    for jobs in (0, 1, 4):
+      self.assertEqual(
+          list(parallel.IterResults(fn, 5, jobs=jobs)),
+          [i * i for i in range(5)])
+      self.assertEqual(
+          list(itertools.islice(parallel.IterResults(fn, jobs=jobs), 5)),
+          [i * i for i in range(5)])
+
+  def testErrorIsRaisedInOrder(self):
+    directory = self.create_tempdir().full_path
+    for jobs in (0, 3):
+      results = parallel.IterResults(
+          functools.partial(_SlowSquare, directory, failing=5), 8,
+          jobs=jobs)
+      self.assertEqual(list(itertools.islice(results, 5)),
+                       [i * i for i in range(5)])
+      with self.assertRaisesRegex(ValueError, 'Item 5 fails'):
+        next(results)
+
+  def testPrefetchLimit(self):
+    for jobs, prefetch in ((0, 0), (2, 0), (2, 3), (3, 1)):
+      directory = self.create_tempdir().full_path
+      limit = prefetch or 2 * jobs
+      results = parallel.IterResults(
+          functools.partial(_SlowSquare, directory), jobs=jobs,
+          prefetch=prefetch)
+      for index in range(12):
+        self.assertEqual(next(results), index * index)
+        # Leave the pool time to run ahead if it could.
+        time.sleep(0.05)
+        # When the consumer holds result index, only the calls up to
+        # index + limit have been started.
+        self.assertLessEqual(len(os.listdir(directory)), index + 1 + limit)
+      results.close()
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,89 @@
+'''Independent random streams of the generators.
+
+Each stage of the sampling of an instance (the items of a knapsack, the
+workers of a load balancing problem, ...) draws from its own stream, derived
+by a NumPy SeedSequence from the hierarchy
+
+  (dataset seed, instance index, stage)
+
+The streams of different instances and stages are statistically independent,
+and each depends only on its own key: instances can be sampled on any thread,
+process or machine and in any order with the same results, and changing how
+one stage is sampled leaves the draws of the others unchanged. No global
+random state is used.
+
+A caller may also draw an instance from its own np.random.Generator (see
+InstanceGenerator): the streams of its stages are then derived from the
+SeedSequence of that generator in the same way.
+'''
+
+import random
+import zlib
+
+import numpy as np
+
+
+def _StageKey(stage: str) -> int:
+  # A stable integer key of the name, unlike hash().
+  return zlib.crc32(stage.encode('utf-8'))
+
+
+def _DatasetSeed(dataset_seed: int) -> int:
+  # SeedSequence only takes non-negative entropy. Negative seeds, which the
+  # generators have always accepted, are taken modulo 2**64 (their 64-bit
+  # two's complement); the others are unchanged.
+  return dataset_seed & (2**64 - 1) if dataset_seed < 0 else dataset_seed
+
+
+def _StageSeed(rng: np.random.Generator, stage: str) -> np.random.SeedSequence:
+  seed_seq = rng.bit_generator.seed_seq
+  if not isinstance(seed_seq, np.random.SeedSequence):
+    raise ValueError('The generator of an instance must be seeded from a '
+                     'SeedSequence, e.g. by np.random.default_rng(seed)')
+  return np.random.SeedSequence(
+      seed_seq.entropy, spawn_key=seed_seq.spawn_key + (_StageKey(stage),),
+      pool_size=seed_seq.pool_size)
+
+
+def InstanceGenerator(dataset_seed: int, index: int) -> np.random.Generator:
+  '''The Generator of the index-th instance of a dataset.
+
+  The generators draw each stage of the instance from StageGenerator(rng,
+  stage) rather than from it directly.
+  '''
+  if index < 0:
+    raise ValueError('Instance indices must be non-negative, got %d' % index)
+  return np.random.Generator(np.random.PCG64(np.random.SeedSequence(
+      _DatasetSeed(dataset_seed), spawn_key=(index,))))
+
+
+def StageGenerator(rng: np.random.Generator,
+                   stage: str) -> np.random.Generator:
+  '''A NumPy Generator drawing from the stream of stage of the instance of rng.
+
+  The stream is a child of the SeedSequence of rng, so it does not depend on
+  what was drawn from rng nor from the other stages.
+  '''
+  return np.random.Generator(np.random.PCG64(_StageSeed(rng, stage)))
+
+
+def StageRandom(rng: np.random.Generator, stage: str) -> random.Random:
+  '''A random.Random drawing from the stream of stage of the instance of rng.'''
+  state = _StageSeed(rng, stage).generate_state(4, np.uint64)
+  return random.Random(int.from_bytes(state.tobytes(), 'little'))
+
+
+def StreamSeed(dataset_seed: int, index: int,
+               stage: str) -> np.random.SeedSequence:
+  '''The SeedSequence of stage of the index-th instance of a dataset.'''
+  return _StageSeed(InstanceGenerator(dataset_seed, index), stage)
+
+
+def Generator(dataset_seed: int, index: int, stage: str) -> np.random.Generator:
+  '''A NumPy Generator drawing from the stream of stage.'''
+  return StageGenerator(InstanceGenerator(dataset_seed, index), stage)
+
+
+def Random(dataset_seed: int, index: int, stage: str) -> random.Random:
+  '''A random.Random drawing from the stream of stage.'''
+  return StageRandom(InstanceGenerator(dataset_seed, index), stage)
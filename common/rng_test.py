@@ -0,0 +1,88 @@
+import numpy as np
+
+from absl.testing import absltest
+
+from common import rng
+
+
+class RngTest(absltest.TestCase):
+
+  def testStreamsAreReproducible(self):
+    np.testing.assert_array_equal(
+        rng.Generator(3, 7, 'items').integers(1 << 30, size=10),
+        rng.Generator(3, 7, 'items').integers(1 << 30, size=10))
+    self.assertEqual(rng.Random(3, 7, 'items').random(),
+                     rng.Random(3, 7, 'items').random())
+    # The streams depend on their key only, not on the global random state.
+    np.random.seed(1)
+    self.assertEqual(
+        rng.StreamSeed(3, 7, 'items').generate_state(4).tolist(),
+        rng.StreamSeed(3, 7, 'items').generate_state(4).tolist())
+
+  def testStreamsAreDistinct(self):
+    keys = [(seed, index, stage) for seed in (0, 1, 2)
+            for index in (0, 1, 2, 1000)
+            for stage in ('items', 'bins', 'supply')]
+    states = {tuple(rng.StreamSeed(*key).generate_state(4).tolist())
+              for key in keys}
+    self.assertLen(states, len(keys))
+    draws = {rng.Random(*key).getrandbits(64) for key in keys}
+    self.assertLen(draws, len(keys))
+
+  def testStreamsAreUncorrelated(self):
+    # Neighbouring instances and stages do not draw related values.
+    samples = np.stack([
+        rng.Generator(0, index, stage).random(10000)
+        for index in range(4) for stage in ('items', 'bins')])
+    correlation = np.corrcoef(samples)
+    off_diagonal = correlation[~np.eye(len(samples), dtype=bool)]
+    self.assertLess(np.abs(off_diagonal).max(), 0.05)
+
+  def testNegativeSeeds(self):
+    states = {
+        seed: rng.StreamSeed(seed, 0, 'items').generate_state(4).tolist()
+        for seed in (-1, -2, 1, 2)
+    }
+    self.assertLen({tuple(state) for state in states.values()}, 4)
+    self.assertEqual(rng.Random(-1, 3, 'items').random(),
+                     rng.Random(-1, 3, 'items').random())
+    with self.assertRaisesRegex(ValueError, 'non-negative'):
+      rng.Generator(0, -1, 'items')
+
+  def testStagesOfAnInstanceGenerator(self):
+    # The streams of a dataset instance are the stages of its generator.
+    instance = rng.InstanceGenerator(3, 7)
+    np.testing.assert_array_equal(
+        rng.StageGenerator(instance, 'items').random(5),
+        rng.Generator(3, 7, 'items').random(5))
+    self.assertEqual(rng.StageRandom(instance, 'items').random(),
+                     rng.Random(3, 7, 'items').random())
+    # Stages do not depend on what was drawn from the generator itself.
+    instance.random(100)
+    np.testing.assert_array_equal(
+        rng.StageGenerator(instance, 'items').random(5),
+        rng.Generator(3, 7, 'items').random(5))
+    # Any generator seeded from a SeedSequence has its own stages.
+    caller = np.random.default_rng(12)
+    self.assertEqual(rng.StageGenerator(caller, 'bins').random(),
+                     rng.StageGenerator(np.random.default_rng(12),
+                                        'bins').random())
+    self.assertNotEqual(rng.StageGenerator(caller, 'bins').random(),
+                        rng.StageGenerator(caller, 'items').random())
+    with self.assertRaisesRegex(ValueError, 'SeedSequence'):
+      # The bit generator of a RandomState has no SeedSequence.
+      rng.StageGenerator(
+          np.random.Generator(np.random.RandomState(0)._bit_generator),
+          'items')
+
+  def testStreamsAreStable(self):
+    # The instances of a dataset seed must not change across versions nor
+    # interpreter runs (stages are not keyed by hash()).
+    self.assertEqual(
+        rng.Generator(0, 0, 'items').integers(1 << 30, size=3).tolist(),
+        [433579479, 993787538, 254638525])
+    self.assertEqual(rng.Random(0, 0, 'items').randint(0, 1 << 30), 743799823)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,261 @@
+'''Shard files packing the files of many instances together.
+
+A dataset written with shards is stored as a few large files
+
+  <out>-00000.shard        records, one per file of an instance
+  <out>-00000.shard.index  one JSON line per record: name, offset, size and
+                           SHA-256 of its data
+
+instead of one file per instance and format. A record is a header (magic,
+name length, data length), the name (the basename the file would have had,
+e.g. kn_12.mps.gz) and the bytes of the file exactly as they would have been
+written, so each record is compressed on its own and reads back with a single
+seek from a shard that is already open. Extract writes a record back out as
+a file, for solvers that need a path.
+
+Shards are append-only: a ShardWriter continues the last shard of output
+until it holds max_bytes, then starts the next one. A record is synced to
+disk before its index line is appended, and a writer drops any record of an
+interrupted run that did not make it to the index, so that an index never
+points past the data. When a name is written again, its last record wins.
+'''
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import struct
+import tempfile
+from typing import Any, BinaryIO, Dict, List, Optional, Sequence, Tuple
+
+from common import output as output_lib
+
+SHARD_SUFFIX = '.shard'
+INDEX_SUFFIX = '.index'
+
+DEFAULT_MAX_BYTES = 1 << 30
+
+_MAGIC = b'MIPR'
+# Magic, name length, data length.
+_HEADER = struct.Struct('<4sIQ')
+
+
+def ShardFiles(output: str) -> List[str]:
+  '''The shard files of output, in order.'''
+  return sorted(glob.glob(glob.escape(output) + '-[0-9]*' + SHARD_SUFFIX))
+
+
+def _ShardFile(output: str, number: int) -> str:
+  return '%s-%05d%s' % (output, number, SHARD_SUFFIX)
+
+
+def _ReadIndex(index_file: str) -> Tuple[List[Dict[str, Any]], int]:
+  '''Entries of index_file up to a torn last line, and their length.'''
+  entries = []
+  length = 0
+  try:
+    with open(index_file, 'rb') as f:
+      for line in f:
+        if not line.endswith(b'\n'):
+          break
+        entries.append(json.loads(line))
+        length += len(line)
+  except FileNotFoundError:
+    pass
+  return entries, length
+
+
+def RebuildIndex(shard_file: str) -> int:
+  '''Rewrites the index of shard_file from its record headers.
+
+  Stops at the first incomplete record. Returns the number of records.
+  '''
+  entries = []
+  size = os.path.getsize(shard_file)
+  with open(shard_file, 'rb') as f:
+    while True:
+      header = f.read(_HEADER.size)
+      if len(header) < _HEADER.size:
+        break
+      magic, name_length, data_length = _HEADER.unpack(header)
+      offset = f.tell() + name_length
+      if magic != _MAGIC or offset + data_length > size:
+        break
+      name = f.read(name_length).decode('utf-8')
+      sha = hashlib.sha256()
+      for block in iter(lambda: f.read(min(1 << 20, offset + data_length -
+                                           f.tell())), b''):
+        sha.update(block)
+      entries.append({'name': name, 'offset': offset, 'size': data_length,
+                      'sha256': sha.hexdigest()})
+  # Indices are appended to, so they have no checksum file.
+  temp_file = shard_file + INDEX_SUFFIX + '.tmp'
+  with open(temp_file, 'w') as f:
+    for entry in entries:
+      f.write(json.dumps(entry, sort_keys=True) + '\n')
+  os.replace(temp_file, shard_file + INDEX_SUFFIX)
+  return len(entries)
+
+
+class ShardWriter(object):
+  '''Appends files to the shards of output.'''
+
+  def __init__(self, output: str, max_bytes: int = DEFAULT_MAX_BYTES):
+    self._output = output
+    self._max_bytes = max_bytes
+    shard_files = ShardFiles(output)
+    self._number = len(shard_files) - 1 if shard_files else 0
+    self._shard = None
+    self._index = None
+    self._Open()
+
+  def _Open(self):
+    shard_file = _ShardFile(self._output, self._number)
+    index_file = shard_file + INDEX_SUFFIX
+    entries, length = _ReadIndex(index_file)
+    end = entries[-1]['offset'] + entries[-1]['size'] if entries else 0
+    # Drops what an interrupted run wrote past its last complete entry.
+    with open(shard_file, 'ab') as shard:
+      if shard.tell() > end:
+        logging.warning('Dropping %d bytes of incomplete records from %s',
+                        shard.tell() - end, shard_file)
+        shard.truncate(end)
+    with open(index_file, 'a') as index:
+      index.truncate(length)
+    self._shard = open(shard_file, 'ab')
+    self._index = open(index_file, 'a')
+
+  def Add(self, name: str, filename: str, digest: Optional[str] = None):
+    '''Appends the content of filename as the record name.
+
+    digest is the SHA-256 of the file, if already known.
+    '''
+    if self._shard.tell() >= self._max_bytes:
+      self._shard.close()
+      self._index.close()
+      self._number += 1
+      self._Open()
+    encoded_name = name.encode('utf-8')
+    size = os.path.getsize(filename)
+    self._shard.write(_HEADER.pack(_MAGIC, len(encoded_name), size))
+    self._shard.write(encoded_name)
+    offset = self._shard.tell()
+    with open(filename, 'rb') as f:
+      shutil.copyfileobj(f, self._shard)
+    self._shard.flush()
+    os.fsync(self._shard.fileno())
+    entry = {
+        'name': name,
+        'offset': offset,
+        'size': size,
+        'sha256': digest or output_lib.FileDigest(filename),
+    }
+    self._index.write(json.dumps(entry, sort_keys=True) + '\n')
+    self._index.flush()
+    os.fsync(self._index.fileno())
+
+  def Close(self):
+    self._shard.close()
+    self._index.close()
+
+
+class ShardReader(object):
+  '''Random access to the records of the shards of output.'''
+
+  def __init__(self, output: str):
+    self._entries = {}
+    for shard_file in ShardFiles(output):
+      for entry in _ReadIndex(shard_file + INDEX_SUFFIX)[0]:
+        self._entries[entry['name']] = dict(entry, shard=shard_file)
+    self._files = {}
+
+  def Names(self) -> List[str]:
+    return sorted(self._entries)
+
+  def __contains__(self, name: str) -> bool:
+    return name in self._entries
+
+  def _File(self, shard_file: str) -> BinaryIO:
+    if shard_file not in self._files:
+      self._files[shard_file] = open(shard_file, 'rb')
+    return self._files[shard_file]
+
+  def Read(self, name: str, verify: bool = False) -> bytes:
+    '''The data of the record name, checked against its SHA-256 if verify.'''
+    entry = self._entries[name]
+    f = self._File(entry['shard'])
+    f.seek(entry['offset'])
+    data = f.read(entry['size'])
+    if len(data) != entry['size'] or (
+        verify and hashlib.sha256(data).hexdigest() != entry['sha256']):
+      raise ValueError('Corrupt record %s in %s' % (name, entry['shard']))
+    return data
+
+  def Extract(self, name: str, filename: str):
+    '''Writes the record name to filename, with its checksum file.'''
+    data = self.Read(name, verify=True)
+    with output_lib.AtomicOutput(filename,
+                                 self._entries[name]['sha256']) as temp_file:
+      with open(temp_file, 'wb') as f:
+        f.write(data)
+
+  def Close(self):
+    for f in self._files.values():
+      f.close()
+    self._files = {}
+
+
+class ShardedOutput(object):
+  '''Moves the files of instances from a staging directory to shards.
+
+  Instances are built with staging_output as their output, in a directory of
+  staging_dir (the system's temporary directory by default), so that their
+  files never reach the file system of output. Add is called with the
+  record of each instance, in the process that owns the shards.
+  '''
+
+  def __init__(self, output: str, suffixes: Sequence[str],
+               max_bytes: int = DEFAULT_MAX_BYTES,
+               staging_dir: Optional[str] = None):
+    self._output = output
+    self._suffixes = list(suffixes)
+    self._staging_dir = tempfile.mkdtemp(prefix='shard-staging-',
+                                         dir=staging_dir)
+    self.staging_output = os.path.join(self._staging_dir,
+                                       os.path.basename(output))
+    self._writer = ShardWriter(output, max_bytes)
+
+  def Complete(self, indices: Sequence[int]) -> List[int]:
+    '''The instances of indices whose files are all in the shards.'''
+    reader = ShardReader(self._output)
+    basename = os.path.basename(self._output)
+    return [
+        index for index in indices
+        if all('%s_%d%s' % (basename, index, suffix) in reader
+               for suffix in self._suffixes)
+    ]
+
+  def Add(self, record: Dict[str, Any]) -> Dict[str, Any]:
+    '''Moves the files of the instance of record into the shards.
+
+    Returns record, with its output as if it had been written to output.
+    '''
+    staged_prefix = record['output']
+    record = dict(record, output=self._output + staged_prefix[
+        len(self.staging_output):])
+    for suffix in self._suffixes:
+      staged_file = staged_prefix + suffix
+      checksum_file = staged_file + output_lib.CHECKSUM_SUFFIX
+      with open(checksum_file, 'r') as f:
+        digest = f.read().split()[0]
+      self._writer.Add(os.path.basename(record['output'] + suffix),
+                       staged_file, digest)
+      os.remove(staged_file)
+      os.remove(checksum_file)
+    return record
+
+  def Close(self):
+    self._writer.Close()
+    shutil.rmtree(self._staging_dir, ignore_errors=True)
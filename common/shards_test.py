@@ -0,0 +1,103 @@
+import os
+
+from absl.testing import absltest
+
+from common import output
+from common import shards
+
+
+class ShardsTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.directory = self.create_tempdir().full_path
+    self.output = os.path.join(self.directory, 'kn')
+
+  def _File(self, name: str, content: bytes) -> str:
+    return self.create_tempfile(file_path=name, content=content,
+                                mode='wb').full_path
+
+  def testWriteAndRead(self):
+    writer = shards.ShardWriter(self.output, max_bytes=200)
+    contents = {'kn_%d.mps.gz' % i: b'model %d ' % i * 10 for i in range(5)}
+    for name, content in contents.items():
+      writer.Add(name, self._File(name, content))
+    writer.Close()
+    # Records of 108 bytes, two per shard.
+    self.assertLen(shards.ShardFiles(self.output), 3)
+    reader = shards.ShardReader(self.output)
+    self.assertEqual(reader.Names(), sorted(contents))
+    for name, content in contents.items():
+      self.assertEqual(reader.Read(name, verify=True), content)
+    self.assertNotIn('kn_5.mps.gz', reader)
+
+    extracted = os.path.join(self.directory, 'out', 'kn_2.mps.gz')
+    os.makedirs(os.path.dirname(extracted))
+    reader.Extract('kn_2.mps.gz', extracted)
+    reader.Close()
+    self.assertTrue(output.VerifyChecksum(extracted))
+    with open(extracted, 'rb') as f:
+      self.assertEqual(f.read(), contents['kn_2.mps.gz'])
+
+  def testLastRecordWins(self):
+    writer = shards.ShardWriter(self.output)
+    writer.Add('kn_0.pb', self._File('a', b'first'))
+    writer.Close()
+    # A later run appends to the same shard.
+    writer = shards.ShardWriter(self.output)
+    writer.Add('kn_0.pb', self._File('b', b'second'))
+    writer.Close()
+    self.assertLen(shards.ShardFiles(self.output), 1)
+    self.assertEqual(shards.ShardReader(self.output).Read('kn_0.pb'),
+                     b'second')
+
+  def testInterruptedRecordIsDropped(self):
+    writer = shards.ShardWriter(self.output)
+    writer.Add('kn_0.pb', self._File('a', b'complete'))
+    writer.Close()
+    shard_file, = shards.ShardFiles(self.output)
+    size = os.path.getsize(shard_file)
+    # A record whose index line was never written, and a torn index line.
+    with open(shard_file, 'ab') as f:
+      f.write(b'MIPR garbage')
+    with open(shard_file + shards.INDEX_SUFFIX, 'a') as f:
+      f.write('{"name": "kn_1.pb"')
+    writer = shards.ShardWriter(self.output)
+    self.assertEqual(os.path.getsize(shard_file), size)
+    writer.Add('kn_1.pb', self._File('b', b'rewritten'))
+    writer.Close()
+    reader = shards.ShardReader(self.output)
+    self.assertEqual(reader.Names(), ['kn_0.pb', 'kn_1.pb'])
+    self.assertEqual(reader.Read('kn_1.pb', verify=True), b'rewritten')
+
+  def testRebuildIndex(self):
+    writer = shards.ShardWriter(self.output)
+    for i in range(3):
+      writer.Add('kn_%d.pb' % i, self._File(str(i), b'x' * i))
+    writer.Close()
+    shard_file, = shards.ShardFiles(self.output)
+    index_file = shard_file + shards.INDEX_SUFFIX
+    with open(index_file) as f:
+      index = f.read()
+    os.remove(index_file)
+    self.assertEqual(shards.RebuildIndex(shard_file), 3)
+    with open(index_file) as f:
+      self.assertEqual(f.read(), index)
+
+  def testCorruptRecord(self):
+    writer = shards.ShardWriter(self.output)
+    writer.Add('kn_0.pb', self._File('a', b'content'))
+    writer.Close()
+    shard_file, = shards.ShardFiles(self.output)
+    with open(shard_file, 'r+b') as f:
+      f.seek(-1, os.SEEK_END)
+      f.write(b'!')
+    reader = shards.ShardReader(self.output)
+    self.assertEqual(reader.Read('kn_0.pb'), b'conten!')
+    with self.assertRaisesRegex(ValueError, 'Corrupt record'):
+      reader.Read('kn_0.pb', verify=True)
+    reader.Close()
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,84 @@
+'''Solving of generated models in process, without writing them out.
+
+The MPModelProto is loaded straight into an OR-Tools MPSolver, which skips
+the MPS export, compression and parsing a solver would otherwise go through.
+'''
+
+import collections
+import logging
+from typing import Any, Dict
+
+from ortools.linear_solver import linear_solver_pb2
+from ortools.linear_solver import pywraplp
+
+# solver is an OR-Tools MIP solver id (SCIP, CBC, HIGHS, ...).
+# time_limit_seconds 0 means no limit. parameters are solver specific, in the
+# solver's own text format. num_threads 0 leaves the solver's default.
+SolveOptions = collections.namedtuple(
+    'SolveOptions', ['solver', 'time_limit_seconds', 'parameters',
+                     'num_threads'],
+    defaults=['SCIP', 0.0, '', 1])
+
+_STATUS_NAMES = {
+    pywraplp.Solver.OPTIMAL: 'OPTIMAL',
+    pywraplp.Solver.FEASIBLE: 'FEASIBLE',
+    pywraplp.Solver.INFEASIBLE: 'INFEASIBLE',
+    pywraplp.Solver.UNBOUNDED: 'UNBOUNDED',
+    pywraplp.Solver.ABNORMAL: 'ABNORMAL',
+    pywraplp.Solver.MODEL_INVALID: 'MODEL_INVALID',
+    pywraplp.Solver.NOT_SOLVED: 'NOT_SOLVED',
+}
+
+
+def _CreateSolver(options: SolveOptions) -> pywraplp.Solver:
+  solver = pywraplp.Solver.CreateSolver(options.solver)
+  if solver is None:
+    raise ValueError('Solver %s is not available in this OR-Tools build' %
+                     options.solver)
+  return solver
+
+
+def CheckSolveOptions(options: SolveOptions):
+  _CreateSolver(options)
+  if options.time_limit_seconds < 0 or options.num_threads < 0:
+    raise ValueError('Time limit and threads must be non-negative: %s' %
+                     (options,))
+
+
+def SolveModel(model: linear_solver_pb2.MPModelProto,
+               options: SolveOptions = SolveOptions()) -> Dict[str, Any]:
+  '''Solves model and returns a JSON serializable record of the result.
+
+  The record holds the solver, its status, the objective value (if a solution
+  was found), the best bound (for MIP solvers), the solve time in seconds and
+  the number of simplex iterations and branch-and-bound nodes.
+  '''
+  solver = _CreateSolver(options)
+  error = solver.LoadModelFromProto(model)
+  if error:
+    raise ValueError('Cannot load model %s: %s' % (model.name, error))
+  if options.time_limit_seconds:
+    solver.SetTimeLimit(int(options.time_limit_seconds * 1000))
+  if options.parameters and not solver.SetSolverSpecificParametersAsString(
+      options.parameters):
+    raise ValueError('Invalid %s parameters: %s' %
+                     (options.solver, options.parameters))
+  if options.num_threads:
+    solver.SetNumThreads(options.num_threads)
+  status = solver.Solve()
+  record = {
+      'solver': options.solver,
+      'status': _STATUS_NAMES.get(status, str(status)),
+      'wall_seconds': solver.WallTime() / 1000.0,
+      'iterations': solver.iterations(),
+  }
+  if status in (pywraplp.Solver.OPTIMAL, pywraplp.Solver.FEASIBLE):
+    record['objective'] = solver.Objective().Value()
+  if solver.IsMip():
+    record['bound'] = solver.Objective().BestBound()
+    record['nodes'] = solver.nodes()
+  logging.info('Solved %s with %s: %s, objective %s, bound %s in %.2fs',
+               model.name, options.solver, record['status'],
+               record.get('objective'), record.get('bound'),
+               record['wall_seconds'])
+  return record
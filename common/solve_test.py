@@ -0,0 +1,64 @@
+from absl.testing import absltest
+from ortools.linear_solver import linear_solver_pb2
+
+from common import solve
+
+
+def _Model() -> linear_solver_pb2.MPModelProto:
+  '''max x + y s.t. x + 2y <= 4, 3x + y <= 6, with x, y integer.
+
+  The LP optimum is 2.8 at (1.6, 1.2), the MIP optimum 2 at (2, 0), (1, 1) or
+  (0, 2). x >= 3 makes it infeasible.
+  '''
+  model = linear_solver_pb2.MPModelProto(name='tiny', maximize=True)
+  for name in ('x', 'y'):
+    model.variable.add(name=name, lower_bound=0.0, upper_bound=10.0,
+                       objective_coefficient=1.0, is_integer=True)
+  model.constraint.add(name='c0', upper_bound=4.0, var_index=[0, 1],
+                       coefficient=[1.0, 2.0])
+  model.constraint.add(name='c1', upper_bound=6.0, var_index=[0, 1],
+                       coefficient=[3.0, 1.0])
+  return model
+
+
+class SolveModelTest(absltest.TestCase):
+
+  def testOptimum(self):
+    record = solve.SolveModel(_Model())
+    self.assertEqual(record['solver'], 'SCIP')
+    self.assertEqual(record['status'], 'OPTIMAL')
+    self.assertAlmostEqual(record['objective'], 2.0)
+    self.assertAlmostEqual(record['bound'], 2.0)
+    self.assertGreaterEqual(record['nodes'], 0)
+    self.assertGreaterEqual(record['wall_seconds'], 0.0)
+
+  def testInfeasible(self):
+    model = _Model()
+    model.variable[0].lower_bound = 3.0
+    record = solve.SolveModel(model)
+    self.assertEqual(record['status'], 'INFEASIBLE')
+    self.assertNotIn('objective', record)
+
+  def testOptions(self):
+    record = solve.SolveModel(
+        _Model(), solve.SolveOptions(time_limit_seconds=10.0,
+                                     parameters='limits/nodes = 1000',
+                                     num_threads=0))
+    self.assertEqual(record['status'], 'OPTIMAL')
+    self.assertAlmostEqual(record['objective'], 2.0)
+
+  def testInvalidParameters(self):
+    with self.assertRaisesRegex(ValueError, 'Invalid SCIP parameters'):
+      solve.SolveModel(_Model(),
+                       solve.SolveOptions(parameters='no/such/parameter = 1'))
+
+  def testCheckSolveOptions(self):
+    solve.CheckSolveOptions(solve.SolveOptions())
+    with self.assertRaisesRegex(ValueError, 'not available'):
+      solve.CheckSolveOptions(solve.SolveOptions(solver='NO_SUCH_SOLVER'))
+    with self.assertRaisesRegex(ValueError, 'non-negative'):
+      solve.CheckSolveOptions(solve.SolveOptions(time_limit_seconds=-1.0))
+
+
+if __name__ == '__main__':
+  absltest.main()
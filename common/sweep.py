@@ -0,0 +1,206 @@
+'''Generation of datasets over a sweep of generator parameters.
+
+A sweep is a JSON file of overrides of the fields of the generator parameters:
+
+  {
+    "grid": {"b_min,b_max": [10, 20, 40], "item_param[0].i_max": [100, 1000]},
+    "points": [{"b_max": 80, "f_min": [1.5, 1.5, 1.5]}]
+  }
+
+Each key is a field path, with [i] selecting an element of a repeated message
+field (added if missing); keys joined by commas are set to the same value.
+"grid" expands to the Cartesian product of its axes, in order, and "points"
+adds the listed overrides after them. Each point is applied on top of the
+base parameters and generates the models of --seed and --num, written to
+<out>_p<point>_<i>.
+
+Jobs are run on a single pool, the largest models first so that the last
+ones to finish are small. Every job that completes or fails is appended to
+<out>_manifest.jsonl along with its overrides, seed, files and statistics.
+Running the same sweep again skips the jobs recorded as done whose files are
+still there: an interrupted or partly failed sweep only builds what is
+missing. Jobs are identified by cache.InstanceKey, so editing the sweep, the
+options or the generator code rebuilds the affected models.
+'''
+
+import collections
+import functools
+import itertools
+import json
+import logging
+import os
+import re
+from typing import Any, Callable, Dict, List, Sequence
+
+from google.protobuf.message import Message
+
+from common import cache as cache_lib
+from common import parallel
+
+_PATH_ELEMENT = re.compile(r'^(\w+)(?:\[(\d+)\])?$')
+
+# One model of a sweep: the index of its point, the index of the model within
+# the point, its output prefix (as passed to BuildRandomizedModel), its job
+# key, the files it writes and the expected size of the point's models.
+SweepJob = collections.namedtuple(
+    'SweepJob', ['point', 'index', 'output', 'key', 'files', 'size'])
+
+
+def LoadSweep(sweep_file: str) -> List[Dict[str, Any]]:
+  '''Returns the list of overrides of the points of sweep_file.'''
+  with open(sweep_file, 'r') as f:
+    sweep = json.load(f)
+  unknown = set(sweep) - {'grid', 'points'}
+  if unknown:
+    raise ValueError('Unknown sweep keys in %s: %s' %
+                     (sweep_file, sorted(unknown)))
+  grid = sweep.get('grid', {})
+  points = [
+      dict(zip(grid, values))
+      for values in itertools.product(*grid.values())
+  ] if grid else []
+  points.extend(sweep.get('points', []))
+  return points
+
+
+def _SetField(message: Message, path: str, value: Any):
+  elements = path.split('.')
+  for element in elements[:-1]:
+    match = _PATH_ELEMENT.match(element)
+    if not match:
+      raise ValueError('Invalid field path: %s' % path)
+    message = getattr(message, match.group(1))
+    if match.group(2) is not None:
+      index = int(match.group(2))
+      while len(message) <= index:
+        message.add()
+      message = message[index]
+  field = elements[-1]
+  if isinstance(value, list):
+    del getattr(message, field)[:]
+    getattr(message, field).extend(value)
+  else:
+    setattr(message, field, value)
+
+
+def ApplyOverrides(params: Message, overrides: Dict[str, Any]) -> Message:
+  '''Returns a copy of params with overrides set.'''
+  params = type(params).FromString(params.SerializeToString())
+  for paths, value in overrides.items():
+    for path in paths.split(','):
+      _SetField(params, path.strip(), value)
+  return params
+
+
+def _ReadManifest(manifest_file: str) -> Dict[str, Dict[str, Any]]:
+  '''Last entry of every job key in manifest_file.'''
+  entries = {}
+  if not os.path.exists(manifest_file):
+    return entries
+  with open(manifest_file, 'r') as f:
+    for line in f:
+      try:
+        entry = json.loads(line)
+      except ValueError:
+        # Torn last line of an interrupted run.
+        continue
+      entries[entry['key']] = entry
+  return entries
+
+
+def _IsDone(entry: Dict[str, Any], files: List[str]) -> bool:
+  return (entry.get('status') == 'done' and entry.get('files') == files and
+          all(os.path.exists(f) for f in files))
+
+
+def _BuildJob(build_fn: Callable[..., Dict[str, Any]], random_seed: int,
+              params: Sequence[Message], jobs: Sequence[SweepJob],
+              position: int) -> Dict[str, Any]:
+  job = jobs[position]
+  record = build_fn(job.output, random_seed, job.index, params[job.point])
+  return dict(record, sweep_job=position)
+
+
+def RunSweep(build_fn: Callable[..., Dict[str, Any]],
+             base_params: Message,
+             points: Sequence[Dict[str, Any]],
+             output: str,
+             random_seed: int,
+             num_models: int,
+             generator_file: str,
+             options: Dict[str, Any],
+             suffixes: Sequence[str],
+             size_fn: Callable[[Message], int],
+             jobs: int = 1,
+             result_fn: Callable[[Dict[str, Any]], None] = None) -> List[str]:
+  '''Builds the models of points missing from the manifest of output.
+
+  build_fn(output, random_seed, index, params) builds one model as the
+  generators' BuildRandomizedModel does, with the given options (which must
+  be JSON serializable, and are part of the job keys). It writes files
+  output_<index> + suffix and returns the statistics of the model, which are
+  recorded in the manifest and passed to result_fn. size_fn(params) estimates
+  the size of a model.
+
+  Returns the output prefixes of the models that failed.
+  '''
+  all_params = [ApplyOverrides(base_params, overrides) for overrides in points]
+  manifest_file = output + '_manifest.jsonl'
+  entries = _ReadManifest(manifest_file)
+  pending = []
+  num_done = 0
+  for point, params in enumerate(all_params):
+    point_output = '%s_p%d' % (output, point)
+    size = size_fn(params)
+    for index in range(num_models):
+      key = cache_lib.InstanceKey(generator_file, params, random_seed + index,
+                                  options)
+      files = [point_output + '_%d' % index + suffix for suffix in suffixes]
+      if key in entries and _IsDone(entries[key], files):
+        num_done += 1
+        continue
+      pending.append(
+          SweepJob(point, index, point_output, key, files, size))
+  # Largest first; stable, so that equal sizes keep the order of the sweep.
+  pending.sort(key=lambda job: -job.size)
+  logging.info('Sweep of %d points: %d models done, %d to build',
+               len(points), num_done, len(pending))
+
+  with open(manifest_file, 'a') as manifest:
+    if manifest.tell():
+      with open(manifest_file, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+          # Ends the torn line, rather than appending to it.
+          manifest.write('\n')
+
+    def Record(job: SweepJob, status: str, record: Dict[str, Any]):
+      entry = {
+          'key': job.key,
+          'status': status,
+          'point': job.point,
+          'overrides': points[job.point],
+          'seed': random_seed + job.index,
+          'files': job.files,
+          'stats': record,
+      }
+      manifest.write(json.dumps(entry, sort_keys=True) + '\n')
+      manifest.flush()
+      os.fsync(manifest.fileno())
+
+    def OnResult(record: Dict[str, Any]):
+      record = dict(record)
+      Record(pending[record.pop('sweep_job')], 'done', record)
+      if result_fn:
+        result_fn(record)
+
+    failures = parallel.RunInstances(
+        functools.partial(_BuildJob, build_fn, random_seed, all_params,
+                          pending), len(pending), jobs,
+        pending[0].size if pending else 0, OnResult)
+    for position in failures:
+      Record(pending[position], 'failed', {})
+  return [
+      '%s_%d' % (pending[position].output, pending[position].index)
+      for position in failures
+  ]
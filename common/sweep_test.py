@@ -0,0 +1,130 @@
+import json
+import os
+
+from absl.testing import absltest
+from ortools.linear_solver import linear_solver_pb2
+
+from common import sweep
+
+
+class ApplyOverridesTest(absltest.TestCase):
+
+  def testOverrides(self):
+    base = linear_solver_pb2.MPModelProto(name='base')
+    base.variable.add(name='x', upper_bound=1.0)
+    params = sweep.ApplyOverrides(base, {
+        'name': 'point',
+        'variable[0].upper_bound, variable[2].upper_bound': 3.0,
+        'constraint[0].var_index': [0, 2],
+    })
+    self.assertEqual(params.name, 'point')
+    self.assertEqual([v.upper_bound for v in params.variable],
+                     [3.0, float('inf'), 3.0])
+    self.assertEqual(params.variable[0].name, 'x')
+    self.assertEqual(params.constraint[0].var_index, [0, 2])
+    # Lists replace the repeated field rather than extending it.
+    params = sweep.ApplyOverrides(params, {'constraint[0].var_index': [1]})
+    self.assertEqual(params.constraint[0].var_index, [1])
+    # base is left alone.
+    self.assertEqual(base.name, 'base')
+    self.assertLen(base.variable, 1)
+    self.assertEqual(base.variable[0].upper_bound, 1.0)
+    with self.assertRaisesRegex(ValueError, 'Invalid field path'):
+      sweep.ApplyOverrides(base, {'variable[x].upper_bound': 1.0})
+
+  def testLoadSweep(self):
+    sweep_file = self.create_tempfile(content=json.dumps({
+        'grid': {'a,b': [1, 2], 'c': ['x', 'y']},
+        'points': [{'a': 5}],
+    }))
+    self.assertEqual(sweep.LoadSweep(sweep_file.full_path), [
+        {'a,b': 1, 'c': 'x'},
+        {'a,b': 1, 'c': 'y'},
+        {'a,b': 2, 'c': 'x'},
+        {'a,b': 2, 'c': 'y'},
+        {'a': 5},
+    ])
+    bad_file = self.create_tempfile(content='{"grids": {}}')
+    with self.assertRaisesRegex(ValueError, 'Unknown sweep keys'):
+      sweep.LoadSweep(bad_file.full_path)
+
+
+class RunSweepTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.output = os.path.join(self.create_tempdir().full_path, 'sweep')
+    self.manifest_file = self.output + '_manifest.jsonl'
+    self.base = linear_solver_pb2.MPModelProto()
+    self.points = [{'name': 'a'}, {'name': 'b'}]
+    self.built = []
+
+  def _Build(self, output, random_seed, index, params):
+    if params.name == 'fail':
+      raise ValueError('Cannot build %s' % params.name)
+    self.built.append((output, index))
+    with open('%s_%d.txt' % (output, index), 'w') as f:
+      f.write('%s %d' % (params.name, random_seed + index))
+    return {'name': params.name}
+
+  def _Run(self, points=None):
+    self.built = []
+    return sweep.RunSweep(self._Build, self.base, points or self.points,
+                          self.output, 10, 2, __file__, {}, ['.txt'],
+                          lambda params: 0, jobs=0)
+
+  def _Manifest(self):
+    with open(self.manifest_file) as f:
+      return f.read().splitlines()
+
+  def testResume(self):
+    self.assertEqual(self._Run(), [])
+    self.assertCountEqual(self.built, [(self.output + '_p%d' % p, i)
+                                       for p in range(2) for i in range(2)])
+    with open(self.output + '_p1_1.txt') as f:
+      self.assertEqual(f.read(), 'b 11')
+    self.assertLen(self._Manifest(), 4)
+
+    self.assertEqual(self._Run(), [])
+    self.assertEqual(self.built, [])
+
+    os.remove(self.output + '_p1_0.txt')
+    self.assertEqual(self._Run(), [])
+    self.assertEqual(self.built, [(self.output + '_p1', 0)])
+    self.assertLen(self._Manifest(), 5)
+
+    # A changed point is a new job.
+    self.assertEqual(self._Run([{'name': 'a'}, {'name': 'c'}]), [])
+    self.assertCountEqual(self.built, [(self.output + '_p1', 0),
+                                       (self.output + '_p1', 1)])
+
+  def testFailuresAreRetried(self):
+    points = [{'name': 'a'}, {'name': 'fail'}]
+    self.assertEqual(self._Run(points),
+                     [self.output + '_p1_0', self.output + '_p1_1'])
+    entries = [json.loads(line) for line in self._Manifest()]
+    self.assertEqual(sorted(entry['status'] for entry in entries),
+                     ['done', 'done', 'failed', 'failed'])
+    self.assertLen(self._Run(points), 2)
+    self.assertEqual(self.built, [])
+
+  def testTornManifestLine(self):
+    self.assertEqual(self._Run(), [])
+    with open(self.manifest_file, 'a') as f:
+      f.write('{"key": "torn", "stat')
+    os.remove(self.output + '_p0_1.txt')
+    self.assertEqual(self._Run(), [])
+    self.assertEqual(self.built, [(self.output + '_p0', 1)])
+    lines = self._Manifest()
+    self.assertLen(lines, 6)
+    self.assertEqual(lines[4], '{"key": "torn", "stat')
+    entry = json.loads(lines[5])
+    self.assertEqual((entry['status'], entry['point'], entry['seed']),
+                     ('done', 0, 11))
+    # The torn line is skipped when the manifest is read again.
+    self.assertEqual(self._Run(), [])
+    self.assertEqual(self.built, [])
+
+
+if __name__ == '__main__':
+  absltest.main()
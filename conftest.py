@@ -0,0 +1,49 @@
+'''pytest configuration of the repository.
+
+The params_pb2 modules of the generators were produced by an older protoc,
+which the C++ implementation of protobuf rejects. The tests use the pure
+Python one, as the generators are run with.
+
+absltest.main parses the flags when a test is run as a binary; under pytest,
+flags (e.g. --test_tmpdir of create_tempfile) keep their default values.
+
+The generators are scripts: each imports its own params_pb2 and defines the
+same flags, so only one of them can be imported in a process. Before the
+tests of a generator are imported, the params_pb2 module and the flags of
+any other generator are dropped. Their functions keep the modules they were
+imported with and do not read flags, only their main does.
+'''
+
+import os
+import sys
+
+os.environ.setdefault('PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION', 'python')
+
+from absl import flags
+import pytest
+
+_GENERATORS = ('knapsack', 'load_balancing')
+
+
+def pytest_configure(config):
+  del config  # Unused.
+  flags.FLAGS.mark_as_parsed()
+
+
+def pytest_collectstart(collector):
+  if not isinstance(collector, pytest.Module):
+    return
+  directory = os.path.dirname(str(collector.path))
+  if os.path.basename(directory) not in _GENERATORS:
+    return
+  params_module = sys.modules.get('params_pb2')
+  if params_module is not None and os.path.dirname(
+      os.path.abspath(params_module.__file__)) != directory:
+    del sys.modules['params_pb2']
+  flags_by_module = flags.FLAGS.flags_by_module_dict()
+  for generator in _GENERATORS:
+    if generator == os.path.basename(directory):
+      continue
+    for flag in list(flags_by_module.get(generator, [])):
+      if flag.name in flags.FLAGS:
+        delattr(flags.FLAGS, flag.name)
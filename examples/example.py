@@ -13,14 +13,20 @@ being generated.
 '''
 
 import logging
+import os
 import random
+import sys
 import example_pb2
 
 from absl import app
 from absl import flags
 from google.protobuf import text_format
 from ortools.linear_solver import linear_solver_pb2
-from ortools.linear_solver import pywraplp
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from common import mps_writer
+from common import rng as rng_lib
 
 FLAGS = flags.FLAGS
 
@@ -41,8 +47,15 @@ flags.DEFINE_string(
     '/tmp/mymps',
     'Pattern where to store the generated MPS files.')
 
+flags.DEFINE_integer(
+    'mps_buffer_size',
+    mps_writer.DEFAULT_BUFFER_SIZE,
+    'How many characters of MPS text to buffer before writing them to the '
+    'output file.')
+
 
-def BuildSingleMPModelProto(num_vars: int) -> linear_solver_pb2.MPModelProto:
+def BuildSingleMPModelProto(
+    num_vars: int, rng: random.Random) -> linear_solver_pb2.MPModelProto:
   model_proto = linear_solver_pb2.MPModelProto()
   for i in range(num_vars):
     var_proto = model_proto.variable.add()
@@ -50,7 +63,7 @@ def BuildSingleMPModelProto(num_vars: int) -> linear_solver_pb2.MPModelProto:
     var_proto.is_integer = True
     var_proto.lower_bound = 0.0
     var_proto.upper_bound = 1.0
-    var_proto.objective_coefficient = random.uniform(0.0, 1.0)
+    var_proto.objective_coefficient = rng.uniform(0.0, 1.0)
 
   ct_proto = model_proto.constraint.add()
   ct_proto.name = 'PickOneConstraint'
@@ -61,18 +74,17 @@ def BuildSingleMPModelProto(num_vars: int) -> linear_solver_pb2.MPModelProto:
   return model_proto
 
 
-def MPModelProtoToMPS(model_proto: linear_solver_pb2.MPModelProto):
-  model_mps = pywraplp.ExportModelAsMpsFormat(model_proto)
-  return model_mps
-
-
-def BuildRandomizedModels(output: str, intent: example_pb2.ExampleIntentProto):
+def BuildRandomizedModels(output: str, intent: example_pb2.ExampleIntentProto,
+                          mps_buffer_size: int = mps_writer.DEFAULT_BUFFER_SIZE):
   for i in range(intent.num_models):
     logging.info('Building model %d', i)
-    model = BuildSingleMPModelProto(intent.num_variables)
+    # Each model draws from its own stream, so that it does not depend on
+    # the models built before it.
+    rng = rng_lib.Random(intent.random_seed, i, 'objective')
+    model = BuildSingleMPModelProto(intent.num_variables, rng)
     model.name = 'RandomizedPickMax_%d' % i
     with open((output + '_%d.mps' % i), 'w') as mps_file:
-      mps_file.write(MPModelProtoToMPS(model))
+      mps_writer.WriteMPModelProtoAsMps(mps_file, model, mps_buffer_size)
 
 
 def main(_):
@@ -90,8 +102,7 @@ def main(_):
   # command line (for all fields set in the intent string).
   text_format.Merge(FLAGS.intent, intent_proto)
 
-  random.seed(intent_proto.random_seed)
-  BuildRandomizedModels(FLAGS.output, intent_proto)
+  BuildRandomizedModels(FLAGS.output, intent_proto, FLAGS.mps_buffer_size)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,59 @@
+'''Lists and extracts the files of instances packed into shards.
+
+Generators run with --shard_max_bytes write the files of their models into
+<out>-<k>.shard files (see common/shards.py) instead of one file each. To
+list them, and write some back out as files for a solver:
+
+  > python extract_instances.py --shards=/data/knapsack --list
+  > python extract_instances.py --shards=/data/knapsack \
+      --names=knapsack_3.mps.gz,knapsack_7.mps.gz --out_dir=/tmp/instances
+
+Without --names, every file is extracted. --rebuild_index rewrites the index
+of each shard from its records, e.g. after it was lost.
+'''
+
+import logging
+import os
+
+from absl import app
+from absl import flags
+
+from common import shards
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('shards', '', 'Output prefix the shards were written to.')
+
+flags.DEFINE_list('names', [], 'Names of the files to extract; all if empty.')
+
+flags.DEFINE_string('out_dir', '.', 'Directory to extract the files to.')
+
+flags.DEFINE_bool('list', False, 'Print the names of the files and exit.')
+
+flags.DEFINE_bool('rebuild_index', False,
+                  'Rewrite the index of every shard from its records first.')
+
+
+def main(_):
+  if FLAGS.rebuild_index:
+    for shard_file in shards.ShardFiles(FLAGS.shards):
+      logging.info('Rebuilt the index of %s: %d records', shard_file,
+                   shards.RebuildIndex(shard_file))
+  reader = shards.ShardReader(FLAGS.shards)
+  if FLAGS.list:
+    for name in reader.Names():
+      print(name)
+    return
+  names = FLAGS.names or reader.Names()
+  missing = [name for name in names if name not in reader]
+  if missing:
+    raise ValueError('Not in the shards of %s: %s' % (FLAGS.shards, missing))
+  os.makedirs(FLAGS.out_dir, exist_ok=True)
+  for name in names:
+    reader.Extract(name, os.path.join(FLAGS.out_dir, name))
+  reader.Close()
+  logging.info('Extracted %d files to %s', len(names), FLAGS.out_dir)
+
+
+if __name__ == '__main__':
+  app.run(main)
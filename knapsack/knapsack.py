@@ -1,14 +1,34 @@
+import collections
+import functools
 import logging
+import os
 import random
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import params_pb2
-import gzip
+
+import numpy as np
 
 from absl import app
 from absl import flags
 
 from google.protobuf import text_format
 from ortools.linear_solver import linear_solver_pb2
-from ortools.linear_solver import pywraplp
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from common import cache as cache_lib
+from common import compression as compression_lib
+from common import dataset_index
+from common import instrumentation
+from common import mip_arrays
+from common import mps_writer
+from common import output as output_lib
+from common import parallel
+from common import rng as rng_lib
+from common import shards
+from common import solve as solve_lib
+from common import sweep as sweep_lib
 
 FLAGS = flags.FLAGS
 
@@ -33,159 +53,865 @@ flags.DEFINE_integer('seed', 0, 'Random seed to use during generation.')
 
 flags.DEFINE_integer('num', 1, 'How many models to generate.')
 
+flags.DEFINE_integer(
+    'mps_buffer_size', mps_writer.DEFAULT_BUFFER_SIZE,
+    'How many characters of MPS text to buffer before writing them to the '
+    'output file.')
+
+flags.DEFINE_integer(
+    'jobs', 1, 'How many processes to generate the models with. Each model '
+    'is identical to the one generated with --jobs=1.')
+
+flags.DEFINE_list(
+    'output_formats', ['mps'],
+    'Comma-separated formats to write each model in: mps (MPS text, '
+    'compressed as set by --compression, for solvers), pb (serialized '
+    'MPModelProto) and npz (columnar arrays '
+    'that common/npz_format.LoadNpz memory-maps without parsing).')
+
+flags.DEFINE_enum(
+    'compression', 'gzip', sorted(compression_lib.SUFFIXES),
+    'How to compress MPS files: gzip; pgzip, gzip deflated by blocks on '
+    '--compression_threads threads, readable by gunzip; zstd, which requires '
+    'the zstandard package and writes .mps.zst files; or none, which writes '
+    '.mps files.')
+
+flags.DEFINE_integer(
+    'compression_level', None,
+    'Compression level of --compression. Defaults to 9 for gzip and pgzip, '
+    '3 for zstd.')
+
+flags.DEFINE_integer(
+    'compression_threads', 1,
+    'How many threads pgzip and zstd compress each file with, 0 for one per '
+    'CPU. With --jobs, the processes already use the CPUs.')
 
-def BuildMipForKnapsack(
-    knapsack: params_pb2.Knapsack) -> linear_solver_pb2.MPModelProto:
-  model_proto = linear_solver_pb2.MPModelProto()
+flags.DEFINE_string(
+    'solver', '',
+    'If set, OR-Tools solver (e.g. SCIP, CBC, HIGHS) to solve each model '
+    'with once built, in process and without going through a file. The '
+    'results go to the --stats_file records. --output_formats may then be '
+    'empty, to write no file at all.')
+
+flags.DEFINE_float(
+    'solve_time_limit', 0.0,
+    'Time limit of each --solver solve in seconds, 0 for none.')
+
+flags.DEFINE_string(
+    'solver_parameters', '',
+    'Parameters of --solver, in its own text format.')
+
+flags.DEFINE_integer(
+    'solver_threads', 1,
+    'How many threads each --solver solve may use, 0 for the solver '
+    'default.')
+
+flags.DEFINE_string(
+    'sweep_file', '',
+    'If set, JSON file of a sweep of overrides of the parameters, see '
+    'common/sweep.py. Each of its points generates the --num models of --seed '
+    'on top of --params_file and --params, written to <out>_p<point>_<i>. '
+    'Progress is recorded in <out>_manifest.jsonl, from which a rerun only '
+    'builds the models missing or failed.')
+
+flags.DEFINE_bool(
+    'skip_existing', False,
+    'Skip the models whose files all exist and match their .sha256 checksum '
+    'files, e.g. to restart a preempted run cheaply. Models with missing, '
+    'partial or corrupt files are built again.')
+
+flags.DEFINE_integer(
+    'shard_max_bytes', 0,
+    'If positive, pack the files of the models into shard files of about '
+    'this many bytes, <out>-<k>.shard with an offset index, instead of '
+    'writing one file per model and format; see common/shards.py. Files '
+    'are extracted with extract_instances.py.')
+
+flags.DEFINE_bool(
+    'write_index', True,
+    'Write the statistics of the models (sizes by block, coefficient ranges, '
+    'degree histograms, numbers of items and bins, ...) to the columnar index '
+    '<out>_index.csv and <out>_index.npz, see common/dataset_index.py.')
 
-  num_items = len(knapsack.item)
-  num_bins = len(knapsack.bin)
+flags.DEFINE_string(
+    'stats_file', '',
+    'If set, file to write generation statistics to, as JSON lines: one per '
+    'instance (time per stage, peak RSS, model size, bytes written) and a '
+    'final {"summary": ...} line with the throughput of the run.')
+
+flags.DEFINE_string(
+    'cache_dir', '',
+    'If set, directory of a cache of generated instances. Instances whose '
+    'params, seed, options and generator code match a cached one are linked '
+    'from the cache instead of being generated.')
+
+flags.DEFINE_integer(
+    'cache_max_bytes', cache_lib.DEFAULT_MAX_BYTES,
+    'Size of the --cache_dir cache above which least recently used instances '
+    'are evicted at the end of a run.')
+
+flags.DEFINE_enum(
+    'formulation', 'direct', ['direct', 'shared_load'],
+    'direct writes the load of each bin and resource in both its supply and '
+    'deficit rows. shared_load defines it once as a load variable referenced '
+    'by both rows, which halves the non-zeros. The models are equivalent. '
+    'The formulation is recorded in the header of the MPS file.')
+
+flags.DEFINE_enum(
+    'sampler', 'legacy', ['legacy', 'fast'],
+    'How to sample knapsacks. legacy draws from the random module and '
+    'reproduces the instances of earlier versions for the same seed. fast '
+    'draws each group of items in bulk from NumPy Generators with independent '
+    'streams for every instance and sampling stage (see common/rng.py); its '
+    'instances follow the same distribution but differ from the legacy ones.')
+
+flags.DEFINE_integer(
+    'max_sampling_attempts', 0,
+    'If positive, check that each sampled knapsack has a placement (enough '
+    'total supply, every item fitting in as many bins as it has copies, and '
+    'a first-fit decreasing placement of all copies) and resample those '
+    'that fail, from their own random streams, up to this many samples per '
+    'instance. Instances that pass the first time are unchanged. The '
+    'rejected samples are logged and counted in the statistics.')
+
+
+KnapsackArrays = collections.namedtuple('KnapsackArrays',
+                                        ['copies', 'demand', 'supply'])
+
+
+def KnapsackToArrays(knapsack: params_pb2.Knapsack) -> KnapsackArrays:
+  # copies[i] = item(i).c
+  # demand[i, r] = item(i).d(r)
+  # supply[b, r] = bin(b).s(r)
   num_resources = knapsack.r
+  copies = np.fromiter((item.c for item in knapsack.item), dtype=np.int64,
+                       count=len(knapsack.item))
+  demand = np.array([item.d for item in knapsack.item],
+                    dtype=np.float64).reshape(-1, num_resources)
+  supply = np.array([b.s for b in knapsack.bin],
+                    dtype=np.float64).reshape(-1, num_resources)
+  return KnapsackArrays(copies=copies, demand=demand, supply=supply)
+
+
+def KnapsackStatistics(knapsack_arrays: KnapsackArrays) -> Dict[str, int]:
+  copies, demand, supply = knapsack_arrays
+  return {
+      'num_items': len(copies),
+      'num_copies': int(copies.sum()),
+      'num_bins': len(supply),
+      'num_resources': demand.shape[1],
+  }
+
+
+def KnapsackArraysToProto(
+    knapsack_arrays: KnapsackArrays) -> params_pb2.Knapsack:
+  copies, demand, supply = knapsack_arrays
+  knapsack = params_pb2.Knapsack()
+  knapsack.r = demand.shape[1]
+  for c, d in zip(copies.tolist(), demand.tolist()):
+    item = knapsack.item.add()
+    item.c = c
+    item.d.extend(d)
+  for s in supply.tolist():
+    knapsack.bin.add().s.extend(s)
+  return knapsack
 
-  # place_vars[i][b] contains the index of a variable denoting whether to place
+
+def BuildMipArraysForKnapsack(knapsack: params_pb2.Knapsack,
+                              formulation: str = 'direct'
+                             ) -> mip_arrays.MipArrays:
+  return BuildMipArraysForKnapsackArrays(KnapsackToArrays(knapsack),
+                                         formulation)
+
+
+def BuildMipArraysForKnapsackArrays(knapsack_arrays: KnapsackArrays,
+                                    formulation: str = 'direct'
+                                   ) -> mip_arrays.MipArrays:
+  if formulation not in ('direct', 'shared_load'):
+    raise ValueError('Unknown formulation: %s' % formulation)
+  copies, demand, supply = knapsack_arrays
+  num_items, num_resources = demand.shape
+  num_bins = len(supply)
+  builder = mip_arrays.MipArraysBuilder()
+
+  # place_vars[i, b] contains the index of a variable denoting whether to place
   # a copy of item i in bin b.
-  place_vars = [[None] * num_bins for _ in range(num_items)]
-  for i in range(num_items):
-    for b in range(num_bins):
-      place_vars[i][b] = len(model_proto.variable)
-      var_proto = model_proto.variable.add()
-      var_proto.name = 'place_%d_%d' % (i, b)
-      var_proto.is_integer = True
-      var_proto.lower_bound = 0.0
-      var_proto.upper_bound = 1.0
+  place_vars = builder.AddVariables(
+      mip_arrays.GridNames('place', num_items, num_bins),
+      lower_bound=0.0, upper_bound=1.0, is_integer=True).reshape(
+          num_items, num_bins)
 
   # Place the appropriate number of copies for each item:
   # for i:
   #   sum_{b} place(i, b) = item(i).c
-  for i in range(num_items):
-    ct_proto = model_proto.constraint.add()
-    ct_proto.name = 'copies_ct_%d' % i
-    ct_proto.lower_bound = knapsack.item[i].c
-    ct_proto.upper_bound = knapsack.item[i].c
-    for b in range(num_bins):
-      ct_proto.var_index.append(place_vars[i][b])
-      ct_proto.coefficient.append(1.0)
+  builder.AddConstraints(
+      mip_arrays.GridNames('copies_ct', num_items),
+      lower_bound=copies, upper_bound=copies,
+      col_index=place_vars, coefficient=1.0)
+
+  if formulation == 'shared_load':
+    return _BuildSharedLoadMipArrays(builder, place_vars, demand, supply)
 
   # Ensure all items fit in their bins:
   # for b, r:
   #   sum_{i} item(i).d(r) * place(i, b) <= knapsack.bin(b).s(r)
-  for b in range(num_bins):
-    for r in range(num_resources):
-      ct_proto = model_proto.constraint.add()
-      ct_proto.name = 'supply_ct_%d_%d' % (b, r)
-      ct_proto.upper_bound = knapsack.bin[b].s[r]
-      for i in range(num_items):
-        ct_proto.var_index.append(place_vars[i][b])
-        ct_proto.coefficient.append(knapsack.item[i].d[r])
-
-  # deficit_vars[b][r] contains the index of a variable tracking the deficit
+  builder.AddConstraints(
+      mip_arrays.GridNames('supply_ct', num_bins, num_resources),
+      lower_bound=-np.inf, upper_bound=supply.reshape(-1),
+      col_index=np.broadcast_to(place_vars.T[:, None, :],
+                                (num_bins, num_resources, num_items)).reshape(
+                                    num_bins * num_resources, num_items),
+      coefficient=np.broadcast_to(demand.T[None, :, :],
+                                  (num_bins, num_resources, num_items)).reshape(
+                                      num_bins * num_resources, num_items))
+
+  # deficit_vars[b, r] contains the index of a variable tracking the deficit
   # of the utilization of the resource r in bin b wrt the utilization expected
   # in a perfectly balanced placement.
-  deficit_vars = [[None] * num_resources for _ in range(num_bins)]
-  for b in range(num_bins):
-    for r in range(num_resources):
-      deficit_vars[b][r] = len(model_proto.variable)
-      var_proto = model_proto.variable.add()
-      var_proto.name = 'deficit_%d_%d' % (b, r)
-      var_proto.is_integer = False
-      var_proto.lower_bound = 0.0
-      var_proto.upper_bound = 1.0
-      var_proto.objective_coefficient = 1.0
+  deficit_vars = builder.AddVariables(
+      mip_arrays.GridNames('deficit', num_bins, num_resources),
+      lower_bound=0.0, upper_bound=1.0, objective=1.0).reshape(
+          num_bins, num_resources)
 
   # for b, r:
   #   1 - num_bins / t(r) * sum_{i} item(i).d(r) * place(i, b) <= deficit(b, r)
   #
   #   where t(r) is the total demand for resource r.
-  for r in range(num_resources):
-    t = sum(item.d[r] for item in knapsack.item)
-    for b in range(num_bins):
-      ct_proto = model_proto.constraint.add()
-      ct_proto.name = 'deficit_ct_%d_%d' % (b, r)
-      ct_proto.lower_bound = 1.0
-      ct_proto.var_index.append(deficit_vars[b][r])
-      ct_proto.coefficient.append(1.0)
-      for i in range(num_items):
-        ct_proto.var_index.append(place_vars[i][b])
-        ct_proto.coefficient.append(knapsack.item[i].d[r] * num_bins / t)
-
-  max_deficit_vars = [None] * num_resources
-  for r in range(num_resources):
-    max_deficit_vars[r] = len(model_proto.variable)
-    var_proto = model_proto.variable.add()
-    var_proto.name = 'max_deficit_%d' % r
-    var_proto.is_integer = False
-    var_proto.lower_bound = 0.0
-    var_proto.upper_bound = 1.0
-    # We hard-code a weighting between inf and L1 norms in the objective (the
-    # former is always strictly more important than the latter).
-    var_proto.objective_coefficient = 10.0 * num_bins * num_resources
+  #
+  # The rows are ordered by r first. t(r) is summed sequentially (not with
+  # np.sum, which sums pairwise) to keep the coefficients bit-exact.
+  t = np.array([sum(demand[:, r].tolist()) for r in range(num_resources)])
+  scaled_demand = demand.T * num_bins / t[:, None]
+  deficit_cols = np.empty((num_resources, num_bins, 1 + num_items),
+                          dtype=np.int64)
+  deficit_cols[:, :, 0] = deficit_vars.T
+  deficit_cols[:, :, 1:] = place_vars.T[None, :, :]
+  deficit_coefs = np.empty((num_resources, num_bins, 1 + num_items))
+  deficit_coefs[:, :, 0] = 1.0
+  deficit_coefs[:, :, 1:] = scaled_demand[:, None, :]
+  builder.AddConstraints(
+      ['deficit_ct_%d_%d' % (b, r) for r in range(num_resources)
+       for b in range(num_bins)],
+      lower_bound=1.0, upper_bound=np.inf,
+      col_index=deficit_cols.reshape(num_resources * num_bins, -1),
+      coefficient=deficit_coefs.reshape(num_resources * num_bins, -1))
+
+  _AddMaxDeficit(builder, deficit_vars)
+  return builder.Build()
+
+
+def _BuildSharedLoadMipArrays(builder: mip_arrays.MipArraysBuilder,
+                              place_vars: np.ndarray, demand: np.ndarray,
+                              supply: np.ndarray) -> mip_arrays.MipArrays:
+  num_items, num_resources = demand.shape
+  num_bins = len(supply)
+
+  # load_vars[b, r] contains the index of a variable denoting the utilization
+  # of the resource r in bin b.
+  load_vars = builder.AddVariables(
+      mip_arrays.GridNames('load', num_bins, num_resources),
+      lower_bound=-np.inf, upper_bound=np.inf).reshape(num_bins, num_resources)
 
-  # for r, b:
-  #   max_deficit(r) >= deficit(b, r)
-  for b in range(num_bins):
-    for r in range(num_resources):
-      ct_proto = model_proto.constraint.add()
-      ct_proto.name = 'max_deficit_ct_%d_%d' % (b, r)
-      ct_proto.lower_bound = 0.0
-      ct_proto.var_index.append(max_deficit_vars[r])
-      ct_proto.coefficient.append(1.0)
-      ct_proto.var_index.append(deficit_vars[b][r])
-      ct_proto.coefficient.append(-1.0)
+  # for b, r:
+  #   load(b, r) = sum_{i} item(i).d(r) * place(i, b)
+  load_cols = np.empty((num_bins, num_resources, 1 + num_items),
+                       dtype=np.int64)
+  load_cols[:, :, 0] = load_vars
+  load_cols[:, :, 1:] = place_vars.T[:, None, :]
+  load_coefs = np.empty((num_bins, num_resources, 1 + num_items))
+  load_coefs[:, :, 0] = 1.0
+  load_coefs[:, :, 1:] = -demand.T[None, :, :]
+  builder.AddConstraints(
+      mip_arrays.GridNames('load_ct', num_bins, num_resources),
+      lower_bound=0.0, upper_bound=0.0,
+      col_index=load_cols.reshape(num_bins * num_resources, -1),
+      coefficient=load_coefs.reshape(num_bins * num_resources, -1))
 
-  return model_proto
+  # Ensure all items fit in their bins:
+  # for b, r:
+  #   load(b, r) <= knapsack.bin(b).s(r)
+  builder.AddConstraints(
+      mip_arrays.GridNames('supply_ct', num_bins, num_resources),
+      lower_bound=-np.inf, upper_bound=supply.reshape(-1),
+      col_index=load_vars.reshape(-1, 1), coefficient=1.0)
+
+  # deficit_vars[b, r] is as in BuildMipArraysForKnapsack.
+  deficit_vars = builder.AddVariables(
+      mip_arrays.GridNames('deficit', num_bins, num_resources),
+      lower_bound=0.0, upper_bound=1.0, objective=1.0).reshape(
+          num_bins, num_resources)
 
+  # for b, r:
+  #   1 - num_bins / t(r) * load(b, r) <= deficit(b, r)
+  #
+  #   where t(r) is the total demand for resource r.
+  t = np.array([sum(demand[:, r].tolist()) for r in range(num_resources)])
+  deficit_cols = np.stack([deficit_vars.T, load_vars.T], axis=2)
+  deficit_coefs = np.stack([
+      np.ones((num_resources, num_bins)),
+      np.broadcast_to((num_bins / t)[:, None], (num_resources, num_bins))
+  ], axis=2)
+  builder.AddConstraints(
+      ['deficit_ct_%d_%d' % (b, r) for r in range(num_resources)
+       for b in range(num_bins)],
+      lower_bound=1.0, upper_bound=np.inf,
+      col_index=deficit_cols.reshape(num_resources * num_bins, 2),
+      coefficient=deficit_coefs.reshape(num_resources * num_bins, 2))
+
+  _AddMaxDeficit(builder, deficit_vars)
+  return builder.Build()
+
+
+def _AddMaxDeficit(builder: mip_arrays.MipArraysBuilder,
+                   deficit_vars: np.ndarray):
+  num_bins, num_resources = deficit_vars.shape
+
+  # We hard-code a weighting between inf and L1 norms in the objective (the
+  # former is always strictly more important than the latter).
+  max_deficit_vars = builder.AddVariables(
+      mip_arrays.GridNames('max_deficit', num_resources),
+      lower_bound=0.0, upper_bound=1.0,
+      objective=10.0 * num_bins * num_resources)
+
+  # for r, b:
+  #   max_deficit(r) >= deficit(b, r)
+  max_deficit_cols = np.stack([
+      np.broadcast_to(max_deficit_vars, (num_bins, num_resources)),
+      deficit_vars,
+  ], axis=2)
+  builder.AddConstraints(
+      mip_arrays.GridNames('max_deficit_ct', num_bins, num_resources),
+      lower_bound=0.0, upper_bound=np.inf,
+      col_index=max_deficit_cols.reshape(num_bins * num_resources, 2),
+      coefficient=np.broadcast_to([1.0, -1.0], (num_bins * num_resources, 2)))
 
-def GenerateKnapsack(params: params_pb2.KnapsackParameters,
-                     random_seed: int) -> params_pb2.Knapsack:
-  random.seed(random_seed)
-  knapsack = params_pb2.Knapsack()
-  assert len(params.f_min) == len(params.f_max)
-  knapsack.r = len(params.f_min)
 
+def BuildMipForKnapsack(
+    knapsack: params_pb2.Knapsack,
+    formulation: str = 'direct') -> linear_solver_pb2.MPModelProto:
+  return mip_arrays.MipArraysToMPModelProto(
+      BuildMipArraysForKnapsack(knapsack, formulation))
+
+
+def _SampleKnapsackLegacy(params: params_pb2.KnapsackParameters,
+                          rng: random.Random) -> KnapsackArrays:
+  # Draws in the same order as earlier versions, so that a random.Random
+  # seeded as the random module used to be gives the same instances.
+  num_resources = len(params.f_min)
+  copies = []
+  demand = []
   for item_param in params.item_param:
-    num_items = random.randint(item_param.i_min, item_param.i_max)
-    for i in range(num_items):
-      item = knapsack.item.add()
-      item.c = random.randint(item_param.c_min, item_param.c_max)
-      item.d.extend([random.uniform(item_param.d_min[r], item_param.d_max[r])
-                     for r in range(knapsack.r)])
-
-  b = random.randint(params.b_min, params.b_max)
-  t = [sum(item.d[r] for item in knapsack.item) for r in range(knapsack.r)]
-  f = [random.uniform(params.f_min[r], params.f_max[r])
-       for r in range(knapsack.r)]
-
-  for _ in range(b):
-    knapsack.bin.add().s.extend([f[r] * t[r] / b for r in range(knapsack.r)])
-  return knapsack
+    num_items = rng.randint(item_param.i_min, item_param.i_max)
+    for _ in range(num_items):
+      copies.append(rng.randint(item_param.c_min, item_param.c_max))
+      demand.append([
+          rng.uniform(item_param.d_min[r], item_param.d_max[r])
+          for r in range(num_resources)
+      ])
+  demand = np.array(demand, dtype=np.float64).reshape(-1, num_resources)
+
+  b = rng.randint(params.b_min, params.b_max)
+  # t(r) is summed sequentially, as the protobuf fields used to be.
+  t = [sum(demand[:, r].tolist()) for r in range(num_resources)]
+  f = [rng.uniform(params.f_min[r], params.f_max[r])
+       for r in range(num_resources)]
+  supply = np.tile([f[r] * t[r] / b for r in range(num_resources)], (b, 1))
+  return KnapsackArrays(copies=np.array(copies, dtype=np.int64),
+                        demand=demand, supply=supply)
+
+
+def _Stage(stage: str, attempt: int) -> str:
+  # The first attempt keeps the streams of the instances sampled without
+  # feasibility check.
+  return stage if attempt == 0 else '%s/attempt_%d' % (stage, attempt)
+
+
+def _SampleKnapsackFast(params: params_pb2.KnapsackParameters,
+                        rng: np.random.Generator,
+                        attempt: int = 0) -> KnapsackArrays:
+  # Draws all the items of an ItemParameters group at once. The items, the
+  # number of bins and the supply factors come from separate streams of the
+  # instance generator rng.
+  items_rng = rng_lib.StageGenerator(rng, _Stage('items', attempt))
+  num_resources = len(params.f_min)
+  copies = []
+  demand = []
+  for item_param in params.item_param:
+    num_items = int(items_rng.integers(item_param.i_min, item_param.i_max,
+                                       endpoint=True))
+    copies.append(items_rng.integers(item_param.c_min, item_param.c_max,
+                                     num_items, endpoint=True))
+    demand.append(items_rng.uniform(
+        np.array(item_param.d_min, dtype=np.float64).reshape(-1),
+        np.array(item_param.d_max, dtype=np.float64).reshape(-1),
+        (num_items, num_resources)))
+  copies = (np.concatenate(copies).astype(np.int64) if copies else
+            np.zeros(0, dtype=np.int64))
+  demand = (np.concatenate(demand) if demand else
+            np.zeros((0, num_resources)))
+
+  b = int(rng_lib.StageGenerator(rng, _Stage('bins', attempt)).integers(
+      params.b_min, params.b_max, endpoint=True))
+  t = demand.sum(axis=0)
+  f = rng_lib.StageGenerator(rng, _Stage('supply', attempt)).uniform(
+      params.f_min, params.f_max)
+  supply = np.tile(f * t / b, (b, 1))
+  return KnapsackArrays(copies=copies, demand=demand, supply=supply)
+
+
+def _SampleKnapsack(params: params_pb2.KnapsackParameters, random_seed: int,
+                    sampler: str, index: int, attempt: int,
+                    rng: Optional[np.random.Generator] = None
+                   ) -> KnapsackArrays:
+  assert len(params.f_min) == len(params.f_max)
+  if sampler == 'legacy' and attempt == 0 and rng is None:
+    return _SampleKnapsackLegacy(params, random.Random(random_seed + index))
+  if rng is None:
+    rng = rng_lib.InstanceGenerator(random_seed, index)
+  if sampler == 'legacy':
+    return _SampleKnapsackLegacy(
+        params, rng_lib.StageRandom(rng, _Stage('legacy', attempt)))
+  if sampler == 'fast':
+    return _SampleKnapsackFast(params, rng, attempt)
+  raise ValueError('Unknown sampler: %s' % sampler)
+
+
+def KnapsackInfeasibility(knapsack_arrays: KnapsackArrays) -> Optional[str]:
+  '''Why a knapsack may be infeasible, or None if a placement was found.
+
+  Checks, in order of cost, that the bins supply the total demand of each
+  resource, that each item fits in as many bins as it has copies (copies of
+  an item go to distinct bins), and that first-fit decreasing places all the
+  copies. The first two only reject infeasible knapsacks; first-fit
+  decreasing is a heuristic, and may reject a few feasible ones.
+  '''
+  copies, demand, supply = knapsack_arrays
+  total_demand = (copies[:, None] * demand).sum(axis=0)
+  if np.any(total_demand > supply.sum(axis=0)):
+    return 'capacity'
+  # fits[i, b] tells whether a copy of item i fits in the empty bin b.
+  fits = np.all(demand[:, None, :] <= supply[None, :, :], axis=2)
+  if np.any(np.count_nonzero(fits, axis=1) < copies):
+    return 'item_fit'
+  # Items by decreasing demand, relative to the average supply of each
+  # resource, of their most demanding resource.
+  average_supply = supply.mean(axis=0) if len(supply) else 1.0
+  size = (demand / np.where(average_supply > 0, average_supply, 1.0)).max(
+      axis=1, initial=0.0)
+  remaining = supply.copy()
+  for i in np.argsort(-size, kind='stable'):
+    if not copies[i]:
+      continue
+    bins = np.flatnonzero(np.all(demand[i] <= remaining, axis=1))[:copies[i]]
+    if len(bins) < copies[i]:
+      return 'first_fit_decreasing'
+    remaining[bins] -= demand[i]
+  return None
+
+
+def SampleFeasibleKnapsack(
+    params: params_pb2.KnapsackParameters, random_seed: int,
+    sampler: str = 'legacy', index: int = 0, max_attempts: int = 1,
+    rng: Optional[np.random.Generator] = None
+) -> Tuple[KnapsackArrays, List[str]]:
+  '''Samples the index-th knapsack, resampling those that fail the check.
+
+  Each sample is checked with KnapsackInfeasibility. The attempt-th resample
+  draws from its own streams (see rng.Generator), so the knapsack is the same
+  whatever the jobs or order of the run, and the first attempt gives the
+  knapsack of SampleKnapsack. Returns the knapsack with the reasons of the
+  rejected samples. Raises ValueError if all max_attempts samples fail.
+  '''
+  rejections = []
+  for attempt in range(max_attempts):
+    knapsack_arrays = _SampleKnapsack(params, random_seed, sampler, index,
+                                      attempt, rng)
+    reason = KnapsackInfeasibility(knapsack_arrays)
+    if reason is None:
+      return knapsack_arrays, rejections
+    rejections.append(reason)
+  raise ValueError('No feasible knapsack in %d samples of instance %d, '
+                   'rejected for %s' % (max_attempts, index,
+                                        ', '.join(sorted(set(rejections)))))
+
+
+def SampleKnapsack(params: params_pb2.KnapsackParameters, random_seed: int,
+                   sampler: str = 'legacy', index: int = 0,
+                   max_attempts: int = 0,
+                   rng: Optional[np.random.Generator] = None) -> KnapsackArrays:
+  '''Samples the index-th knapsack of a dataset, as columnar arrays.
+
+  With sampler='legacy', draws from a random.Random seeded with
+  random_seed + index and gives the same instances as earlier versions. With
+  sampler='fast', draws each group of items in bulk from the streams of
+  rng.Generator(random_seed, index, stage). Both follow the distribution of
+  params, but give different instances for the same seed. Neither uses the
+  global random state. With max_attempts, knapsacks that may be infeasible
+  are resampled, see SampleFeasibleKnapsack.
+
+  If rng is given (see rng.InstanceGenerator), the knapsack is drawn from it
+  instead of random_seed and index: both samplers draw from streams of
+  rng.StageGenerator(rng, stage).
+  '''
+  if max_attempts:
+    return SampleFeasibleKnapsack(params, random_seed, sampler, index,
+                                  max_attempts, rng)[0]
+  return _SampleKnapsack(params, random_seed, sampler, index, 0, rng)
 
 
-def MPModelProtoToMPS(model_proto: linear_solver_pb2.MPModelProto):
-  model_mps = pywraplp.ExportModelAsMpsFormat(model_proto)
-  return model_mps
+def GenerateKnapsack(params: params_pb2.KnapsackParameters,
+                     random_seed: int,
+                     sampler: str = 'legacy',
+                     index: int = 0,
+                     max_attempts: int = 0,
+                     rng: Optional[np.random.Generator] = None
+                    ) -> params_pb2.Knapsack:
+  return KnapsackArraysToProto(
+      SampleKnapsack(params, random_seed, sampler, index, max_attempts, rng))
+
+
+def _SampleCounted(params: params_pb2.KnapsackParameters, random_seed: int,
+                   sampler: str, index: int, max_attempts: int,
+                   stats: instrumentation.InstanceStats) -> KnapsackArrays:
+  '''SampleKnapsack, recording the rejected samples in stats.'''
+  if not max_attempts:
+    return SampleKnapsack(params, random_seed, sampler, index)
+  knapsack_arrays, rejections = SampleFeasibleKnapsack(
+      params, random_seed, sampler, index, max_attempts)
+  stats.counters['rejected_samples'] = len(rejections)
+  if rejections:
+    logging.info('Rejected %d samples of instance %d that may be infeasible: '
+                 '%s', len(rejections), index, ', '.join(rejections))
+  return knapsack_arrays
+
+
+def EstimateModelSize(params: params_pb2.KnapsackParameters,
+                      formulation: str = 'direct') -> int:
+  # Expected number of non-zeros: each place(i, b) appears in the copies row
+  # of item i and in the supply and deficit rows of bin b for every resource
+  # (in the load row only with the shared_load formulation).
+  num_items = sum((p.i_min + p.i_max) / 2 for p in params.item_param)
+  num_bins = (params.b_min + params.b_max) / 2
+  num_resources = len(params.f_min)
+  if formulation == 'shared_load':
+    return int(num_items * num_bins * (1 + num_resources) +
+               6 * num_bins * num_resources)
+  return int(num_items * num_bins * (1 + 2 * num_resources) +
+             3 * num_bins * num_resources)
+
+
+def BuildRandomizedModel(output: str, random_seed: int, index: int,
+                         knapsack_params: params_pb2.KnapsackParameters,
+                         mps_buffer_size: int = mps_writer.DEFAULT_BUFFER_SIZE,
+                         formulation: str = 'direct',
+                         sampler: str = 'legacy',
+                         output_formats: List[str] = ('mps',),
+                         cache_dir: str = '',
+                         compression: compression_lib.Compression = (
+                             compression_lib.DEFAULT),
+                         solve_options: Optional[solve_lib.SolveOptions] = None,
+                         skip_existing: bool = False,
+                         max_attempts: int = 0) -> Dict[str, Any]:
+  '''Builds one model and returns its generation statistics.
+
+  With solve_options, the model is also solved and the result recorded under
+  'solve' in the statistics. With skip_existing, a model whose files are all
+  complete (see output.VerifyChecksum) is left as is. With max_attempts,
+  knapsacks that may be infeasible are resampled (see
+  SampleFeasibleKnapsack), and the rejected samples counted.
+  '''
+  prefix = output + '_%d' % index
+  name = 'Knapsack_%d' % index
+  stats = instrumentation.InstanceStats(
+      generator='knapsack', name=name, seed=random_seed + index,
+      output=prefix, params_hash=dataset_index.ParamsHash(knapsack_params))
+  suffixes = [output_lib.OutputSuffix(f, compression) for f in output_formats]
+  if skip_existing and suffixes and all(
+      output_lib.VerifyChecksum(prefix + suffix) for suffix in suffixes):
+    logging.info('Skipping model %s, its files are complete', prefix)
+    stats.fields['skipped'] = True
+    stats.counters['output_bytes'] = sum(
+        os.path.getsize(prefix + suffix) for suffix in suffixes)
+    return stats.ToDict()
+  # A cached instance would still have to be built to be solved.
+  instance_cache = (cache_lib.InstanceCache(cache_dir)
+                    if cache_dir and not solve_options else None)
+  if instance_cache:
+    key = cache_lib.InstanceKey(
+        __file__, knapsack_params, random_seed + index,
+        dict(name=name, formulation=formulation, sampler=sampler,
+             output_formats=sorted(output_formats),
+             compression=compression._asdict(), max_attempts=max_attempts))
+    with stats.Time('cache'):
+      cached = instance_cache.Fetch(key, prefix, suffixes)
+    if cached:
+      logging.info('Linked model %s from the cache', prefix)
+      stats.fields['cached'] = True
+      statistics = instance_cache.Statistics(key)
+      if statistics is not None:
+        stats.fields['statistics'] = statistics
+      stats.counters['output_bytes'] = sum(
+          os.path.getsize(prefix + suffix) for suffix in suffixes)
+      return stats.ToDict()
+  logging.info('Building model %s', prefix)
+  with stats.Time('sample'):
+    knapsack_arrays = _SampleCounted(knapsack_params, random_seed, sampler,
+                                     index, max_attempts, stats)
+  with stats.Time('build'):
+    model_arrays = BuildMipArraysForKnapsackArrays(knapsack_arrays,
+                                                   formulation)
+  stats.AddModelSize(model_arrays)
+  with stats.Time('statistics'):
+    stats.fields['statistics'] = dict(
+        dataset_index.ModelStatistics(model_arrays),
+        **KnapsackStatistics(knapsack_arrays))
+  if solve_options:
+    with stats.Time('to_proto'):
+      model_proto = mip_arrays.MipArraysToMPModelProto(model_arrays, name)
+    with stats.Time('solve'):
+      stats.fields['solve'] = solve_lib.SolveModel(model_proto, solve_options)
+  if output_formats:
+    output_lib.WriteModel(prefix, model_arrays, output_formats, name=name,
+                          mps_buffer_size=mps_buffer_size,
+                          metadata=[('Formulation', formulation)], stats=stats,
+                          compression=compression)
+  if instance_cache:
+    with stats.Time('cache'):
+      instance_cache.Store(key, prefix, suffixes,
+                           stats.fields['statistics'])
+  return stats.ToDict()
 
 
 def BuildRandomizedModels(output: str, random_seed: int, num_models: int,
                           knapsack_params:
-                          params_pb2.KnapsackParameters):
-  for i in range(num_models):
-    filename = output + '_%d.mps.gz' % i
-    logging.info('Building model %s', filename)
-    knapsack = GenerateKnapsack(knapsack_params, random_seed + i)
-    model = BuildMipForKnapsack(knapsack)
-    model.name = 'Knapsack_%d' % i
-    with gzip.open(filename, 'wt') as mps_file:
-      mps_file.write(MPModelProtoToMPS(model))
+                          params_pb2.KnapsackParameters,
+                          mps_buffer_size: int = mps_writer.DEFAULT_BUFFER_SIZE,
+                          jobs: int = 1,
+                          formulation: str = 'direct',
+                          sampler: str = 'legacy',
+                          output_formats: List[str] = ('mps',),
+                          cache_dir: str = '',
+                          cache_max_bytes: int = cache_lib.DEFAULT_MAX_BYTES,
+                          stats_file: str = '',
+                          compression: compression_lib.Compression = (
+                              compression_lib.DEFAULT),
+                          solve_options: Optional[
+                              solve_lib.SolveOptions] = None,
+                          skip_existing: bool = False,
+                          write_index: bool = True,
+                          shard_max_bytes: int = 0,
+                          max_attempts: int = 0) -> List[int]:
+  '''Builds num_models models and returns the indices of those that failed.
+
+  With write_index, the statistics of the models are added to the index of
+  output, see dataset_index. With shard_max_bytes, the files of the models
+  are packed into shards of that size (see shards.ShardedOutput), and
+  skip_existing skips the models already in them.
+  '''
+  sharded = None
+  indices = None
+  if shard_max_bytes and output_formats:
+    sharded = shards.ShardedOutput(
+        output,
+        [output_lib.OutputSuffix(f, compression) for f in output_formats],
+        shard_max_bytes)
+    if skip_existing:
+      complete = set(sharded.Complete(range(num_models)))
+      logging.info('Skipping %d models already in the shards', len(complete))
+      indices = [i for i in range(num_models) if i not in complete]
+  build_fn = functools.partial(
+      BuildRandomizedModel,
+      sharded.staging_output if sharded else output, random_seed,
+      knapsack_params=knapsack_params, mps_buffer_size=mps_buffer_size,
+      formulation=formulation, sampler=sampler, output_formats=output_formats,
+      cache_dir=cache_dir, compression=compression,
+      solve_options=solve_options, skip_existing=skip_existing and not sharded,
+      max_attempts=max_attempts)
+  summary = instrumentation.RunSummary(
+      stats_file, dataset_index.IndexWriter(output)
+      if write_index and output_formats else None)
+
+  def OnResult(record: Dict[str, Any]):
+    summary.Add(sharded.Add(record) if sharded else record)
+
+  try:
+    failures = parallel.RunInstances(
+        build_fn, num_models, jobs,
+        EstimateModelSize(knapsack_params, formulation), OnResult, indices)
+  finally:
+    if sharded:
+      sharded.Close()
+  summary.Finish(len(failures))
+  if cache_dir:
+    cache_lib.InstanceCache(cache_dir, cache_max_bytes).Evict()
+  return failures
+
+
+def BuildSweep(output: str, random_seed: int, num_models: int,
+               knapsack_params: params_pb2.KnapsackParameters,
+               points: List[Dict[str, Any]],
+               mps_buffer_size: int = mps_writer.DEFAULT_BUFFER_SIZE,
+               jobs: int = 1,
+               formulation: str = 'direct',
+               sampler: str = 'legacy',
+               output_formats: List[str] = ('mps',),
+               cache_dir: str = '',
+               cache_max_bytes: int = cache_lib.DEFAULT_MAX_BYTES,
+               stats_file: str = '',
+               compression: compression_lib.Compression = (
+                   compression_lib.DEFAULT),
+               solve_options: Optional[solve_lib.SolveOptions] = None,
+               skip_existing: bool = False,
+               write_index: bool = True,
+               max_attempts: int = 0) -> List[str]:
+  '''Builds the models of a sweep (see common/sweep.py) not built yet.
+
+  points are the overrides of knapsack_params of each point of the sweep.
+  With write_index, the statistics of the models of all points are added to
+  the index of output. Returns the prefixes of the models that failed.
+  '''
+  build_fn = functools.partial(
+      BuildRandomizedModel, mps_buffer_size=mps_buffer_size,
+      formulation=formulation, sampler=sampler, output_formats=output_formats,
+      cache_dir=cache_dir, compression=compression,
+      solve_options=solve_options, skip_existing=skip_existing,
+      max_attempts=max_attempts)
+  options = dict(formulation=formulation, sampler=sampler,
+                 output_formats=sorted(output_formats),
+                 compression=compression._asdict(), max_attempts=max_attempts)
+  suffixes = [output_lib.OutputSuffix(f, compression) for f in output_formats]
+  summary = instrumentation.RunSummary(
+      stats_file, dataset_index.IndexWriter(output)
+      if write_index and output_formats else None)
+  failures = sweep_lib.RunSweep(
+      build_fn, knapsack_params, points, output, random_seed, num_models,
+      __file__, options, suffixes,
+      functools.partial(EstimateModelSize, formulation=formulation), jobs,
+      summary.Add)
+  summary.Finish(len(failures))
+  if cache_dir:
+    cache_lib.InstanceCache(cache_dir, cache_max_bytes).Evict()
+  return failures
+
+
+def _BuildSerializedInstance(
+    random_seed: int, index: int,
+    knapsack_params: params_pb2.KnapsackParameters,
+    formulation: str = 'direct',
+    sampler: str = 'legacy',
+    solve_options: Optional[solve_lib.SolveOptions] = None,
+    max_attempts: int = 0
+) -> Tuple[bytes, bytes, Dict[str, Any]]:
+  '''Builds one instance, serialized to be sent back from a worker.'''
+  name = 'Knapsack_%d' % index
+  stats = instrumentation.InstanceStats(generator='knapsack', name=name,
+                                        seed=random_seed + index,
+                                        formulation=formulation,
+                                        sampler=sampler)
+  with stats.Time('sample'):
+    knapsack_arrays = _SampleCounted(knapsack_params, random_seed, sampler,
+                                     index, max_attempts, stats)
+  with stats.Time('build'):
+    model_arrays = BuildMipArraysForKnapsackArrays(knapsack_arrays,
+                                                   formulation)
+  stats.AddModelSize(model_arrays)
+  with stats.Time('statistics'):
+    stats.fields['statistics'] = dict(
+        dataset_index.ModelStatistics(model_arrays),
+        **KnapsackStatistics(knapsack_arrays))
+  with stats.Time('serialize'):
+    knapsack_bytes = KnapsackArraysToProto(knapsack_arrays).SerializeToString()
+    model_bytes = mip_arrays.MipArraysToBytes(model_arrays, name)
+  if solve_options:
+    with stats.Time('solve'):
+      stats.fields['solve'] = solve_lib.SolveModel(
+          linear_solver_pb2.MPModelProto.FromString(model_bytes),
+          solve_options)
+  return knapsack_bytes, model_bytes, stats.ToDict()
+
+
+def IterInstances(
+    knapsack_params: params_pb2.KnapsackParameters,
+    random_seed: int = 0,
+    num_models: Optional[int] = None,
+    jobs: int = 1,
+    prefetch: int = 0,
+    formulation: str = 'direct',
+    sampler: str = 'legacy',
+    solve_options: Optional[solve_lib.SolveOptions] = None,
+    max_attempts: int = 0
+) -> Iterator[Tuple[params_pb2.Knapsack, linear_solver_pb2.MPModelProto,
+                    Dict[str, Any]]]:
+  '''Yields (knapsack, model, metadata) for num_models instances, or forever.
+
+  The i-th instance is the one BuildRandomizedModels writes to <out>_i, and
+  metadata holds its name, seed and generation statistics. Nothing is
+  written to disk. The instances are built on jobs background processes (in
+  the calling process if 0), at most prefetch of them ahead of the consumer;
+  see parallel.IterResults. With solve_options, each model is also solved by
+  the process that built it, and the result is in metadata['solve']. With
+  max_attempts, knapsacks that may be infeasible are resampled, see
+  SampleFeasibleKnapsack.
+  '''
+  build_fn = functools.partial(_BuildSerializedInstance, random_seed,
+                               knapsack_params=knapsack_params,
+                               formulation=formulation, sampler=sampler,
+                               solve_options=solve_options,
+                               max_attempts=max_attempts)
+  for knapsack_bytes, model_bytes, metadata in parallel.IterResults(
+      build_fn, num_models, jobs, prefetch):
+    yield (params_pb2.Knapsack.FromString(knapsack_bytes),
+           linear_solver_pb2.MPModelProto.FromString(model_bytes), metadata)
 
 
 def main(_):
+  solve_options = None
+  if FLAGS.solver:
+    solve_options = solve_lib.SolveOptions(FLAGS.solver,
+                                           FLAGS.solve_time_limit,
+                                           FLAGS.solver_parameters,
+                                           FLAGS.solver_threads)
+    solve_lib.CheckSolveOptions(solve_options)
+  output_lib.CheckOutputFormats(FLAGS.output_formats,
+                                allow_empty=bool(solve_options))
+  compression = compression_lib.Compression(FLAGS.compression,
+                                            FLAGS.compression_level,
+                                            FLAGS.compression_threads)
+  compression_lib.CheckCompression(compression)
   knapsack_params = params_pb2.KnapsackParameters()
   if FLAGS.params_file:
     with open(FLAGS.params_file, 'r') as params_file:
       params_str = params_file.read()
       text_format.Merge(params_str, knapsack_params)
   text_format.Merge(FLAGS.params, knapsack_params)
-  BuildRandomizedModels(FLAGS.out, FLAGS.seed, FLAGS.num, knapsack_params)
+  if FLAGS.sweep_file:
+    if FLAGS.shard_max_bytes:
+      raise ValueError('Sweeps are written as separate files, without '
+                       '--shard_max_bytes')
+    failures = BuildSweep(FLAGS.out, FLAGS.seed, FLAGS.num, knapsack_params,
+                          sweep_lib.LoadSweep(FLAGS.sweep_file),
+                          FLAGS.mps_buffer_size, FLAGS.jobs, FLAGS.formulation,
+                          FLAGS.sampler, FLAGS.output_formats, FLAGS.cache_dir,
+                          FLAGS.cache_max_bytes, FLAGS.stats_file, compression,
+                          solve_options, FLAGS.skip_existing,
+                          FLAGS.write_index, FLAGS.max_sampling_attempts)
+    if failures:
+      raise RuntimeError('Failed to build %d models: %s' %
+                         (len(failures), failures))
+    return
+  failures = BuildRandomizedModels(FLAGS.out, FLAGS.seed, FLAGS.num,
+                                   knapsack_params, FLAGS.mps_buffer_size,
+                                   FLAGS.jobs, FLAGS.formulation,
+                                   FLAGS.sampler, FLAGS.output_formats,
+                                   FLAGS.cache_dir, FLAGS.cache_max_bytes,
+                                   FLAGS.stats_file,
+                                   compression, solve_options,
+                                   FLAGS.skip_existing, FLAGS.write_index,
+                                   FLAGS.shard_max_bytes,
+                                   FLAGS.max_sampling_attempts)
+  if failures:
+    raise RuntimeError('Failed to build %d of %d models: %s' %
+                       (len(failures), FLAGS.num, failures))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,417 @@
+import json
+import os
+import random
+import sys
+from unittest import mock
+
+import numpy as np
+
+from absl.testing import absltest
+
+from google.protobuf import text_format
+from ortools.linear_solver import linear_solver_pb2
+from ortools.linear_solver import pywraplp
+
+import knapsack
+import params_pb2
+
+from common import mip_arrays
+from common import rng as rng_lib
+
+_PARAMS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'params.text_pb2')
+
+# Groups of items with several copies, and a varying number of bins.
+_VARIED_PARAMS = '''
+  b_min: 3
+  b_max: 7
+  f_min: [1.5, 2.0]
+  f_max: [2.5, 3.0]
+  item_param {
+    i_min: 5
+    i_max: 20
+    c_min: 1
+    c_max: 3
+    d_min: [0.0, 0.1]
+    d_max: [0.2, 0.3]
+  }
+  item_param {
+    i_min: 0
+    i_max: 2
+    c_min: 2
+    c_max: 2
+    d_min: [0.5, 0.5]
+    d_max: [1.0, 1.0]
+  }
+'''
+
+
+def _LegacyGenerateKnapsack(params: params_pb2.KnapsackParameters,
+                            rng: random.Random) -> params_pb2.Knapsack:
+  '''The sampler of earlier versions, drawing from rng.'''
+  result = params_pb2.Knapsack()
+  result.r = len(params.f_min)
+  for item_param in params.item_param:
+    num_items = rng.randint(item_param.i_min, item_param.i_max)
+    for _ in range(num_items):
+      item = result.item.add()
+      item.c = rng.randint(item_param.c_min, item_param.c_max)
+      item.d.extend([rng.uniform(item_param.d_min[r], item_param.d_max[r])
+                     for r in range(result.r)])
+  b = rng.randint(params.b_min, params.b_max)
+  t = [sum(item.d[r] for item in result.item) for r in range(result.r)]
+  f = [rng.uniform(params.f_min[r], params.f_max[r]) for r in range(result.r)]
+  for _ in range(b):
+    result.bin.add().s.extend([f[r] * t[r] / b for r in range(result.r)])
+  return result
+
+
+def _LegacyBuildMipForKnapsack(
+    k: params_pb2.Knapsack) -> linear_solver_pb2.MPModelProto:
+  '''The model of earlier versions, built one field at a time.'''
+  model_proto = linear_solver_pb2.MPModelProto()
+  num_items = len(k.item)
+  num_bins = len(k.bin)
+  num_resources = k.r
+
+  place_vars = [[None] * num_bins for _ in range(num_items)]
+  for i in range(num_items):
+    for b in range(num_bins):
+      place_vars[i][b] = len(model_proto.variable)
+      var_proto = model_proto.variable.add()
+      var_proto.name = 'place_%d_%d' % (i, b)
+      var_proto.is_integer = True
+      var_proto.lower_bound = 0.0
+      var_proto.upper_bound = 1.0
+
+  for i in range(num_items):
+    ct_proto = model_proto.constraint.add()
+    ct_proto.name = 'copies_ct_%d' % i
+    ct_proto.lower_bound = k.item[i].c
+    ct_proto.upper_bound = k.item[i].c
+    for b in range(num_bins):
+      ct_proto.var_index.append(place_vars[i][b])
+      ct_proto.coefficient.append(1.0)
+
+  for b in range(num_bins):
+    for r in range(num_resources):
+      ct_proto = model_proto.constraint.add()
+      ct_proto.name = 'supply_ct_%d_%d' % (b, r)
+      ct_proto.upper_bound = k.bin[b].s[r]
+      for i in range(num_items):
+        ct_proto.var_index.append(place_vars[i][b])
+        ct_proto.coefficient.append(k.item[i].d[r])
+
+  deficit_vars = [[None] * num_resources for _ in range(num_bins)]
+  for b in range(num_bins):
+    for r in range(num_resources):
+      deficit_vars[b][r] = len(model_proto.variable)
+      var_proto = model_proto.variable.add()
+      var_proto.name = 'deficit_%d_%d' % (b, r)
+      var_proto.is_integer = False
+      var_proto.lower_bound = 0.0
+      var_proto.upper_bound = 1.0
+      var_proto.objective_coefficient = 1.0
+
+  for r in range(num_resources):
+    t = sum(item.d[r] for item in k.item)
+    for b in range(num_bins):
+      ct_proto = model_proto.constraint.add()
+      ct_proto.name = 'deficit_ct_%d_%d' % (b, r)
+      ct_proto.lower_bound = 1.0
+      ct_proto.var_index.append(deficit_vars[b][r])
+      ct_proto.coefficient.append(1.0)
+      for i in range(num_items):
+        ct_proto.var_index.append(place_vars[i][b])
+        ct_proto.coefficient.append(k.item[i].d[r] * num_bins / t)
+
+  max_deficit_vars = [None] * num_resources
+  for r in range(num_resources):
+    max_deficit_vars[r] = len(model_proto.variable)
+    var_proto = model_proto.variable.add()
+    var_proto.name = 'max_deficit_%d' % r
+    var_proto.is_integer = False
+    var_proto.lower_bound = 0.0
+    var_proto.upper_bound = 1.0
+    var_proto.objective_coefficient = 10.0 * num_bins * num_resources
+
+  for b in range(num_bins):
+    for r in range(num_resources):
+      ct_proto = model_proto.constraint.add()
+      ct_proto.name = 'max_deficit_ct_%d_%d' % (b, r)
+      ct_proto.lower_bound = 0.0
+      ct_proto.var_index.append(max_deficit_vars[r])
+      ct_proto.coefficient.append(1.0)
+      ct_proto.var_index.append(deficit_vars[b][r])
+      ct_proto.coefficient.append(-1.0)
+
+  return model_proto
+
+
+class KnapsackTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.params = []
+    for text in (open(_PARAMS_FILE).read(), _VARIED_PARAMS):
+      params = params_pb2.KnapsackParameters()
+      text_format.Merge(text, params)
+      self.params.append(params)
+
+  def testLegacySamplerIsUnchanged(self):
+    for params in self.params:
+      for seed in range(5):
+        for index in (0, 3):
+          self.assertEqual(
+              knapsack.GenerateKnapsack(params, seed, index=index),
+              _LegacyGenerateKnapsack(params, random.Random(seed + index)))
+
+  def testModelIsUnchanged(self):
+    for params in self.params:
+      for seed in range(5):
+        k = knapsack.GenerateKnapsack(params, seed)
+        expected = _LegacyBuildMipForKnapsack(k)
+        model_proto = mip_arrays.MipArraysToMPModelProto(
+            knapsack.BuildMipArraysForKnapsack(k))
+        self.assertEqual(model_proto, expected)
+        self.assertEqual(model_proto.SerializeToString(),
+                         expected.SerializeToString())
+        self.assertEqual(
+            mip_arrays.MipArraysToBytes(knapsack.BuildMipArraysForKnapsack(k)),
+            expected.SerializeToString())
+
+  def testKnapsackArraysRoundTrip(self):
+    for params in self.params:
+      k = knapsack.GenerateKnapsack(params, 7, sampler='fast')
+      self.assertEqual(
+          knapsack.KnapsackArraysToProto(knapsack.KnapsackToArrays(k)), k)
+
+  def testFastSamplerIsReproducible(self):
+    for params in self.params:
+      self.assertEqual(
+          knapsack.GenerateKnapsack(params, 1, sampler='fast', index=4),
+          knapsack.GenerateKnapsack(params, 1, sampler='fast', index=4))
+      self.assertNotEqual(
+          knapsack.GenerateKnapsack(params, 1, sampler='fast', index=4),
+          knapsack.GenerateKnapsack(params, 1, sampler='fast', index=5))
+
+  def testSampleFromGenerator(self):
+    params = self.params[1]
+    for sampler in ('legacy', 'fast'):
+      first = knapsack.GenerateKnapsack(params, 0, sampler,
+                                        rng=np.random.default_rng(4))
+      self.assertEqual(
+          knapsack.GenerateKnapsack(params, 0, sampler,
+                                    rng=np.random.default_rng(4)), first)
+      self.assertNotEqual(
+          knapsack.GenerateKnapsack(params, 0, sampler,
+                                    rng=np.random.default_rng(5)), first)
+    # The fast streams of a dataset instance are those of its generator.
+    self.assertEqual(
+        knapsack.GenerateKnapsack(params, 0, 'fast',
+                                  rng=rng_lib.InstanceGenerator(3, 2)),
+        knapsack.GenerateKnapsack(params, 3, 'fast', index=2))
+
+  def testNegativeSeeds(self):
+    for sampler in ('legacy', 'fast'):
+      self.assertNotEqual(
+          knapsack.GenerateKnapsack(self.params[1], -3, sampler, index=1),
+          knapsack.GenerateKnapsack(self.params[1], 3, sampler, index=1))
+
+  def testJobsWriteTheSameFiles(self):
+    # Both runs write to the same paths, which the index lists.
+    directory = self.create_tempdir().full_path
+    contents = []
+    for jobs in (1, 3):
+      # The parameters are pickled by the name of their module, which another
+      # generator's tests may have replaced (see conftest.py).
+      with mock.patch.dict(sys.modules, params_pb2=params_pb2):
+        self.assertEqual(
+            knapsack.BuildRandomizedModels(
+                os.path.join(directory, 'kn'), 0, 7, self.params[1],
+                jobs=jobs, output_formats=['mps', 'pb']), [])
+      files = {}
+      for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        with open(path, 'rb') as f:
+          files[name] = f.read()
+        os.remove(path)
+      contents.append(files)
+    self.assertContainsSubset(
+        ['kn_%d.%s' % (i, ext) for i in range(7) for ext in ('mps.gz', 'pb')]
+        + ['kn_index.csv'], contents[0])
+    self.assertEqual(sorted(contents[1]), sorted(contents[0]))
+    for name, data in contents[0].items():
+      self.assertEqual(contents[1][name], data, name)
+
+  def testIterInstancesInOrder(self):
+    params = self.params[1]
+    for jobs in (0, 3):
+      with mock.patch.dict(sys.modules, params_pb2=params_pb2):
+        instances = list(knapsack.IterInstances(params, 2, 6, jobs=jobs,
+                                                sampler='fast'))
+      self.assertEqual([metadata['name'] for _, _, metadata in instances],
+                       ['Knapsack_%d' % i for i in range(6)])
+      for index, (k, model_proto, _) in enumerate(instances):
+        self.assertEqual(k, knapsack.GenerateKnapsack(params, 2, 'fast',
+                                                      index=index))
+        self.assertEqual(model_proto.name, 'Knapsack_%d' % index)
+
+
+def _Arrays(copies, demand, supply) -> knapsack.KnapsackArrays:
+  return knapsack.KnapsackArrays(
+      copies=np.array(copies, dtype=np.int64),
+      demand=np.array(demand, dtype=np.float64),
+      supply=np.array(supply, dtype=np.float64))
+
+
+# Supplies close to the total demand of the copies (1.5 per item on
+# average), so that about half of the knapsacks are rejected.
+_TIGHT_PARAMS = '''
+  b_min: 2
+  b_max: 4
+  f_min: [1.3]
+  f_max: [2.0]
+  item_param {
+    i_min: 4
+    i_max: 8
+    c_min: 1
+    c_max: 2
+    d_min: [0.1]
+    d_max: [1.0]
+  }
+'''
+
+
+class FeasibilityTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.params = params_pb2.KnapsackParameters()
+    text_format.Merge(_TIGHT_PARAMS, self.params)
+
+  def testRejectionReasons(self):
+    # 2 + 2 > 1 + 1.
+    self.assertEqual(knapsack.KnapsackInfeasibility(
+        _Arrays([1, 1], [[2.0], [2.0]], [[1.0], [1.0]])), 'capacity')
+    # Each resource alone has the capacity, but no bin fits both demands.
+    self.assertEqual(knapsack.KnapsackInfeasibility(
+        _Arrays([1], [[2.0, 2.0]], [[3.0, 1.0], [1.0, 3.0]])), 'item_fit')
+    # The 2 copies need 2 bins where the item fits, there is one.
+    self.assertEqual(knapsack.KnapsackInfeasibility(
+        _Arrays([2], [[3.0]], [[3.0], [2.0], [2.0]])), 'item_fit')
+    # Every item fits, but 3 items of 2 do not go in 2 bins of 3.
+    self.assertEqual(knapsack.KnapsackInfeasibility(
+        _Arrays([1, 1, 1], [[2.0], [2.0], [2.0]], [[3.0], [3.0]])),
+                     'first_fit_decreasing')
+    self.assertIsNone(knapsack.KnapsackInfeasibility(
+        _Arrays([2, 1, 0], [[1.0, 2.0], [2.0, 1.0], [9.0, 9.0]],
+                [[3.0, 3.0], [3.0, 3.0]])))
+
+  def testSampleFeasibleKnapsack(self):
+    num_rejected = 0
+    for sampler in ('legacy', 'fast'):
+      for index in range(10):
+        knapsack_arrays, rejections = knapsack.SampleFeasibleKnapsack(
+            self.params, 0, sampler, index, max_attempts=20)
+        self.assertIsNone(knapsack.KnapsackInfeasibility(knapsack_arrays))
+        again, again_rejections = knapsack.SampleFeasibleKnapsack(
+            self.params, 0, sampler, index, max_attempts=20)
+        self.assertEqual(again_rejections, rejections)
+        for a, b in zip(again, knapsack_arrays):
+          np.testing.assert_array_equal(a, b)
+        # The accepted sample is the attempt after the rejected ones, drawn
+        # from its own streams.
+        expected = knapsack._SampleKnapsack(self.params, 0, sampler, index,
+                                            len(rejections))
+        for a, b in zip(expected, knapsack_arrays):
+          np.testing.assert_array_equal(a, b)
+        if not rejections:
+          np.testing.assert_array_equal(
+              knapsack.SampleKnapsack(self.params, 0, sampler,
+                                      index).supply,
+              knapsack_arrays.supply)
+        num_rejected += len(rejections)
+    self.assertGreater(num_rejected, 0)
+
+  def testNoFeasibleSample(self):
+    self.params.f_max[:] = [0.5]
+    self.params.f_min[:] = [0.5]
+    with self.assertRaisesRegex(ValueError, 'rejected for capacity'):
+      knapsack.SampleFeasibleKnapsack(self.params, 0, 'fast', max_attempts=3)
+
+  def testRejectedSamplesAreCounted(self):
+    output = os.path.join(self.create_tempdir().full_path, 'kn')
+    stats_file = output + '_stats.jsonl'
+    self.assertEqual(
+        knapsack.BuildRandomizedModels(
+            output, 0, 6, self.params, sampler='fast', output_formats=['pb'],
+            stats_file=stats_file, write_index=False, max_attempts=20), [])
+    with open(stats_file) as f:
+      lines = [json.loads(line) for line in f]
+    records, summary = lines[:-1], lines[-1]['summary']
+    self.assertLen(records, 6)
+    for record in records:
+      index = int(record['output'].rsplit('_', 1)[1])
+      _, rejections = knapsack.SampleFeasibleKnapsack(
+          self.params, 0, 'fast', index, max_attempts=20)
+      self.assertEqual(record['rejected_samples'], len(rejections))
+    self.assertEqual(summary['rejected_samples'],
+                     sum(record['rejected_samples'] for record in records))
+    self.assertGreater(summary['rejected_samples'], 0)
+
+
+def _SolveObjective(model_proto: linear_solver_pb2.MPModelProto) -> float:
+  '''Solves model_proto to optimality with SCIP, returns the objective.'''
+  solver = pywraplp.Solver.CreateSolver('SCIP')
+  assert not solver.LoadModelFromProto(model_proto)
+  assert solver.Solve() == pywraplp.Solver.OPTIMAL
+  return solver.Objective().Value()
+
+
+class SharedLoadTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.params = params_pb2.KnapsackParameters()
+    text_format.Merge(_TIGHT_PARAMS, self.params)
+
+  def testSameOptimumAsDirect(self):
+    for index in range(4):
+      knapsack_arrays, _ = knapsack.SampleFeasibleKnapsack(
+          self.params, 0, 'fast', index, max_attempts=20)
+      direct = knapsack.BuildMipArraysForKnapsackArrays(knapsack_arrays)
+      shared_load = knapsack.BuildMipArraysForKnapsackArrays(
+          knapsack_arrays, 'shared_load')
+      self.assertAlmostEqual(
+          _SolveObjective(mip_arrays.MipArraysToMPModelProto(shared_load)),
+          _SolveObjective(mip_arrays.MipArraysToMPModelProto(direct)),
+          places=6)
+
+  def testLoadVariablesAndRows(self):
+    knapsack_arrays, _ = knapsack.SampleFeasibleKnapsack(
+        self.params, 0, 'fast', max_attempts=20)
+    num_items, num_resources = knapsack_arrays.demand.shape
+    num_bins = len(knapsack_arrays.supply)
+    direct = knapsack.BuildMipArraysForKnapsackArrays(knapsack_arrays)
+    shared_load = knapsack.BuildMipArraysForKnapsackArrays(
+        knapsack_arrays, 'shared_load')
+    num_loads = num_bins * num_resources
+    self.assertEqual(
+        [name for name in shared_load.var_name if name.startswith('load_')],
+        mip_arrays.GridNames('load', num_bins, num_resources))
+    self.assertEqual(
+        [name for name in shared_load.con_name if name.startswith('load_ct')],
+        mip_arrays.GridNames('load_ct', num_bins, num_resources))
+    self.assertLen(shared_load.var_name, len(direct.var_name) + num_loads)
+    self.assertLen(shared_load.con_name, len(direct.con_name) + num_loads)
+    # Each load(b, r) replaces the num_items place terms of the supply and
+    # deficit rows of (b, r): the items are written once per bin and resource
+    # instead of twice.
+    self.assertEqual(
+        len(direct.coefficient) - len(shared_load.coefficient),
+        num_loads * (2 * num_items - (1 + num_items) - 2))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -1,14 +1,34 @@
+import collections
+import functools
 import logging
+import os
 import random
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import params_pb2
-import gzip
+
+import numpy as np
 
 from absl import app
 from absl import flags
 
 from google.protobuf import text_format
 from ortools.linear_solver import linear_solver_pb2
-from ortools.linear_solver import pywraplp
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from common import cache as cache_lib
+from common import compression as compression_lib
+from common import dataset_index
+from common import instrumentation
+from common import mip_arrays
+from common import mps_writer
+from common import output as output_lib
+from common import parallel
+from common import rng as rng_lib
+from common import shards
+from common import solve as solve_lib
+from common import sweep as sweep_lib
 
 FLAGS = flags.FLAGS
 
@@ -27,9 +47,140 @@ flags.DEFINE_integer('seed', 0, 'Random seed to use during generation.')
 
 flags.DEFINE_integer('num', 1, 'How many models to generate.')
 
+flags.DEFINE_integer(
+    'mps_buffer_size', mps_writer.DEFAULT_BUFFER_SIZE,
+    'How many characters of MPS text to buffer before writing them to the '
+    'output file.')
+
+flags.DEFINE_integer(
+    'jobs', 1, 'How many processes to generate the models with. Each model '
+    'is identical to the one generated with --jobs=1.')
+
+flags.DEFINE_list(
+    'output_formats', ['mps'],
+    'Comma-separated formats to write each model in: mps (MPS text, '
+    'compressed as set by --compression, for solvers), pb (serialized '
+    'MPModelProto) and npz (columnar arrays '
+    'that common/npz_format.LoadNpz memory-maps without parsing).')
+
+flags.DEFINE_enum(
+    'compression', 'gzip', sorted(compression_lib.SUFFIXES),
+    'How to compress MPS files: gzip; pgzip, gzip deflated by blocks on '
+    '--compression_threads threads, readable by gunzip; zstd, which requires '
+    'the zstandard package and writes .mps.zst files; or none, which writes '
+    '.mps files.')
+
+flags.DEFINE_integer(
+    'compression_level', None,
+    'Compression level of --compression. Defaults to 9 for gzip and pgzip, '
+    '3 for zstd.')
+
+flags.DEFINE_integer(
+    'compression_threads', 1,
+    'How many threads pgzip and zstd compress each file with, 0 for one per '
+    'CPU. With --jobs, the processes already use the CPUs.')
+
+flags.DEFINE_string(
+    'solver', '',
+    'If set, OR-Tools solver (e.g. SCIP, CBC, HIGHS) to solve each model '
+    'with once built, in process and without going through a file. The '
+    'results go to the --stats_file records. --output_formats may then be '
+    'empty, to write no file at all.')
+
+flags.DEFINE_float(
+    'solve_time_limit', 0.0,
+    'Time limit of each --solver solve in seconds, 0 for none.')
+
+flags.DEFINE_string(
+    'solver_parameters', '',
+    'Parameters of --solver, in its own text format.')
+
+flags.DEFINE_integer(
+    'solver_threads', 1,
+    'How many threads each --solver solve may use, 0 for the solver '
+    'default.')
+
+flags.DEFINE_string(
+    'sweep_file', '',
+    'If set, JSON file of a sweep of overrides of the parameters, see '
+    'common/sweep.py. Each of its points generates the --num models of --seed '
+    'on top of --params_file and --params, written to <out>_p<point>_<i>. '
+    'Progress is recorded in <out>_manifest.jsonl, from which a rerun only '
+    'builds the models missing or failed.')
+
+flags.DEFINE_bool(
+    'skip_existing', False,
+    'Skip the models whose files all exist and match their .sha256 checksum '
+    'files, e.g. to restart a preempted run cheaply. Models with missing, '
+    'partial or corrupt files are built again.')
+
+flags.DEFINE_integer(
+    'shard_max_bytes', 0,
+    'If positive, pack the files of the models into shard files of about '
+    'this many bytes, <out>-<k>.shard with an offset index, instead of '
+    'writing one file per model and format; see common/shards.py. Files '
+    'are extracted with extract_instances.py.')
+
+flags.DEFINE_bool(
+    'write_index', True,
+    'Write the statistics of the models (sizes by block, coefficient ranges, '
+    'degree histograms, numbers of workers and workloads, ...) to the '
+    'columnar index <out>_index.csv and <out>_index.npz, see '
+    'common/dataset_index.py.')
+
+flags.DEFINE_string(
+    'stats_file', '',
+    'If set, file to write generation statistics to, as JSON lines: one per '
+    'instance (time per stage, peak RSS, model size, bytes written) and a '
+    'final {"summary": ...} line with the throughput of the run.')
+
+flags.DEFINE_string(
+    'cache_dir', '',
+    'If set, directory of a cache of generated instances. Instances whose '
+    'params, seed, options and generator code match a cached one are linked '
+    'from the cache instead of being generated.')
+
+flags.DEFINE_integer(
+    'cache_max_bytes', cache_lib.DEFAULT_MAX_BYTES,
+    'Size of the --cache_dir cache above which least recently used instances '
+    'are evicted at the end of a run.')
+
+flags.DEFINE_bool(
+    'sparse', False,
+    'Only create the reserved capacity variables and worker_used constraints '
+    'of allowed (workload, worker) pairs, with the tight big-M '
+    'worker.capacity. The model is equivalent to the default one.')
+
+flags.DEFINE_enum(
+    'sampler', 'legacy', ['legacy', 'fast'],
+    'How to sample problems. legacy draws from the random module and '
+    'reproduces the instances of earlier versions for the same seed. fast '
+    'draws from NumPy Generators with independent streams for every instance '
+    'and sampling stage (see common/rng.py), sampling the allowed workers of '
+    'each worker group in bulk; its instances follow the same distribution '
+    'but differ from the legacy ones.')
+
+flags.DEFINE_bool(
+    'compact_failures', False,
+    'Write the failure constraints of each workload with a variable holding '
+    'its total reserved capacity, so that each failure row has 2 non-zeros '
+    'instead of k - 1 for k allowed workers. The model is equivalent to the '
+    'default one.')
+
+flags.DEFINE_integer(
+    'max_sampling_attempts', 0,
+    'If positive, check that each workload has at least 2 allowed workers '
+    'whose capacity covers its load without the largest of them, and '
+    'resample the workloads that fail, from their own random streams, up to '
+    'this many samples in total. Those still failing are allowed the fewest '
+    'additional workers, largest capacity first, that cover them. Workloads '
+    'that pass the first time are unchanged. The resampled and repaired '
+    'workloads are logged and counted in the statistics.')
+
 
 def BuildMipForLoadBalancing(
-    problem: params_pb2.LoadBalancingProblem) -> linear_solver_pb2.MPModelProto:
+    problem: params_pb2.LoadBalancingProblem,
+    compact_failures: bool = False) -> linear_solver_pb2.MPModelProto:
   model_proto = linear_solver_pb2.MPModelProto()
 
   num_workloads = len(problem.workload)
@@ -89,6 +240,9 @@ def BuildMipForLoadBalancing(
   # There must be sufficient capacity for each workload in the scenario where
   # any one of the allowed workers is unavailable.
   # For s, t: sum_{t' != t} reserved_capacity_vars[s][t'] >= workload[s].load
+  if compact_failures:
+    _AddCompactFailureConstraints(problem, reserved_capacity_vars, model_proto)
+    return model_proto
   for s in range(num_workloads):
     allowed_workers = sorted(set(problem.workload[s].allowed_workers))
     assert len(allowed_workers) > 1
@@ -105,68 +259,901 @@ def BuildMipForLoadBalancing(
   return model_proto
 
 
-def GenerateLoadBalancingProblem(
-    params: params_pb2.LoadBalancingParameters,
-    random_seed: int) -> params_pb2.LoadBalancingProblem:
-  random.seed(random_seed)
+def _AddCompactFailureConstraints(problem: params_pb2.LoadBalancingProblem,
+                                  reserved_capacity_vars: List[List[int]],
+                                  model_proto: linear_solver_pb2.MPModelProto):
+  # Equivalent form of the failure constraints with O(k) instead of O(k^2)
+  # non-zeros for a workload with k allowed workers:
+  # For s: total_reserved_capacity_vars[s] =
+  #          sum_{t allowed} reserved_capacity_vars[s][t]
+  # For s, allowed t:
+  #   total_reserved_capacity_vars[s] - reserved_capacity_vars[s][t]
+  #     >= workload[s].load
+  for s in range(len(problem.workload)):
+    allowed_workers = sorted(set(problem.workload[s].allowed_workers))
+    assert len(allowed_workers) > 1
+    total_var = len(model_proto.variable)
+    var_proto = model_proto.variable.add()
+    var_proto.name = f'total_reserved_capacity_{s}'
+    var_proto.lower_bound = 0.0
+    var_proto.upper_bound = float('inf')
+
+    ct_proto = model_proto.constraint.add()
+    ct_proto.name = f'total_reserved_capacity_ct_{s}'
+    ct_proto.lower_bound = 0
+    ct_proto.upper_bound = 0
+    ct_proto.var_index.append(total_var)
+    ct_proto.coefficient.append(1)
+    for t in allowed_workers:
+      ct_proto.var_index.append(reserved_capacity_vars[s][t])
+      ct_proto.coefficient.append(-1)
+
+    for unavailable_t in allowed_workers:
+      ct_proto = model_proto.constraint.add()
+      ct_proto.name = f'workload_ct_{s}_failure_{unavailable_t}'
+      ct_proto.lower_bound = problem.workload[s].load
+      ct_proto.var_index.append(total_var)
+      ct_proto.coefficient.append(1)
+      ct_proto.var_index.append(reserved_capacity_vars[s][unavailable_t])
+      ct_proto.coefficient.append(-1)
+
+
+def DenseModelBlocks(
+    problem: params_pb2.LoadBalancingProblem, compact_failures: bool = False
+) -> Tuple[dataset_index.Blocks, dataset_index.Blocks]:
+  '''The blocks of the variables and constraints of BuildMipForLoadBalancing.
+
+  Computed from the sizes of the problem rather than the names of the model,
+  whose failure rows are interleaved by workload with compact_failures.
+  '''
+  num_workloads = len(problem.workload)
+  num_workers = len(problem.worker)
+  num_allowed = np.diff(LoadBalancingToArrays(problem).allowed_start)
+  var_names = ['reserved_capacity', 'worker_used', 'total_reserved_capacity']
+  var_sizes = [num_workloads * num_workers, num_workers,
+               num_workloads if compact_failures else 0]
+  var_blocks = np.repeat(np.arange(len(var_names)), var_sizes)
+  con_names = ['worker_used_ct', 'worker_capacity_ct', 'workload_ct_failure',
+               'total_reserved_capacity_ct']
+  failure_blocks = np.full(int(num_allowed.sum()), 2)
+  if compact_failures:
+    # Each workload has its total row, then its failure rows.
+    failure_blocks = np.insert(failure_blocks,
+                               np.cumsum(num_allowed) - num_allowed, 3)
+  con_blocks = np.concatenate([
+      np.zeros(num_workloads * num_workers, dtype=np.int64),
+      np.ones(num_workers, dtype=np.int64), failure_blocks
+  ])
+  return (var_names, var_blocks), (con_names, con_blocks)
+
+
+LoadBalancingArrays = collections.namedtuple(
+    'LoadBalancingArrays',
+    ['load', 'capacity', 'cost', 'allowed_start', 'allowed_worker'])
+
+
+def LoadBalancingToArrays(
+    problem: params_pb2.LoadBalancingProblem) -> LoadBalancingArrays:
+  # load[s] = workload(s).load
+  # capacity[t] = worker(t).capacity, cost[t] = worker(t).cost
+  # The allowed workers of workload s, sorted and without duplicates, are
+  # allowed_worker[allowed_start[s]:allowed_start[s + 1]].
+  num_workloads = len(problem.workload)
+  num_workers = len(problem.worker)
+  load = np.fromiter((w.load for w in problem.workload), dtype=np.float64,
+                     count=num_workloads)
+  capacity = np.fromiter((w.capacity for w in problem.worker),
+                         dtype=np.float64, count=num_workers)
+  cost = np.fromiter((w.cost for w in problem.worker), dtype=np.float64,
+                     count=num_workers)
+  allowed = [np.unique(np.asarray(w.allowed_workers, dtype=np.int64))
+             for w in problem.workload]
+  allowed_start = np.zeros(num_workloads + 1, dtype=np.int64)
+  np.cumsum([len(a) for a in allowed], out=allowed_start[1:])
+  allowed_worker = (np.concatenate(allowed) if allowed else
+                    np.zeros(0, dtype=np.int64))
+  return LoadBalancingArrays(load=load, capacity=capacity, cost=cost,
+                             allowed_start=allowed_start,
+                             allowed_worker=allowed_worker)
+
+
+def LoadBalancingStatistics(
+    problem: params_pb2.LoadBalancingProblem) -> Dict[str, int]:
+  num_allowed = np.fromiter((len(w.allowed_workers) for w in problem.workload),
+                            dtype=np.int64, count=len(problem.workload))
+  return {
+      'num_workers': len(problem.worker),
+      'num_workloads': len(problem.workload),
+      'num_allowed_pairs': int(num_allowed.sum()),
+      'allowed_workers_min': int(num_allowed.min()) if num_allowed.size else 0,
+      'allowed_workers_max': int(num_allowed.max()) if num_allowed.size else 0,
+  }
+
+
+def _ModelStatistics(model_arrays: mip_arrays.MipArrays,
+                     problem: params_pb2.LoadBalancingProblem, sparse: bool,
+                     compact_failures: bool) -> Dict[str, Any]:
+  if sparse:
+    # The builder lays out each block contiguously.
+    return dataset_index.ModelStatistics(model_arrays)
+  var_blocks, con_blocks = DenseModelBlocks(problem, compact_failures)
+  return dataset_index.ModelStatistics(model_arrays, var_blocks=var_blocks,
+                                       con_blocks=con_blocks)
+
+
+def BuildSparseMipArraysForLoadBalancing(
+    problem: params_pb2.LoadBalancingProblem,
+    compact_failures: bool = False) -> mip_arrays.MipArrays:
+  # Same model as BuildMipForLoadBalancing, without the variables and
+  # constraints of pairs (s, t) where t is not allowed for s (those variables
+  # are fixed to 0). The pairs are the entries of the allowed workers CSR.
+  load, capacity, cost, allowed_start, allowed_worker = LoadBalancingToArrays(
+      problem)
+  num_workloads = len(load)
+  num_workers = len(capacity)
+  num_allowed = np.diff(allowed_start)
+  assert np.all(num_allowed > 1)
+  pair_workload = np.repeat(np.arange(num_workloads), num_allowed)
+  pair_names = [
+      '%d_%d' % (s, t)
+      for s, t in zip(pair_workload.tolist(), allowed_worker.tolist())
+  ]
+  builder = mip_arrays.MipArraysBuilder()
+
+  # reserved_capacity_vars[p] contains the index of a continuous variable
+  # denoting the capacity reserved on worker allowed_worker[p] for handling
+  # workload pair_workload[p].
+  reserved_capacity_vars = builder.AddVariables(
+      ['reserved_capacity_' + n for n in pair_names],
+      lower_bound=0.0, upper_bound=capacity[allowed_worker])
+
+  # worker_used_vars[t] contains the index of a binary variable denoting whether
+  # worker t is used in the solution.
+  worker_used_vars = builder.AddVariables(
+      mip_arrays.GridNames('worker_used', num_workers),
+      lower_bound=0.0, upper_bound=1.0, objective=cost, is_integer=True)
+
+  # Capacity can be reserved only if a node is used.
+  # For allowed s, t: reserved_capacity_vars[s][t] <= M * worker_used_vars[t]
+  # where M = worker[t].capacity, the upper bound of reserved_capacity_vars[s][t].
+  builder.AddConstraints(
+      ['worker_used_ct_' + n for n in pair_names],
+      lower_bound=0.0, upper_bound=np.inf,
+      col_index=np.stack(
+          [reserved_capacity_vars, worker_used_vars[allowed_worker]], axis=1),
+      coefficient=np.stack(
+          [np.full(len(allowed_worker), -1.0), capacity[allowed_worker]],
+          axis=1))
+
+  # Cannot reserve more capacity than available.
+  # For t: sum_{s allowed} reserved_capacity_vars[s][t] <= worker[t].capacity
+  # Workers allowed for no workload get no constraint.
+  by_worker = np.argsort(allowed_worker, kind='stable')
+  num_workloads_per_worker = np.bincount(allowed_worker,
+                                         minlength=num_workers)
+  used_workers = np.flatnonzero(num_workloads_per_worker)
+  builder.AddConstraints(
+      ['worker_capacity_ct_%d' % t for t in used_workers.tolist()],
+      lower_bound=-np.inf, upper_bound=capacity[used_workers],
+      col_index=reserved_capacity_vars[by_worker], coefficient=1.0,
+      row_length=num_workloads_per_worker[used_workers])
+
+  # There must be sufficient capacity for each workload in the scenario where
+  # any one of the allowed workers is unavailable.
+  # For s, allowed t: sum_{allowed t' != t} reserved_capacity_vars[s][t']
+  #                     >= workload[s].load
+  failure_names = [
+      'workload_ct_%d_failure_%d' % (s, t)
+      for s, t in zip(pair_workload.tolist(), allowed_worker.tolist())
+  ]
+  if compact_failures:
+    # Same as _AddCompactFailureConstraints.
+    total_reserved_capacity_vars = builder.AddVariables(
+        mip_arrays.GridNames('total_reserved_capacity', num_workloads),
+        lower_bound=0.0, upper_bound=np.inf)
+    # Each row lists the total first, then the pairs of the workload.
+    total_cols = np.insert(reserved_capacity_vars, allowed_start[:-1],
+                           total_reserved_capacity_vars)
+    total_coefs = np.full(len(total_cols), -1.0)
+    total_coefs[allowed_start[:-1] + np.arange(num_workloads)] = 1.0
+    builder.AddConstraints(
+        mip_arrays.GridNames('total_reserved_capacity_ct', num_workloads),
+        lower_bound=0.0, upper_bound=0.0, col_index=total_cols,
+        coefficient=total_coefs, row_length=num_allowed + 1)
+    builder.AddConstraints(
+        failure_names, lower_bound=load[pair_workload], upper_bound=np.inf,
+        col_index=np.stack([
+            total_reserved_capacity_vars[pair_workload], reserved_capacity_vars
+        ], axis=1),
+        coefficient=np.array([1.0, -1.0]))
+    return builder.Build()
+  failure_cols = []
+  for s in range(num_workloads):
+    pairs = reserved_capacity_vars[allowed_start[s]:allowed_start[s + 1]]
+    k = len(pairs)
+    failure_cols.append(
+        np.broadcast_to(pairs, (k, k))[~np.eye(k, dtype=bool)])
+  builder.AddConstraints(
+      failure_names, lower_bound=load[pair_workload], upper_bound=np.inf,
+      col_index=(np.concatenate(failure_cols) if failure_cols else
+                 np.zeros(0, dtype=np.int64)),
+      coefficient=1.0, row_length=num_allowed[pair_workload] - 1)
+
+  return builder.Build()
+
+
+# Below this probability, allowed workers are sampled by drawing the
+# geometric gaps between them instead of one uniform number per pair.
+_GEOMETRIC_SAMPLING_PROBABILITY = 0.05
+
+
+def _SampleBernoulliPositions(rng: np.random.Generator, size: int,
+                              probability: float) -> np.ndarray:
+  '''Returns the sorted positions in range(size) of successful trials.'''
+  if probability <= 0.0 or size == 0:
+    return np.zeros(0, dtype=np.int64)
+  if probability >= 1.0:
+    return np.arange(size, dtype=np.int64)
+  if probability >= _GEOMETRIC_SAMPLING_PROBABILITY:
+    return np.flatnonzero(rng.random(size) < probability)
+  # The gap to the next success is geometric. Draw gaps in batches sized
+  # for the expected number of successes until we are past the end.
+  positions = []
+  last = -1
+  while last < size:
+    expected = (size - last) * probability
+    gaps = rng.geometric(probability,
+                         int(expected + 4 * np.sqrt(expected)) + 16)
+    batch = last + np.cumsum(gaps)
+    positions.append(batch)
+    last = int(batch[-1])
+  positions = np.concatenate(positions)
+  return positions[:np.searchsorted(positions, size)]
+
+
+def _SampleAllowedWorkersLegacy(rng: random.Random, probability: np.ndarray,
+                                num_workloads: int,
+                                workload_param: params_pb2.WorkloadParameters,
+                                problem: params_pb2.LoadBalancingProblem):
+  # One rng.random() per (workload, worker) pair, in the same order as the
+  # original double loop, so that instances are reproduced exactly.
+  num_workers = len(probability)
+  for _ in range(num_workloads):
+    workload = problem.workload.add()
+    workload.load = rng.uniform(workload_param.load_min,
+                                workload_param.load_max)
+    draws = np.fromiter((rng.random() for _ in range(num_workers)),
+                        dtype=np.float64, count=num_workers)
+    workload.allowed_workers.extend(
+        np.flatnonzero(draws < probability).tolist())
+
+
+def _SampleWorkloadArrays(
+    rng: np.random.Generator, group_start: np.ndarray, num_workloads: int,
+    workload_param: params_pb2.WorkloadParameters
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  # The allowed workers of the num_workloads workloads form a CSR adjacency:
+  # workload i gets allowed_worker[allowed_start[i]:allowed_start[i + 1]].
+  # Pairs of each worker group are sampled at once, as positions in the
+  # row-major num_workloads x group_size matrix.
+  load = rng.uniform(workload_param.load_min, workload_param.load_max,
+                     num_workloads)
+  rows = []
+  cols = []
+  for group, p in enumerate(workload_param.allowed_worker_probability):
+    group_size = int(group_start[group + 1] - group_start[group])
+    positions = _SampleBernoulliPositions(rng, num_workloads * group_size, p)
+    rows.append(positions // max(1, group_size))
+    cols.append(positions % max(1, group_size) + group_start[group])
+  rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+  cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+  # Groups are contiguous and in order, so a stable sort by workload keeps
+  # each row sorted by worker.
+  order = np.argsort(rows, kind='stable')
+  allowed_start = np.zeros(num_workloads + 1, dtype=np.int64)
+  np.cumsum(np.bincount(rows, minlength=num_workloads), out=allowed_start[1:])
+  return load, allowed_start, cols[order]
+
+
+def _SampleAllowedWorkersFast(rng: np.random.Generator,
+                              group_start: np.ndarray, num_workloads: int,
+                              workload_param: params_pb2.WorkloadParameters,
+                              problem: params_pb2.LoadBalancingProblem):
+  load, allowed_start, allowed_worker = _SampleWorkloadArrays(
+      rng, group_start, num_workloads, workload_param)
+  allowed_worker = allowed_worker.tolist()
+  allowed_start = allowed_start.tolist()
+  for i in range(num_workloads):
+    workload = problem.workload.add()
+    workload.load = load[i]
+    workload.allowed_workers.extend(
+        allowed_worker[allowed_start[i]:allowed_start[i + 1]])
+
+
+def _SampleProblem(
+    params: params_pb2.LoadBalancingParameters, random_seed: int,
+    sampler: str, index: int, rng: Optional[np.random.Generator] = None
+) -> Tuple[params_pb2.LoadBalancingProblem, np.ndarray, np.ndarray]:
+  '''Samples a problem, with the group_start of its worker groups.
+
+  Also returns workload_param_index[s], the index of the WorkloadParameters
+  that workload s was sampled from.
+  '''
+  if sampler == 'legacy':
+    legacy_rng = (random.Random(random_seed + index) if rng is None else
+                  rng_lib.StageRandom(rng, 'legacy'))
+  elif sampler == 'fast':
+    if rng is None:
+      rng = rng_lib.InstanceGenerator(random_seed, index)
+    worker_rng = rng_lib.StageGenerator(rng, 'workers')
+    workload_rng = rng_lib.StageGenerator(rng, 'workloads')
+  else:
+    raise ValueError('Unknown sampler: %s' % sampler)
   problem = params_pb2.LoadBalancingProblem()
 
-  # The index of the WorkerParameters that generated this worker.
-  worker_group = []
+  # Workers of the i-th WorkerParameters have the indices
+  # range(group_start[i], group_start[i + 1]).
+  group_start = [0]
 
-  for (group, worker_param) in enumerate(params.worker_parameter):
-    num_workers = random.randint(worker_param.i_min, worker_param.i_max)
-    for _ in range(num_workers):
-      worker_group.append(group)
+  for worker_param in params.worker_parameter:
+    if sampler == 'legacy':
+      num_workers = legacy_rng.randint(worker_param.i_min, worker_param.i_max)
+      capacity = [
+          legacy_rng.uniform(worker_param.capacity_min,
+                             worker_param.capacity_max)
+          for _ in range(num_workers)
+      ]
+    else:
+      num_workers = int(worker_rng.integers(worker_param.i_min,
+                                            worker_param.i_max, endpoint=True))
+      capacity = worker_rng.uniform(worker_param.capacity_min,
+                                    worker_param.capacity_max,
+                                    num_workers).tolist()
+    group_start.append(group_start[-1] + num_workers)
+    for c in capacity:
       worker = problem.worker.add()
-      worker.capacity = random.uniform(worker_param.capacity_min,
-                                       worker_param.capacity_max)
+      worker.capacity = c
       worker.cost = worker_param.cost
+  group_start = np.array(group_start, dtype=np.int64)
 
+  num_workloads_per_param = []
   for workload_param in params.workload_parameter:
-    num_workloads = random.randint(workload_param.i_min, workload_param.i_max)
     assert len(workload_param.allowed_worker_probability) == len(
         params.worker_parameter)
-    for _ in range(num_workloads):
-      workload = problem.workload.add()
-      workload.load = random.uniform(workload_param.load_min,
-                                     workload_param.load_max)
-      for worker_index in range(len(problem.worker)):
-        if random.random() < workload_param.allowed_worker_probability[
-            worker_group[worker_index]]:
-          workload.allowed_workers.append(worker_index)
+    if sampler == 'legacy':
+      num_workloads = legacy_rng.randint(workload_param.i_min,
+                                         workload_param.i_max)
+      # probability[t] is the probability that worker t is allowed.
+      probability = np.repeat(
+          np.array(workload_param.allowed_worker_probability, dtype=np.float64),
+          np.diff(group_start))
+      _SampleAllowedWorkersLegacy(legacy_rng, probability, num_workloads,
+                                  workload_param, problem)
+    else:
+      num_workloads = int(workload_rng.integers(
+          workload_param.i_min, workload_param.i_max, endpoint=True))
+      _SampleAllowedWorkersFast(workload_rng, group_start, num_workloads,
+                                workload_param, problem)
+    num_workloads_per_param.append(num_workloads)
+
+  workload_param_index = np.repeat(
+      np.arange(len(num_workloads_per_param), dtype=np.int64),
+      np.array(num_workloads_per_param, dtype=np.int64))
+  return problem, group_start, workload_param_index
+
+
+def _NonResilient(load: np.ndarray, capacity: np.ndarray,
+                  allowed_start: np.ndarray,
+                  allowed_worker: np.ndarray) -> np.ndarray:
+  '''Mask of the workloads that ResilienceViolations finds, from a CSR.'''
+  num_allowed = np.diff(allowed_start)
+  # Sums and maxima over the rows with allowed workers. An empty row starts
+  # where the next one does, so the next row's start still ends the previous.
+  nonempty = num_allowed > 0
+  starts = allowed_start[:-1][nonempty]
+  allowed_capacity = capacity[allowed_worker]
+  total = np.zeros(len(load))
+  largest = np.zeros(len(load))
+  if starts.size:
+    total[nonempty] = np.add.reduceat(allowed_capacity, starts)
+    largest[nonempty] = np.maximum.reduceat(allowed_capacity, starts)
+  return (num_allowed < 2) | (total - largest < load)
+
+
+def ResilienceViolations(
+    problem: params_pb2.LoadBalancingProblem) -> np.ndarray:
+  '''Indices of the workloads that cannot survive the loss of a worker.
 
+  Those are the workloads with fewer than 2 allowed workers, which the
+  failure constraints do not support, and those whose allowed workers do not
+  have the capacity to cover their load without the largest of them, which
+  make the model infeasible. The check is necessary, not sufficient: workloads
+  also compete for the capacity of the workers.
+  '''
+  load, capacity, _, allowed_start, allowed_worker = LoadBalancingToArrays(
+      problem)
+  return np.flatnonzero(
+      _NonResilient(load, capacity, allowed_start, allowed_worker))
+
+
+def _RepairWorkload(problem: params_pb2.LoadBalancingProblem, s: int,
+                    capacity: np.ndarray, by_capacity: np.ndarray):
+  '''Allows the fewest workers, largest first, that make workload resilient.'''
+  workload = problem.workload[s]
+  allowed = np.unique(np.asarray(workload.allowed_workers, dtype=np.int64))
+  candidates = by_capacity[~np.isin(by_capacity, allowed)]
+  # After adding the first m candidates, for m = 0, 1, ...: the largest is
+  # either the largest allowed worker or the first candidate.
+  added = np.concatenate([[0.0], np.cumsum(capacity[candidates])])
+  largest = np.full(len(added),
+                    capacity[allowed].max() if allowed.size else 0.0)
+  if candidates.size:
+    largest[1:] = np.maximum(largest[1:], capacity[candidates[0]])
+  num_allowed = len(allowed) + np.arange(len(added))
+  total = capacity[allowed].sum() + added
+  feasible = np.flatnonzero((num_allowed >= 2) &
+                            (total - largest >= workload.load))
+  if not feasible.size:
+    raise ValueError('No set of workers covers the load %g of workload %d '
+                     'after losing one' % (workload.load, s))
+  del workload.allowed_workers[:]
+  workload.allowed_workers.extend(
+      np.sort(np.concatenate([allowed, candidates[:feasible[0]]])).tolist())
+
+
+def SampleResilientProblem(
+    params: params_pb2.LoadBalancingParameters, random_seed: int,
+    sampler: str = 'legacy', index: int = 0,
+    max_attempts: int = 1, rng: Optional[np.random.Generator] = None
+) -> Tuple[params_pb2.LoadBalancingProblem, Dict[str, int]]:
+  '''Samples the index-th problem, fixing its non-resilient workloads.
+
+  The workloads of ResilienceViolations are sampled again, load and allowed
+  workers, up to max_attempts samples in total. The attempt-th resample
+  draws from its own stream (see rng.Generator), whatever the sampler, so
+  the problem is the same whatever the jobs or order of the run, and
+  workloads that pass the first time are those of GenerateLoadBalancingProblem.
+  The workloads still failing are repaired by allowing them the fewest
+  workers, largest capacity first, that make them resilient. Returns the
+  problem with the numbers of resampled and repaired workloads. Raises
+  ValueError only if all the workers together cannot cover a workload.
+  '''
+  problem, group_start, workload_param_index = _SampleProblem(
+      params, random_seed, sampler, index, rng)
+  if rng is None:
+    rng = rng_lib.InstanceGenerator(random_seed, index)
+  capacity = np.fromiter((w.capacity for w in problem.worker),
+                         dtype=np.float64, count=len(problem.worker))
+  counts = {'resampled_workloads': 0, 'repaired_workloads': 0}
+  violations = ResilienceViolations(problem)
+  for attempt in range(1, max_attempts):
+    if not violations.size:
+      break
+    counts['resampled_workloads'] += len(violations)
+    attempt_rng = rng_lib.StageGenerator(rng, 'workloads/attempt_%d' % attempt)
+    failed = []
+    # The workloads of each WorkloadParameters are resampled together.
+    for param in np.unique(workload_param_index[violations]).tolist():
+      workloads = violations[workload_param_index[violations] == param]
+      load, allowed_start, allowed_worker = _SampleWorkloadArrays(
+          attempt_rng, group_start, len(workloads),
+          params.workload_parameter[param])
+      for s, l, start, end in zip(workloads.tolist(), load.tolist(),
+                                  allowed_start[:-1].tolist(),
+                                  allowed_start[1:].tolist()):
+        workload = problem.workload[s]
+        workload.load = l
+        del workload.allowed_workers[:]
+        workload.allowed_workers.extend(allowed_worker[start:end].tolist())
+      failed.append(workloads[_NonResilient(load, capacity, allowed_start,
+                                            allowed_worker)])
+    violations = np.sort(np.concatenate(failed))
+  if violations.size:
+    counts['repaired_workloads'] = len(violations)
+    by_capacity = np.lexsort((np.arange(len(capacity)), -capacity))
+    for s in violations.tolist():
+      _RepairWorkload(problem, s, capacity, by_capacity)
+  return problem, counts
+
+
+def GenerateLoadBalancingProblem(
+    params: params_pb2.LoadBalancingParameters,
+    random_seed: int,
+    sampler: str = 'legacy',
+    index: int = 0,
+    max_attempts: int = 0,
+    rng: Optional[np.random.Generator] = None
+) -> params_pb2.LoadBalancingProblem:
+  '''Samples the index-th problem of a dataset from params.
+
+  With sampler='legacy', draws from a random.Random seeded with
+  random_seed + index and gives the same instances as earlier versions. With
+  sampler='fast', draws the workers and the workloads from the streams of
+  rng.Generator(random_seed, index, stage), sampling the allowed workers of
+  many workloads at once. Both follow the distribution of params, but give
+  different instances for the same seed. Neither uses the global random
+  state. With max_attempts, the workloads that cannot survive the loss of a
+  worker are resampled or repaired, see SampleResilientProblem.
+
+  If rng is given (see rng.InstanceGenerator), the problem is drawn from it
+  instead of random_seed and index: both samplers draw from streams of
+  rng.StageGenerator(rng, stage).
+  '''
+  if max_attempts:
+    return SampleResilientProblem(params, random_seed, sampler, index,
+                                  max_attempts, rng)[0]
+  return _SampleProblem(params, random_seed, sampler, index, rng)[0]
+
+
+def _SampleCounted(params: params_pb2.LoadBalancingParameters,
+                   random_seed: int, sampler: str, index: int,
+                   max_attempts: int, stats: instrumentation.InstanceStats
+                  ) -> params_pb2.LoadBalancingProblem:
+  '''GenerateLoadBalancingProblem, recording the fixed workloads in stats.'''
+  if not max_attempts:
+    return GenerateLoadBalancingProblem(params, random_seed, sampler, index)
+  problem, counts = SampleResilientProblem(params, random_seed, sampler,
+                                           index, max_attempts)
+  stats.counters.update(counts)
+  if counts['resampled_workloads'] or counts['repaired_workloads']:
+    logging.info('Resampled %d and repaired %d non-resilient workloads of '
+                 'instance %d', counts['resampled_workloads'],
+                 counts['repaired_workloads'], index)
   return problem
 
 
-def MPModelProtoToMPS(model_proto: linear_solver_pb2.MPModelProto):
-  nnz = sum(len(c.var_index) for c in model_proto.constraint)
-  logging.info('# vars = %d, # cons = %d, # nz = %d', len(model_proto.variable),
-               len(model_proto.constraint), nnz)
-  model_mps = pywraplp.ExportModelAsMpsFormat(model_proto)
-  return model_mps
+def EstimateModelSize(params: params_pb2.LoadBalancingParameters,
+                      sparse: bool = False,
+                      compact_failures: bool = False) -> int:
+  # Expected number of non-zeros: three per (workload, worker) pair in the
+  # worker_used and worker_capacity rows (allowed pairs only when sparse),
+  # plus k * (k - 1) in the failure rows of a workload with k allowed workers
+  # (3 * k + 1 with compact failure rows).
+  num_workers = [(p.i_min + p.i_max) / 2 for p in params.worker_parameter]
+  nnz = 0
+  for workload_param in params.workload_parameter:
+    num_allowed = sum(
+        n * p for n, p in zip(num_workers,
+                              workload_param.allowed_worker_probability))
+    nnz += ((workload_param.i_min + workload_param.i_max) / 2 *
+            (3 * (num_allowed if sparse else sum(num_workers)) +
+             (3 * num_allowed + 1 if compact_failures else
+              num_allowed * (num_allowed - 1))))
+  return int(nnz)
+
+
+def BuildRandomizedModel(output: str, random_seed: int, index: int,
+                         params: params_pb2.LoadBalancingParameters,
+                         mps_buffer_size: int = mps_writer.DEFAULT_BUFFER_SIZE,
+                         sparse: bool = False,
+                         sampler: str = 'legacy',
+                         compact_failures: bool = False,
+                         output_formats: List[str] = ('mps',),
+                         cache_dir: str = '',
+                         compression: compression_lib.Compression = (
+                             compression_lib.DEFAULT),
+                         solve_options: Optional[solve_lib.SolveOptions] = None,
+                         skip_existing: bool = False,
+                         max_attempts: int = 0) -> Dict[str, Any]:
+  '''Builds one model and returns its generation statistics.
+
+  With solve_options, the model is also solved and the result recorded under
+  'solve' in the statistics. With skip_existing, a model whose files are all
+  complete (see output.VerifyChecksum) is left as is. With max_attempts, the
+  workloads that cannot survive the loss of a worker are resampled or
+  repaired (see SampleResilientProblem), and counted.
+  '''
+  prefix = output + '_%d' % index
+  name = 'LoadBalancing_%d' % index
+  stats = instrumentation.InstanceStats(
+      generator='load_balancing', name=name, seed=random_seed + index,
+      output=prefix, params_hash=dataset_index.ParamsHash(params))
+  suffixes = [output_lib.OutputSuffix(f, compression) for f in output_formats]
+  if skip_existing and suffixes and all(
+      output_lib.VerifyChecksum(prefix + suffix) for suffix in suffixes):
+    logging.info('Skipping model %s, its files are complete', prefix)
+    stats.fields['skipped'] = True
+    stats.counters['output_bytes'] = sum(
+        os.path.getsize(prefix + suffix) for suffix in suffixes)
+    return stats.ToDict()
+  # A cached instance would still have to be built to be solved.
+  instance_cache = (cache_lib.InstanceCache(cache_dir)
+                    if cache_dir and not solve_options else None)
+  if instance_cache:
+    key = cache_lib.InstanceKey(
+        __file__, params, random_seed + index,
+        dict(name=name, sparse=sparse, sampler=sampler,
+             compact_failures=compact_failures,
+             output_formats=sorted(output_formats),
+             compression=compression._asdict(), max_attempts=max_attempts))
+    with stats.Time('cache'):
+      cached = instance_cache.Fetch(key, prefix, suffixes)
+    if cached:
+      logging.info('Linked model %s from the cache', prefix)
+      stats.fields['cached'] = True
+      statistics = instance_cache.Statistics(key)
+      if statistics is not None:
+        stats.fields['statistics'] = statistics
+      stats.counters['output_bytes'] = sum(
+          os.path.getsize(prefix + suffix) for suffix in suffixes)
+      return stats.ToDict()
+  logging.info('Building model %s', prefix)
+  with stats.Time('sample'):
+    problem = _SampleCounted(params, random_seed, sampler, index,
+                             max_attempts, stats)
+  with stats.Time('build'):
+    if sparse:
+      model_arrays = BuildSparseMipArraysForLoadBalancing(
+          problem, compact_failures)
+    else:
+      model_arrays = mip_arrays.MPModelProtoToMipArrays(
+          BuildMipForLoadBalancing(problem, compact_failures))
+  stats.AddModelSize(model_arrays)
+  with stats.Time('statistics'):
+    stats.fields['statistics'] = dict(
+        _ModelStatistics(model_arrays, problem, sparse, compact_failures),
+        **LoadBalancingStatistics(problem))
+  logging.info('# vars = %d, # cons = %d, # nz = %d',
+               len(model_arrays.var_name), len(model_arrays.con_name),
+               len(model_arrays.col_index))
+  if solve_options:
+    with stats.Time('to_proto'):
+      model_proto = mip_arrays.MipArraysToMPModelProto(model_arrays, name)
+    with stats.Time('solve'):
+      stats.fields['solve'] = solve_lib.SolveModel(model_proto, solve_options)
+  if output_formats:
+    output_lib.WriteModel(prefix, model_arrays, output_formats, name=name,
+                          mps_buffer_size=mps_buffer_size, stats=stats,
+                          compression=compression)
+  if instance_cache:
+    with stats.Time('cache'):
+      instance_cache.Store(key, prefix, suffixes,
+                           stats.fields['statistics'])
+  return stats.ToDict()
 
 
 def BuildRandomizedModels(output: str, random_seed: int, num_models: int,
-                          params: params_pb2.LoadBalancingParameters):
-  for i in range(num_models):
-    filename = output + '_%d.mps.gz' % i
-    logging.info('Building model %s', filename)
-    problem = GenerateLoadBalancingProblem(params, random_seed + i)
-    model = BuildMipForLoadBalancing(problem)
-    model.name = 'LoadBalancing_%d' % i
-    with gzip.open(filename, 'wt') as mps_file:
-      mps_file.write(MPModelProtoToMPS(model))
+                          params: params_pb2.LoadBalancingParameters,
+                          mps_buffer_size: int = mps_writer.DEFAULT_BUFFER_SIZE,
+                          jobs: int = 1,
+                          sparse: bool = False,
+                          sampler: str = 'legacy',
+                          compact_failures: bool = False,
+                          output_formats: List[str] = ('mps',),
+                          cache_dir: str = '',
+                          cache_max_bytes: int = cache_lib.DEFAULT_MAX_BYTES,
+                          stats_file: str = '',
+                          compression: compression_lib.Compression = (
+                              compression_lib.DEFAULT),
+                          solve_options: Optional[
+                              solve_lib.SolveOptions] = None,
+                          skip_existing: bool = False,
+                          write_index: bool = True,
+                          shard_max_bytes: int = 0,
+                          max_attempts: int = 0) -> List[int]:
+  '''Builds num_models models and returns the indices of those that failed.
+
+  With write_index, the statistics of the models are added to the index of
+  output, see dataset_index. With shard_max_bytes, the files of the models
+  are packed into shards of that size (see shards.ShardedOutput), and
+  skip_existing skips the models already in them.
+  '''
+  sharded = None
+  indices = None
+  if shard_max_bytes and output_formats:
+    sharded = shards.ShardedOutput(
+        output,
+        [output_lib.OutputSuffix(f, compression) for f in output_formats],
+        shard_max_bytes)
+    if skip_existing:
+      complete = set(sharded.Complete(range(num_models)))
+      logging.info('Skipping %d models already in the shards', len(complete))
+      indices = [i for i in range(num_models) if i not in complete]
+  build_fn = functools.partial(
+      BuildRandomizedModel, sharded.staging_output if sharded else output,
+      random_seed, params=params, mps_buffer_size=mps_buffer_size,
+      sparse=sparse, sampler=sampler, compact_failures=compact_failures,
+      output_formats=output_formats, cache_dir=cache_dir,
+      compression=compression, solve_options=solve_options,
+      skip_existing=skip_existing and not sharded, max_attempts=max_attempts)
+  summary = instrumentation.RunSummary(
+      stats_file, dataset_index.IndexWriter(output)
+      if write_index and output_formats else None)
+
+  def OnResult(record: Dict[str, Any]):
+    summary.Add(sharded.Add(record) if sharded else record)
+
+  try:
+    failures = parallel.RunInstances(
+        build_fn, num_models, jobs,
+        EstimateModelSize(params, sparse, compact_failures), OnResult,
+        indices)
+  finally:
+    if sharded:
+      sharded.Close()
+  summary.Finish(len(failures))
+  if cache_dir:
+    cache_lib.InstanceCache(cache_dir, cache_max_bytes).Evict()
+  return failures
+
+
+def BuildSweep(output: str, random_seed: int, num_models: int,
+               params: params_pb2.LoadBalancingParameters,
+               points: List[Dict[str, Any]],
+               mps_buffer_size: int = mps_writer.DEFAULT_BUFFER_SIZE,
+               jobs: int = 1,
+               sparse: bool = False,
+               sampler: str = 'legacy',
+               compact_failures: bool = False,
+               output_formats: List[str] = ('mps',),
+               cache_dir: str = '',
+               cache_max_bytes: int = cache_lib.DEFAULT_MAX_BYTES,
+               stats_file: str = '',
+               compression: compression_lib.Compression = (
+                   compression_lib.DEFAULT),
+               solve_options: Optional[solve_lib.SolveOptions] = None,
+               skip_existing: bool = False,
+               write_index: bool = True,
+               max_attempts: int = 0) -> List[str]:
+  '''Builds the models of a sweep (see common/sweep.py) not built yet.
+
+  points are the overrides of params of each point of the sweep. With
+  write_index, the statistics of the models of all points are added to the
+  index of output. Returns the prefixes of the models that failed.
+  '''
+  build_fn = functools.partial(BuildRandomizedModel,
+                               mps_buffer_size=mps_buffer_size,
+                               sparse=sparse, sampler=sampler,
+                               compact_failures=compact_failures,
+                               output_formats=output_formats,
+                               cache_dir=cache_dir, compression=compression,
+                               solve_options=solve_options,
+                               skip_existing=skip_existing,
+                               max_attempts=max_attempts)
+  options = dict(sparse=sparse, sampler=sampler,
+                 compact_failures=compact_failures,
+                 output_formats=sorted(output_formats),
+                 compression=compression._asdict(), max_attempts=max_attempts)
+  suffixes = [output_lib.OutputSuffix(f, compression) for f in output_formats]
+  summary = instrumentation.RunSummary(
+      stats_file, dataset_index.IndexWriter(output)
+      if write_index and output_formats else None)
+  failures = sweep_lib.RunSweep(
+      build_fn, params, points, output, random_seed, num_models, __file__,
+      options, suffixes,
+      functools.partial(EstimateModelSize, sparse=sparse,
+                        compact_failures=compact_failures), jobs, summary.Add)
+  summary.Finish(len(failures))
+  if cache_dir:
+    cache_lib.InstanceCache(cache_dir, cache_max_bytes).Evict()
+  return failures
+
+
+def _BuildSerializedInstance(
+    random_seed: int, index: int,
+    params: params_pb2.LoadBalancingParameters,
+    sparse: bool = False,
+    sampler: str = 'legacy',
+    compact_failures: bool = False,
+    solve_options: Optional[solve_lib.SolveOptions] = None,
+    max_attempts: int = 0
+) -> Tuple[bytes, bytes, Dict[str, Any]]:
+  '''Builds one instance, serialized to be sent back from a worker.'''
+  name = 'LoadBalancing_%d' % index
+  stats = instrumentation.InstanceStats(generator='load_balancing', name=name,
+                                        seed=random_seed + index, sparse=sparse,
+                                        sampler=sampler,
+                                        compact_failures=compact_failures)
+  with stats.Time('sample'):
+    problem = _SampleCounted(params, random_seed, sampler, index,
+                             max_attempts, stats)
+  with stats.Time('build'):
+    if sparse:
+      model_arrays = BuildSparseMipArraysForLoadBalancing(
+          problem, compact_failures)
+    else:
+      model_arrays = mip_arrays.MPModelProtoToMipArrays(
+          BuildMipForLoadBalancing(problem, compact_failures))
+  stats.AddModelSize(model_arrays)
+  with stats.Time('statistics'):
+    stats.fields['statistics'] = dict(
+        _ModelStatistics(model_arrays, problem, sparse, compact_failures),
+        **LoadBalancingStatistics(problem))
+  with stats.Time('serialize'):
+    problem_bytes = problem.SerializeToString()
+    model_bytes = mip_arrays.MipArraysToBytes(model_arrays, name)
+  if solve_options:
+    with stats.Time('solve'):
+      stats.fields['solve'] = solve_lib.SolveModel(
+          linear_solver_pb2.MPModelProto.FromString(model_bytes),
+          solve_options)
+  return problem_bytes, model_bytes, stats.ToDict()
+
+
+def IterInstances(
+    params: params_pb2.LoadBalancingParameters,
+    random_seed: int = 0,
+    num_models: Optional[int] = None,
+    jobs: int = 1,
+    prefetch: int = 0,
+    sparse: bool = False,
+    sampler: str = 'legacy',
+    compact_failures: bool = False,
+    solve_options: Optional[solve_lib.SolveOptions] = None,
+    max_attempts: int = 0
+) -> Iterator[Tuple[params_pb2.LoadBalancingProblem,
+                    linear_solver_pb2.MPModelProto, Dict[str, Any]]]:
+  '''Yields (problem, model, metadata) for num_models instances, or forever.
+
+  The i-th instance is the one BuildRandomizedModels writes to <out>_i, and
+  metadata holds its name, seed and generation statistics. Nothing is
+  written to disk. The instances are built on jobs background processes (in
+  the calling process if 0), at most prefetch of them ahead of the consumer;
+  see parallel.IterResults. With solve_options, each model is also solved by
+  the process that built it, and the result is in metadata['solve']. With
+  max_attempts, the workloads that cannot survive the loss of a worker are
+  resampled or repaired, see SampleResilientProblem.
+  '''
+  build_fn = functools.partial(_BuildSerializedInstance, random_seed,
+                               params=params, sparse=sparse, sampler=sampler,
+                               compact_failures=compact_failures,
+                               solve_options=solve_options,
+                               max_attempts=max_attempts)
+  for problem_bytes, model_bytes, metadata in parallel.IterResults(
+      build_fn, num_models, jobs, prefetch):
+    yield (params_pb2.LoadBalancingProblem.FromString(problem_bytes),
+           linear_solver_pb2.MPModelProto.FromString(model_bytes), metadata)
 
 
 def main(_):
+  solve_options = None
+  if FLAGS.solver:
+    solve_options = solve_lib.SolveOptions(FLAGS.solver,
+                                           FLAGS.solve_time_limit,
+                                           FLAGS.solver_parameters,
+                                           FLAGS.solver_threads)
+    solve_lib.CheckSolveOptions(solve_options)
+  output_lib.CheckOutputFormats(FLAGS.output_formats,
+                                allow_empty=bool(solve_options))
+  compression = compression_lib.Compression(FLAGS.compression,
+                                            FLAGS.compression_level,
+                                            FLAGS.compression_threads)
+  compression_lib.CheckCompression(compression)
   params = params_pb2.LoadBalancingParameters()
   if FLAGS.params_file:
     with open(FLAGS.params_file, 'r') as params_file:
       params_str = params_file.read()
       text_format.Merge(params_str, params)
   text_format.Merge(FLAGS.params, params)
-  BuildRandomizedModels(FLAGS.out, FLAGS.seed, FLAGS.num, params)
+  if FLAGS.sweep_file:
+    if FLAGS.shard_max_bytes:
+      raise ValueError('Sweeps are written as separate files, without '
+                       '--shard_max_bytes')
+    failures = BuildSweep(FLAGS.out, FLAGS.seed, FLAGS.num, params,
+                          sweep_lib.LoadSweep(FLAGS.sweep_file),
+                          FLAGS.mps_buffer_size, FLAGS.jobs, FLAGS.sparse,
+                          FLAGS.sampler, FLAGS.compact_failures,
+                          FLAGS.output_formats, FLAGS.cache_dir,
+                          FLAGS.cache_max_bytes, FLAGS.stats_file, compression,
+                          solve_options, FLAGS.skip_existing,
+                          FLAGS.write_index, FLAGS.max_sampling_attempts)
+    if failures:
+      raise RuntimeError('Failed to build %d models: %s' %
+                         (len(failures), failures))
+    return
+  failures = BuildRandomizedModels(FLAGS.out, FLAGS.seed, FLAGS.num, params,
+                                   FLAGS.mps_buffer_size, FLAGS.jobs,
+                                   FLAGS.sparse, FLAGS.sampler,
+                                   FLAGS.compact_failures,
+                                   FLAGS.output_formats, FLAGS.cache_dir,
+                                   FLAGS.cache_max_bytes, FLAGS.stats_file,
+                                   compression, solve_options,
+                                   FLAGS.skip_existing, FLAGS.write_index,
+                                   FLAGS.shard_max_bytes,
+                                   FLAGS.max_sampling_attempts)
+  if failures:
+    raise RuntimeError('Failed to build %d of %d models: %s' %
+                       (len(failures), FLAGS.num, failures))
 
 
 if __name__ == '__main__':
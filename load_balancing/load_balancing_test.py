@@ -0,0 +1,517 @@
+import io
+import json
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+from unittest import mock
+
+import numpy as np
+
+from absl.testing import absltest
+from google.protobuf import text_format
+from ortools.linear_solver import linear_solver_pb2
+from ortools.linear_solver import pywraplp
+
+import load_balancing
+import params_pb2
+
+from common import mip_arrays
+from common import mps_writer
+from common import output
+
+_PARAMS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'params.text_pb2')
+
+# A few workers of two groups, and loads that may exceed the capacity of a
+# worker, where the big-M of the dense model is the load.
+_SMALL_PARAMS = '''
+  worker_parameter {
+    i_min: 4
+    i_max: 6
+    capacity_min: 1.0
+    capacity_max: 3.0
+    cost: 1
+  }
+  worker_parameter {
+    i_min: 3
+    i_max: 5
+    capacity_min: 2.0
+    capacity_max: 4.0
+    cost: 3
+  }
+  workload_parameter {
+    i_min: 3
+    i_max: 5
+    load_min: 1.0
+    load_max: 4.0
+    allowed_worker_probability: [0.6, 0.3]
+  }
+  workload_parameter {
+    i_min: 1
+    i_max: 3
+    load_min: 2.0
+    load_max: 5.0
+    allowed_worker_probability: [0.2, 0.7]
+  }
+'''
+
+
+def _SmallParams() -> params_pb2.LoadBalancingParameters:
+  params = params_pb2.LoadBalancingParameters()
+  text_format.Merge(_SMALL_PARAMS, params)
+  return params
+
+
+def _ExampleParams() -> params_pb2.LoadBalancingParameters:
+  params = params_pb2.LoadBalancingParameters()
+  with open(_PARAMS_FILE) as f:
+    text_format.Merge(f.read(), params)
+  return params
+
+
+def _LegacyGenerateLoadBalancingProblem(
+    params: params_pb2.LoadBalancingParameters,
+    rng: random.Random) -> params_pb2.LoadBalancingProblem:
+  '''The sampler of earlier versions, drawing from rng.'''
+  problem = params_pb2.LoadBalancingProblem()
+
+  # The index of the WorkerParameters that generated this worker.
+  worker_group = []
+
+  for (group, worker_param) in enumerate(params.worker_parameter):
+    num_workers = rng.randint(worker_param.i_min, worker_param.i_max)
+    for _ in range(num_workers):
+      worker_group.append(group)
+      worker = problem.worker.add()
+      worker.capacity = rng.uniform(worker_param.capacity_min,
+                                    worker_param.capacity_max)
+      worker.cost = worker_param.cost
+
+  for workload_param in params.workload_parameter:
+    num_workloads = rng.randint(workload_param.i_min, workload_param.i_max)
+    for _ in range(num_workloads):
+      workload = problem.workload.add()
+      workload.load = rng.uniform(workload_param.load_min,
+                                  workload_param.load_max)
+      for worker_index in range(len(problem.worker)):
+        if rng.random() < workload_param.allowed_worker_probability[
+            worker_group[worker_index]]:
+          workload.allowed_workers.append(worker_index)
+
+  return problem
+
+
+def _SmallProblems(num: int) -> List[params_pb2.LoadBalancingProblem]:
+  '''Problems whose workloads all have at least 2 allowed workers.'''
+  return [
+      load_balancing.GenerateLoadBalancingProblem(
+          _SmallParams(), 0, sampler, index, max_attempts=3)
+      for sampler in ('legacy', 'fast') for index in range(num)
+  ]
+
+
+def _DenseArrays(problem: params_pb2.LoadBalancingProblem,
+                 compact_failures: bool) -> mip_arrays.MipArrays:
+  return mip_arrays.MPModelProtoToMipArrays(
+      load_balancing.BuildMipForLoadBalancing(problem, compact_failures))
+
+
+def _SatisfiedRows(arrays: mip_arrays.MipArrays, x: np.ndarray,
+                   tolerance: float = 1e-9) -> Dict[str, bool]:
+  '''Whether each row of arrays, by name, holds at the point x.'''
+  num_cons = len(arrays.con_name)
+  row = np.repeat(np.arange(num_cons), np.diff(arrays.row_start))
+  activity = np.bincount(row, weights=arrays.coefficient * x[arrays.col_index],
+                         minlength=num_cons)
+  satisfied = ((activity >= arrays.con_lower_bound - tolerance) &
+               (activity <= arrays.con_upper_bound + tolerance))
+  return dict(zip(arrays.con_name, satisfied.tolist()))
+
+
+def _Solve(
+    model_proto: linear_solver_pb2.MPModelProto
+) -> Tuple[int, Optional[float], Dict[str, float]]:
+  '''Solves model_proto with SCIP: status, objective and values by name.'''
+  solver = pywraplp.Solver.CreateSolver('SCIP')
+  assert not solver.LoadModelFromProto(model_proto)
+  status = solver.Solve()
+  if status != pywraplp.Solver.OPTIMAL:
+    return status, None, {}
+  # The solver does not keep the names of the variables.
+  return status, solver.Objective().Value(), {
+      v.name: solver_var.solution_value()
+      for v, solver_var in zip(model_proto.variable, solver.variables())
+  }
+
+
+def _WithDefaultsSet(
+    model_proto: linear_solver_pb2.MPModelProto
+) -> linear_solver_pb2.MPModelProto:
+  '''A copy of model_proto with every scalar variable and constraint field set.
+
+  Two models are equal in meaning when these copies are equal, whichever
+  fields holding their default values were set.
+  '''
+  model_proto = linear_solver_pb2.MPModelProto.FromString(
+      model_proto.SerializeToString())
+  for messages in (model_proto.variable, model_proto.constraint):
+    for message in messages:
+      for field in message.DESCRIPTOR.fields:
+        if not field.is_repeated:
+          setattr(message, field.name, getattr(message, field.name))
+  return model_proto
+
+
+class DenseModelTest(absltest.TestCase):
+
+  def testPbHasTheSameValuesAsTheModel(self):
+    directory = self.create_tempdir().full_path
+    for problem in _SmallProblems(2):
+      for compact_failures in (False, True):
+        model_proto = load_balancing.BuildMipForLoadBalancing(
+            problem, compact_failures)
+        model_proto.name = 'dense'
+        prefix = os.path.join(directory, 'model')
+        output.WriteModel(prefix, mip_arrays.MPModelProtoToMipArrays(
+            model_proto), ['pb'], name='dense')
+        with open(prefix + '.pb', 'rb') as f:
+          written = linear_solver_pb2.MPModelProto.FromString(f.read())
+        self.assertEqual(_WithDefaultsSet(written),
+                         _WithDefaultsSet(model_proto))
+        # The reserved capacities are continuous and their is_integer is not
+        # set in model_proto, it is in the arrays' encoding.
+        self.assertFalse(model_proto.variable[0].HasField('is_integer'))
+        self.assertTrue(written.variable[0].HasField('is_integer'))
+
+
+class SparseFormulationTest(absltest.TestCase):
+
+  def testSameRowsAsDense(self):
+    rng = np.random.default_rng(0)
+    for problem in _SmallProblems(5):
+      for compact_failures in (False, True):
+        dense = _DenseArrays(problem, compact_failures)
+        sparse = load_balancing.BuildSparseMipArraysForLoadBalancing(
+            problem, compact_failures)
+        dense_index = {name: i for i, name in enumerate(dense.var_name)}
+        sparse_vars = np.array([dense_index[name] for name in sparse.var_name])
+        self.assertContainsSubset(sparse.con_name, dense.con_name)
+        # The variables left out are those the dense model fixes to 0.
+        left_out = np.setdiff1d(np.arange(len(dense.var_name)), sparse_vars)
+        self.assertTrue(np.all(dense.var_upper_bound[left_out] == 0.0))
+        np.testing.assert_array_equal(
+            sparse.var_upper_bound, dense.var_upper_bound[sparse_vars])
+        np.testing.assert_array_equal(sparse.objective,
+                                      dense.objective[sparse_vars])
+
+        # Points in the bounds of the variables, some at the bounds, satisfy
+        # the same rows of both models. Dense rows of pairs that are not
+        # allowed and of unused workers always hold.
+        for _ in range(20):
+          x = dense.var_upper_bound * rng.random(len(dense.var_name))
+          x[rng.random(len(x)) < 0.3] = 0.0
+          at_bound = rng.random(len(x)) < 0.2
+          x[at_bound] = dense.var_upper_bound[at_bound]
+          x[dense.is_integer] = rng.integers(0, 2, dense.is_integer.sum())
+          if compact_failures:
+            for s in range(len(problem.workload)):
+              x[dense_index['total_reserved_capacity_%d' % s]] = sum(
+                  x[dense_index['reserved_capacity_%d_%d' % (s, t)]]
+                  for t in set(problem.workload[s].allowed_workers))
+          dense_rows = _SatisfiedRows(dense, x)
+          sparse_rows = _SatisfiedRows(sparse, x[sparse_vars])
+          for name, satisfied in dense_rows.items():
+            self.assertEqual(sparse_rows.get(name, True), satisfied, name)
+
+  def testBigMIsCapacity(self):
+    problem = _SmallProblems(1)[0]
+    sparse = load_balancing.BuildSparseMipArraysForLoadBalancing(problem)
+    load, capacity, _, _, allowed_worker = (
+        load_balancing.LoadBalancingToArrays(problem))
+    # The worker_used rows come first, with 2 terms each.
+    rows = sparse.coefficient[:2 * len(allowed_worker)].reshape(-1, 2)
+    np.testing.assert_array_equal(rows[:, 0], -1.0)
+    np.testing.assert_array_equal(rows[:, 1], capacity[allowed_worker])
+    # The instance has loads larger than a worker's capacity, whose dense
+    # big-M is the load.
+    self.assertGreater(load.max(), capacity.min())
+
+  def testSameOptimumAsDense(self):
+    num_optimal = 0
+    for problem in _SmallProblems(3):
+      for compact_failures in (False, True):
+        dense_proto = load_balancing.BuildMipForLoadBalancing(
+            problem, compact_failures)
+        sparse = load_balancing.BuildSparseMipArraysForLoadBalancing(
+            problem, compact_failures)
+        status, objective, values = _Solve(dense_proto)
+        sparse_status, sparse_objective, _ = _Solve(
+            mip_arrays.MipArraysToMPModelProto(sparse))
+        self.assertEqual(sparse_status, status)
+        if status != pywraplp.Solver.OPTIMAL:
+          continue
+        num_optimal += 1
+        self.assertAlmostEqual(sparse_objective, objective, places=6)
+        # The dense optimum is a solution of the sparse model.
+        x = np.array([values[name] for name in sparse.var_name])
+        self.assertTrue(np.all(x >= sparse.var_lower_bound - 1e-6))
+        self.assertTrue(np.all(x <= sparse.var_upper_bound + 1e-6))
+        self.assertTrue(all(_SatisfiedRows(sparse, x, 1e-6).values()))
+    self.assertGreater(num_optimal, 0)
+
+
+class CompactFailuresTest(absltest.TestCase):
+
+  def _FailureNnz(self, arrays: mip_arrays.MipArrays, s: int) -> int:
+    '''The non-zeros of the failure rows of workload s, and its total row.'''
+    row_length = np.diff(arrays.row_start)
+    return sum(
+        int(length) for name, length in zip(arrays.con_name, row_length)
+        if name.startswith('workload_ct_%d_failure_' % s) or
+        name == 'total_reserved_capacity_ct_%d' % s)
+
+  def testNonZerosAreLinear(self):
+    problem = _Problem([1.0] * 10, [(1.0, list(range(k))) for k in
+                                    (2, 3, 6, 10)])
+    for build in (_DenseArrays,
+                  load_balancing.BuildSparseMipArraysForLoadBalancing):
+      full = build(problem, False)
+      compact = build(problem, True)
+      for s, workload in enumerate(problem.workload):
+        k = len(workload.allowed_workers)
+        self.assertEqual(self._FailureNnz(full, s), k * (k - 1))
+        self.assertEqual(self._FailureNnz(compact, s), 3 * k + 1)
+      # The other rows are the same.
+      self.assertEqual(
+          len(full.col_index) - len(compact.col_index),
+          sum(k * (k - 1) - (3 * k + 1) for k in (2, 3, 6, 10)))
+      self.assertLen(compact.var_name, len(full.var_name) + 4)
+
+  def testSmallerModelsOnExample(self):
+    problem = load_balancing.GenerateLoadBalancingProblem(_ExampleParams(), 0)
+    sizes = {}
+    for compact_failures in (False, True):
+      arrays = load_balancing.BuildSparseMipArraysForLoadBalancing(
+          problem, compact_failures)
+      out = io.StringIO()
+      mps_writer.WriteMps(out, arrays)
+      sizes[compact_failures] = (len(arrays.col_index), len(out.getvalue()))
+      # The estimate is the expected size.
+      estimate = load_balancing.EstimateModelSize(_ExampleParams(), True,
+                                                  compact_failures)
+      self.assertAlmostEqual(len(arrays.col_index), estimate,
+                             delta=0.05 * estimate)
+    self.assertEqual(sizes[False][0], 186407)
+    self.assertEqual(sizes[True][0], 19602)
+    # 10.9 MB and 2.1 MB of MPS text.
+    self.assertLess(sizes[True][1], sizes[False][1] / 5)
+
+  def testSameOptimumAsFullFormulation(self):
+    num_optimal = 0
+    for problem in _SmallProblems(3):
+      for build in (load_balancing.BuildMipForLoadBalancing,
+                    lambda *args: mip_arrays.MipArraysToMPModelProto(
+                        load_balancing.BuildSparseMipArraysForLoadBalancing(
+                            *args))):
+        status, objective, _ = _Solve(build(problem, False))
+        compact_status, compact_objective, values = _Solve(
+            build(problem, True))
+        self.assertEqual(compact_status, status)
+        if status != pywraplp.Solver.OPTIMAL:
+          continue
+        num_optimal += 1
+        self.assertAlmostEqual(compact_objective, objective, places=6)
+        # The totals are fixed by their equalities.
+        for s, workload in enumerate(problem.workload):
+          self.assertAlmostEqual(
+              values['total_reserved_capacity_%d' % s],
+              sum(values['reserved_capacity_%d_%d' % (s, t)]
+                  for t in set(workload.allowed_workers)), places=6)
+    self.assertGreater(num_optimal, 0)
+
+
+class SamplerTest(absltest.TestCase):
+
+  def testLegacySamplerIsUnchanged(self):
+    for params in (_ExampleParams(), _SmallParams()):
+      for seed in range(3):
+        for index in (0, 2):
+          problem = load_balancing.GenerateLoadBalancingProblem(
+              params, seed, 'legacy', index)
+          expected = _LegacyGenerateLoadBalancingProblem(
+              params, random.Random(seed + index))
+          self.assertEqual(problem, expected)
+          self.assertEqual(problem.SerializeToString(),
+                           expected.SerializeToString())
+
+  def testFastSamplerIsReproducible(self):
+    params = _ExampleParams()
+    problem = load_balancing.GenerateLoadBalancingProblem(params, 1, 'fast', 4)
+    self.assertEqual(
+        load_balancing.GenerateLoadBalancingProblem(params, 1, 'fast', 4),
+        problem)
+    for seed, index in ((1, 5), (2, 4)):
+      self.assertNotEqual(
+          load_balancing.GenerateLoadBalancingProblem(params, seed, 'fast',
+                                                      index), problem)
+    # The fast sampler follows the distribution of params too.
+    self.assertLen(problem.worker, 1000)
+    self.assertLen(problem.workload, 60)
+    for workload in problem.workload[:50]:
+      self.assertBetween(workload.load, 1.0, 5.0)
+    allowed = [len(w.allowed_workers) for w in problem.workload]
+    # 0.1 * 500 + 0.01 * 500 allowed workers are expected per workload.
+    self.assertBetween(np.mean(allowed), 50, 60)
+
+  def testWorkloadArrays(self):
+    rng = np.random.default_rng(0)
+    param = _SmallParams().workload_parameter[0]
+    param.allowed_worker_probability[:] = [1.0, 0.0]
+    load, allowed_start, allowed_worker = (
+        load_balancing._SampleWorkloadArrays(rng, np.array([0, 3, 7]), 4,
+                                             param))
+    self.assertLen(load, 4)
+    np.testing.assert_array_equal(allowed_start, [0, 3, 6, 9, 12])
+    np.testing.assert_array_equal(allowed_worker, [0, 1, 2] * 4)
+    param.allowed_worker_probability[:] = [0.5, 0.02]
+    _, allowed_start, allowed_worker = (
+        load_balancing._SampleWorkloadArrays(rng, np.array([0, 300, 700]),
+                                             50, param))
+    for start, end in zip(allowed_start[:-1], allowed_start[1:]):
+      row = allowed_worker[start:end]
+      self.assertTrue(np.all(np.diff(row) > 0))
+      self.assertTrue(np.all((row >= 0) & (row < 700)))
+
+  def testGeometricGapsMatchBernoulliTrials(self):
+    size = 10000
+    probability = 0.01
+    self.assertLess(probability,
+                    load_balancing._GEOMETRIC_SAMPLING_PROBABILITY)
+
+    def Counts(rng: np.random.Generator) -> np.ndarray:
+      counts = []
+      for _ in range(2000):
+        positions = load_balancing._SampleBernoulliPositions(rng, size,
+                                                             probability)
+        self.assertTrue(np.all(np.diff(positions) > 0))
+        self.assertTrue(np.all((positions >= 0) & (positions < size)))
+        counts.append(len(positions))
+      return np.array(counts)
+
+    geometric = Counts(np.random.default_rng(0))
+    with mock.patch.object(load_balancing, '_GEOMETRIC_SAMPLING_PROBABILITY',
+                           0.0):
+      bernoulli = Counts(np.random.default_rng(0))
+    # Both counts are binomial(size, probability): mean 100, variance 99. The
+    # means of 2000 samples are within 0.23 and the variances within 3.2 of
+    # those, one standard deviation.
+    expected_variance = size * probability * (1 - probability)
+    for counts in (geometric, bernoulli):
+      self.assertAlmostEqual(counts.mean(), size * probability, delta=1.0)
+      self.assertAlmostEqual(counts.var(), expected_variance, delta=15.0)
+    self.assertAlmostEqual(geometric.mean(), bernoulli.mean(), delta=1.0)
+    self.assertAlmostEqual(geometric.var(), bernoulli.var(), delta=20.0)
+
+
+def _Problem(capacity: List[float],
+             workloads: List[Tuple[float, List[int]]]
+             ) -> params_pb2.LoadBalancingProblem:
+  '''A problem of workers of capacity, and workloads (load, allowed).'''
+  problem = params_pb2.LoadBalancingProblem()
+  for c in capacity:
+    problem.worker.add(capacity=c, cost=1)
+  for load, allowed_workers in workloads:
+    problem.workload.add(load=load, allowed_workers=allowed_workers)
+  return problem
+
+
+def _SparseParams() -> params_pb2.LoadBalancingParameters:
+  '''Small params where many workloads have fewer than 2 allowed workers.'''
+  params = _SmallParams()
+  params.workload_parameter[0].i_min = 20
+  params.workload_parameter[0].i_max = 20
+  params.workload_parameter[0].allowed_worker_probability[:] = [0.15, 0.1]
+  return params
+
+
+class ResilienceTest(absltest.TestCase):
+
+  def testViolations(self):
+    problem = _Problem([1.0, 2.0, 3.0], [
+        (2.5, [1, 2]),  # 2 + 3 - 3 < 2.5.
+        (1.0, [0]),  # A single allowed worker.
+        (3.0, [0, 1, 2]),  # 1 + 2 + 3 - 3 >= 3.
+        (1.5, []),
+        (2.0, [2, 1, 2]),  # Duplicates count once: 2 + 3 - 3 >= 2.
+    ])
+    np.testing.assert_array_equal(
+        load_balancing.ResilienceViolations(problem), [0, 1, 3])
+
+  def testRepair(self):
+    problem = _Problem([1.0, 2.0, 3.0],
+                       [(2.5, [1, 2]), (1.0, [0]), (3.0, [0, 1, 2]),
+                        (1.5, [])])
+    capacity = np.array([1.0, 2.0, 3.0])
+    by_capacity = np.array([2, 1, 0])
+    for s in load_balancing.ResilienceViolations(problem).tolist():
+      load_balancing._RepairWorkload(problem, s, capacity, by_capacity)
+    self.assertEmpty(load_balancing.ResilienceViolations(problem))
+    # The fewest workers are added, largest capacity first.
+    self.assertEqual([list(w.allowed_workers) for w in problem.workload],
+                     [[0, 1, 2], [0, 2], [0, 1, 2], [1, 2]])
+    problem = _Problem([1.0, 2.0, 3.0], [(4.0, [0])])
+    with self.assertRaisesRegex(ValueError, 'No set of workers'):
+      load_balancing._RepairWorkload(problem, 0, capacity, by_capacity)
+
+  def testSampleResilientProblem(self):
+    params = _SparseParams()
+    for sampler in ('legacy', 'fast'):
+      first = load_balancing.GenerateLoadBalancingProblem(
+          params, 3, sampler, 1)
+      violations = load_balancing.ResilienceViolations(first)
+      self.assertNotEmpty(violations)
+      for max_attempts in (1, 2, 5):
+        problem, counts = load_balancing.SampleResilientProblem(
+            params, 3, sampler, 1, max_attempts)
+        self.assertEqual(
+            load_balancing.SampleResilientProblem(params, 3, sampler, 1,
+                                                  max_attempts),
+            (problem, counts))
+        self.assertEmpty(load_balancing.ResilienceViolations(problem))
+        self.assertEqual(counts['resampled_workloads'] > 0, max_attempts > 1)
+        self.assertLessEqual(counts['repaired_workloads'], len(violations))
+        # Only the workloads that failed are changed.
+        self.assertEqual(problem.worker, first.worker)
+        for s, (workload, first_workload) in enumerate(
+            zip(problem.workload, first.workload)):
+          if s not in violations:
+            self.assertEqual(workload, first_workload)
+      # With a single sample, every failing workload is repaired.
+      self.assertEqual(
+          load_balancing.SampleResilientProblem(params, 3, sampler, 1)[1],
+          {'resampled_workloads': 0, 'repaired_workloads': len(violations)})
+
+  def testCountersReachRecords(self):
+    params = _SparseParams()
+    output = os.path.join(self.create_tempdir().full_path, 'lb')
+    stats_file = output + '_stats.jsonl'
+    self.assertEqual(
+        load_balancing.BuildRandomizedModels(
+            output, 0, 3, params, sparse=True, sampler='fast',
+            stats_file=stats_file, write_index=False, max_attempts=3), [])
+    with open(stats_file) as f:
+      lines = [json.loads(line) for line in f]
+    records, summary = lines[:-1], lines[-1]['summary']
+    self.assertLen(records, 3)
+    for record in records:
+      _, counts = load_balancing.SampleResilientProblem(
+          params, 0, 'fast', int(record['output'].rsplit('_', 1)[1]), 3)
+      for key, value in counts.items():
+        self.assertEqual(record[key], value, key)
+    for key in ('resampled_workloads', 'repaired_workloads'):
+      self.assertEqual(summary[key], sum(record[key] for record in records))
+    self.assertGreater(summary['resampled_workloads'], 0)
+
+
+if __name__ == '__main__':
+  absltest.main()